@@ -42,10 +42,12 @@ import math
 import io
 import random
 import json
+import contextlib
+import threading
+import queue
 
 # Multiprocessing
-from torch.multiprocessing import Process
-import multiprocessing
+import concurrent.futures
 
 import numpy as np
 
@@ -61,11 +63,34 @@ import tdfTools as tdf
 import mlJob as mlJob
 import jobShow as JobShow
 
-torch.manual_seed(1)
+# Each partition is seeded with this plus its own partition number.
+# The control process uses a seed below that, which no partition uses.
+# See MLEngine_SeedPartition.
+BASE_RANDOM_SEED = 1
+CONTROL_PROCESS_RANDOM_SEED = BASE_RANDOM_SEED - 1
 
 DEFAULT_PARTITION_SIZE = 20 * (1024 * 1024)
+
+# Set this environment variable to a number of bytes to use a different partition size.
+# A partition is a range of the TDF file that one worker call reads. Smaller partitions
+# mean more calls to the worker, while larger ones mean more memory for each call.
+PARTITION_SIZE_ENV_VAR = "ML_PARTITION_SIZE"
+
+# The number of parsed timelines the background reader may hold while training.
+DEFAULT_PREFETCH_DEPTH = 2
+
+# The number of megabytes of parsed timelines a training worker keeps between epochs.
+DEFAULT_DECODED_TIMELINE_CACHE_MB = 256
 USE_GPU = False
 
+# Run the forward pass in bfloat16 with autocast. The weights, gradients and loss stay in float32.
+# A job can also turn this on with the MixedPrecision training option.
+USE_MIXED_PRECISION = False
+
+# Compile the network with torch.compile in each worker process. This needs Pytorch 2.0
+# or later, and we fall back to the normal eager network if it is not available.
+USE_TORCH_COMPILE = False
+
 ###############################
 # Repairing Matrices
 # Once a number gets really small, just set it to 0. Otherwise, it will shrink and shrink
@@ -76,6 +101,11 @@ MAX_VALID_RESULT_VALUE = 1.0E8
 MIN_VALID_MATRIX_VALUE = 1.0E-8
 MAX_VALID_MATRIX_VALUE = 1.0E8
 LARGE_REASONABLE_MATRIX_VALUE = 1.0E8
+# When we only check for NaN values, and do not repair them, a network that has
+# passed several checks in a row is checked less often. After N healthy checks in
+# a row, skip the next min(N, MAX_SKIPPED_VALUE_CHECKS) checks. Any failure goes back
+# to checking every time. Debug jobs are always checked every time.
+MAX_SKIPPED_VALUE_CHECKS = 31
 
 # We have a different checksum for saving or validating.
 # The save checksum makes sure that we save/restore the neural net correctly,
@@ -111,8 +141,81 @@ RECURRENT_STATE_LINEAR_UNIT_NAME    = "ReccurentStateLinearUnit"
 LSTM_SAVED_STATE_NAME               = "LSTMState"
 LSTM_LINEAR_UNIT_SAVED_STATE_NAME   = "LSTMLinearUnit"
 
-# Debugging only
-g_ChildProcessPipe = None
+# The runtime job in a worker process. The worker pool initializer builds this once
+# from the serialized job, and then every partition updates this same object.
+g_WorkerJob = None
+
+# The neural network, loss function and optimizer in a training worker process.
+# These are built on the first partition and reused for every partition after that.
+g_WorkerTrainingState = None
+
+# The job properties that every partition needs, like the file name and the filter.
+# These do not change during a run, so a worker reads them from the job once.
+g_WorkerPartitionConfig = None
+
+# The neural network in a testing worker process. The weights do not change while
+# we test, so this is built and compiled on the first partition and reused after that.
+g_WorkerTestingState = None
+
+# The arrays for timelines that a training worker already parsed, so later epochs 
+# do not parse them again. See MLEngine_ReadTimelinesInBackground.
+g_WorkerTimelineCache = None
+
+# Scratch arrays for MLEngine_FullCheckLinearUnit, keyed by (number of values, dtype).
+# Every linear unit is checked after every training step, so this reuses the same
+# memory for the absolute values rather than allocating a new array each time.
+# The worker process is reused for later jobs, which may have different layer sizes,
+# so this is emptied whenever a job is loaded into or unloaded from the worker.
+g_CheckScratchArrays = {}
+
+# The worker pool that trains and tests one job at a time, in the control process.
+# This stays alive from one job to the next, so running a directory of jobs only 
+# starts the worker process, and imports torch in it, once. 
+# See MLEngine_GetSingleWorkerPool.
+g_SingleWorkerPool = None
+
+# The parsed list of input variable names for each input names string, and the
+# number of result classes for each result variable. Every network constructor 
+# needs these, and they never change for a given string, so a process only
+# computes each one once. See MLEngine_GetInputNameList.
+g_InputNameListCache = {}
+g_NumClassesCache = {}
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_SeedPartition]
+#
+# Seed all of the random number generators (Pytorch, numpy and Python) before a
+# worker processes one partition. Worker processes are reused for many partitions,
+# so this reseeds at the start of every partition, not once per worker.
+# Without this, each child process inherits the exact same random state from the 
+# parent, and every partition would shuffle its timelines in the same order and 
+# draw the same random numbers. Seeding with the partition number keeps runs 
+# repeatable, no matter which worker gets which partition, but gives each 
+# partition its own independent random sequence.
+################################################################################
+def MLEngine_SeedPartition(partitionNum):
+    MLEngine_SeedRandomGenerators(BASE_RANDOM_SEED + partitionNum)
+# End - MLEngine_SeedPartition
+
+
+
+
+################################################################################
+#
+# [MLEngine_SeedRandomGenerators]
+#
+################################################################################
+def MLEngine_SeedRandomGenerators(seed):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+# End - MLEngine_SeedRandomGenerators
+
 
 
 
@@ -129,10 +232,18 @@ def MLEngine_Init_GPU():
     if (USE_GPU):
         # The CUDA functions are non-deterministic (by design) which can affect RNN functions.
         # To avoid non-determinism 
-        # On CUDA 10.1, set environment variable CUDA_LAUNCH_BLOCKING=1. This may affect performance.
+        # On CUDA 10.1, set environment variable CUDA_LAUNCH_BLOCKING=1. This makes every
+        # kernel launch wait for the GPU, so only do it on the old CUDA versions that need it.
         # On CUDA 10.2 or later, set environment variable (note the leading colon symbol) 
         #   CUBLAS_WORKSPACE_CONFIG=:16:8 or CUBLAS_WORKSPACE_CONFIG=:4096:2.
-        os.environ["CUDA_LAUNCH_BLOCKING"] = "1"
+        cudaVersionStr = torch.version.cuda
+        if (cudaVersionStr is not None):
+            try:
+                cudaVersion = tuple(int(numStr) for numStr in cudaVersionStr.split(".")[:2])
+            except ValueError:
+                cudaVersion = None
+            if ((cudaVersion is not None) and (cudaVersion < (10, 2))):
+                os.environ["CUDA_LAUNCH_BLOCKING"] = "1"
         os.environ["CUBLAS_WORKSPACE_CONFIG"] = ":4096:2"
 
     os.environ["MLEngine_Init"] = "1"
@@ -141,20 +252,45 @@ def MLEngine_Init_GPU():
 
 
 
+
 ################################################################################
+#
+# [MLEngine_SetMatmulPrecision]
+#
+# Let float32 matrix multiplies use TF32 tensor cores on Ampere and later GPUs,
+# unless the job asks for full float32 precision so its runs are reproducible.
+# TF32 roughly doubles GEMM throughput for the linear units.
+# cudnn.benchmark is a separate job option, and is off unless the job asks for it.
+# It times the cuDNN algorithms for each new input shape and picks the fastest, 
+# but may not pick the same one every run.
+# These are settings for the whole process, and each job may want a different 
+# one, so this is called for every job and in every worker process, and is not
+# part of the one-time setup in MLEngine_Init_GPU.
 ################################################################################
-def ASSERT_ERROR(messageStr):
-    fKillProcessOnAsserts = True
-    fQuitButKeepRunningOnAsserts = False
+def MLEngine_SetMatmulPrecision(job):
+    if (not USE_GPU):
+        return
+
+    fAllowTF32 = job.GetAllowTF32()
+    torch.backends.cuda.matmul.allow_tf32 = fAllowTF32
+    torch.backends.cudnn.allow_tf32 = fAllowTF32
+    torch.backends.cudnn.benchmark = job.GetCudnnBenchmark()
+    if (hasattr(torch, "set_float32_matmul_precision")):
+        torch.set_float32_matmul_precision("high" if fAllowTF32 else "highest")
+# End - MLEngine_SetMatmulPrecision
+
+
+
 
+################################################################################
+################################################################################
+def ASSERT_ERROR(messageStr):
     print("ERROR! " + messageStr)
-    if (fKillProcessOnAsserts):
-        print("Exiting process...")
-        raise Exception()
-    elif (fQuitButKeepRunningOnAsserts):
-        if (g_ChildProcessPipe is not None):
-            MLEngine_ReturnResultsFromChildProcess(g_ChildProcessPipe, None, -1, -1, 0,
-                                                    True, -1, -1, E_ASSERT_ERROR, -1)
+
+    # If this is in a worker process, then the exception is passed back to the
+    # control process by the worker pool, and it is reported there as E_ASSERT_ERROR.
+    print("Exiting process...")
+    raise Exception(messageStr)
 # End - ASSERT_ERROR
 
 
@@ -178,23 +314,78 @@ def MLEngine_SaveLinearUnitToJob(linearUnit, job, name):
     if (fDebug):
         print("MLEngine_SaveLinearUnitToJob. name=" + name)
 
-    # Make private copies so we do not affect future backprop.
-    weightMatrix = linearUnit.weight.detach().numpy()
-    biasVector = linearUnit.bias.detach().numpy()
+    # These are detached, so we do not affect future backprop.
+    weightMatrix, biasVector = MLEngine_GetLinearUnitArrays(linearUnit)
 
     job.SetLinearUnitMatrices(name, weightMatrix, biasVector)
+
+    # Return the weights we saved, so the caller can checksum them without 
+    # reading the tensor again.
+    return weightMatrix
 # End - MLEngine_SaveLinearUnitToJob
 
 
 
 
 
+################################################################################
+#
+# [MLEngine_GetInputNameList]
+# [MLEngine_GetNumClassesForVariable]
+#
+# Cached versions of splitting the input names string, and of 
+# tdf.TDF_GetNumClassesForVariable. Callers must not change the returned list.
+################################################################################
+def MLEngine_GetInputNameList(inputNameListStr):
+    inputNameList = g_InputNameListCache.get(inputNameListStr)
+    if (inputNameList is None):
+        inputNameList = inputNameListStr.split(tdf.VARIABLE_LIST_SEPARATOR)
+        g_InputNameListCache[inputNameListStr] = inputNameList
+    return inputNameList
+# End - MLEngine_GetInputNameList
+
+def MLEngine_GetNumClassesForVariable(resultValueName):
+    numClasses = g_NumClassesCache.get(resultValueName)
+    if (numClasses is None):
+        numClasses = tdf.TDF_GetNumClassesForVariable(resultValueName)
+        g_NumClassesCache[resultValueName] = numClasses
+    return numClasses
+# End - MLEngine_GetNumClassesForVariable
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_MakeLinearUnit]
+#
+# Make a new nn.Linear. If the job already has saved matrices for it, then
+# RestoreNetState will overwrite every value, so skip the random initialization 
+# and just allocate the weight and bias.
+################################################################################
+def MLEngine_MakeLinearUnit(job, name, inputSize, outputSize):
+    if ((job.HasLinearUnitMatrices(name)) and (hasattr(torch.nn.utils, "skip_init"))):
+        return torch.nn.utils.skip_init(nn.Linear, inputSize, outputSize)
+
+    return nn.Linear(inputSize, outputSize)
+# End - MLEngine_MakeLinearUnit
+
+
+
+
+
 ################################################################################
 #
 # [MLEngine_ReadLinearUnitFromJob]
 #
+# Copy the matrices saved in the job into an existing linear unit.
+# This updates the existing weight and bias Parameters in place rather than making
+# a new nn.Linear, so anything that already refers to those Parameters, like
+# an optimizer or a compiled network, is still valid.
+# Returns True if the job had saved matrices for this linear unit.
 ################################################################################
-def MLEngine_ReadLinearUnitFromJob(job, name):
+def MLEngine_ReadLinearUnitFromJob(job, name, linearUnit):
     fDebug = False
     if (fDebug):
         print("MLEngine_ReadLinearUnitFromJob. name=" + name)
@@ -203,28 +394,60 @@ def MLEngine_ReadLinearUnitFromJob(job, name):
     if (not fFoundIt):
         if (fDebug):
             print("MLEngine_ReadLinearUnitFromJob. Error! Not found")
-        return None
+        return False
 
     # WARNING!!!!
     # Leave these as float32. Changing them to 64 will cause the checksum code to
     # compute different checksums for Linear Units when they are restored by this
     # routine compare to when they are initialized.
-    weightTensor = torch.tensor(weightMatrix, dtype=torch.float32)
-    biasTensor = torch.tensor(biasVector, dtype=torch.float32)
-    weightSize = weightTensor.size()
-    inputSize = weightSize[1]
-    outputSize = weightSize[0]
+    # The job returns numpy arrays, so wrap them with from_numpy rather than having 
+    # torch.tensor copy them element by element. ascontiguousarray only converts the
+    # array if it is not already contiguous float32.
+    weightTensor = torch.from_numpy(np.ascontiguousarray(weightMatrix, dtype=np.float32))
+    biasTensor = torch.from_numpy(np.ascontiguousarray(biasVector, dtype=np.float32))
+    if ((weightTensor.size() != linearUnit.weight.size()) 
+            or (biasTensor.size() != linearUnit.bias.size())):
+        ASSERT_ERROR("MLEngine_ReadLinearUnitFromJob. Saved matrix has the wrong size: " + name)
+
+    # If the linear unit is on the GPU, then copy from pinned memory without waiting
+    # for the copy to finish. This lets the copies of several layers overlap with
+    # parsing the next layer's matrices from the job. Anything that later reads the 
+    # weights runs on the same CUDA stream, so it runs after the copy is done.
+    fNonBlocking = linearUnit.weight.is_cuda
+    if (fNonBlocking):
+        weightTensor = weightTensor.pin_memory()
+        biasTensor = biasTensor.pin_memory()
 
-    linearUnit = nn.Linear(inputSize, outputSize)
-    linearUnit.weight = torch.nn.Parameter(weightTensor)
-    linearUnit.bias = torch.nn.Parameter(biasTensor)
+    with torch.no_grad():
+        linearUnit.weight.copy_(weightTensor, non_blocking=fNonBlocking)
+        linearUnit.bias.copy_(biasTensor, non_blocking=fNonBlocking)
 
-    return linearUnit
+    return True
 # End - MLEngine_ReadLinearUnitFromJob
 
 
 
 
+################################################################################
+#
+# [MLEngine_GetLinearUnitArrays]
+#
+# Return the weight matrix and bias vector of a linear unit as numpy arrays.
+# These are views that share storage with the tensors, not copies, so they
+# always see the latest values written by the optimizer. Callers that only
+# read the values should get them once and pass them to the check and
+# checksum routines below, rather than copying the tensors for each one.
+################################################################################
+def MLEngine_GetLinearUnitArrays(linearUnit):
+    weightMatrix = linearUnit.weight.detach().cpu().numpy()
+    biasVector = linearUnit.bias.detach().cpu().numpy()
+    return weightMatrix, biasVector
+# End - MLEngine_GetLinearUnitArrays
+
+
+
+
+
 ################################################################################
 #
 # [MLEngine_SimpleCheckArray]
@@ -235,20 +458,19 @@ def MLEngine_SimpleCheckArray(linearUnit, name):
     fValid = True
     fAbortOnError = False
 
-    # Must call clone() to force the data structures to get the latest version of the data
-    # The optimizer seems to play games with multiple versions
-    weightMatrix = linearUnit.weight.clone().detach().numpy()
-    biasVector = linearUnit.bias.clone().detach().numpy()
-
-    if (np.isnan(weightMatrix).any()):
-        print("ERROR!:\nMLEngine_SimpleCheckArray passed an Invalid Matrix")
-        fValid = False
+    # Scan the tensors directly. This is a single vectorized check on each tensor,
+    # and does not copy the weights into a new numpy array.
+    with torch.no_grad():
+        if (torch.isnan(linearUnit.weight).any().item()):
+            print("ERROR!:\nMLEngine_SimpleCheckArray passed an Invalid Matrix")
+            fValid = False
 
-    if (np.isnan(biasVector).any()):
-        print("ERROR!:\nMLEngine_SimpleCheckArray passed an Invalid Bias Vector")
-        fValid = False
+        if (torch.isnan(linearUnit.bias).any().item()):
+            print("ERROR!:\nMLEngine_SimpleCheckArray passed an Invalid Bias Vector")
+            fValid = False
 
     if (not fValid):
+        weightMatrix, biasVector = MLEngine_GetLinearUnitArrays(linearUnit)
         print("    name = " + str(name))
         print("    weightMatrix = " + str(weightMatrix))
         print("    biasVector = " + str(biasVector))
@@ -267,74 +489,61 @@ def MLEngine_SimpleCheckArray(linearUnit, name):
 #
 # [MLEngine_FullCheckLinearUnit]
 #
-# linearUnit is a Tensor and may be 1, 2, or 3 dimensional.
+# weightMatrix and biasVector are the numpy arrays returned by MLEngine_GetLinearUnitArrays.
+# The weight matrix may be 1, 2, or 3 dimensional.
 ################################################################################
-def MLEngine_FullCheckLinearUnit(linearUnit, unitName):
+def MLEngine_FullCheckLinearUnit(weightMatrix, biasVector, unitName):
     fValid = True
     fDebug = False
 
-    arrayDimList = linearUnit.weight.shape
+    arrayDimList = weightMatrix.shape
     numDimensions = len(arrayDimList)
     numDataSamples = arrayDimList[0]
     if (fDebug):
         print("MLEngine_FullCheckLinearUnit")
-        print("     linearUnit = " + str(linearUnit))
-        print("     type(linearUnit) = " + str(type(linearUnit)))
+        print("     unitName = " + str(unitName))
         print("     arrayDimList = " + str(arrayDimList))
         print("     numDimensions = " + str(numDimensions))
         print("     numDataSamples = " + str(numDataSamples))
 
-    # Must call clone() to force the data structures to get the latest version of the data
-    # The optimizer seems to play games with multiple versions
-    weightMatrix = linearUnit.weight.clone().detach().numpy()
-    biasVector = linearUnit.bias.clone().detach().numpy()
-
-    for inputVecNum in range(numDataSamples):
-        if (numDimensions == 3):
-            vec = weightMatrix[inputVecNum][0]
-        else:
-            vec = weightMatrix[inputVecNum]
-
-        for valIndex, currentVal in enumerate(vec):
-            if ((math.isnan(currentVal)) 
-                    or (currentVal > MAX_VALID_MATRIX_VALUE)
-                    or (currentVal < -MAX_VALID_MATRIX_VALUE)
-                    or ((currentVal > 0) and (currentVal < MIN_VALID_MATRIX_VALUE)) 
-                    or ((currentVal < 0) and (currentVal > -MIN_VALID_MATRIX_VALUE))):
-                if (currentVal == tdf.TDF_INVALID_VALUE):
-                    continue
-
-                if (fDebug):
-                    print("\n\n\n MLEngine_FullCheckLinearUnit in Matrix. Found bad value")
-                    print("   inputVecNum = " + str(inputVecNum) + ", valIndex = " + str(valIndex))
-
-                fValid = False
-                break
-        # End - for currentValEntry in vec:
+    # Check every value with a few array operations rather than a Python loop over each one.
+    # A value is bad if it is NaN, too large, or so small it is likely an underflow.
+    # Both limits are on the magnitude, so compute the absolute values once and
+    # compare against those.
+    # TDF_INVALID_VALUE is a legal value, even though it may look out of range.
+    for valueArray, arrayName in ((weightMatrix, "Matrix"), (biasVector, "biasVector")):
+        values = valueArray.reshape(-1)
+        scratchKey = (values.size, values.dtype)
+        absValues = g_CheckScratchArrays.get(scratchKey)
+        if (absValues is None):
+            absValues = np.empty(values.size, dtype=values.dtype)
+            g_CheckScratchArrays[scratchKey] = absValues
+        np.abs(values, out=absValues)
+
+        # Fast path. Almost every training step leaves the values healthy, so first
+        # check the whole array with two reductions. max() returns NaN if any value
+        # is NaN, and the comparison with NaN is False, so this also catches NaN.
+        # Only build the full mask of bad values if this check fails.
+        if ((values.size == 0)
+                or ((absValues.max() <= MAX_VALID_MATRIX_VALUE)
+                    and (not np.any((absValues > 0) & (absValues < MIN_VALID_MATRIX_VALUE))))):
+            continue
 
-        if (not fValid):
+        badValueMask = (np.isnan(values)
+                        | (absValues > MAX_VALID_MATRIX_VALUE)
+                        | ((absValues > 0) & (absValues < MIN_VALID_MATRIX_VALUE)))
+        badValueMask &= (values != tdf.TDF_INVALID_VALUE)
+        if (badValueMask.any()):
+            if (fDebug):
+                # values is a flat view of the array, so convert the flat index back
+                # to the position of the bad value in the original array.
+                flatIndex = np.flatnonzero(badValueMask)[0]
+                print("\n\n\n MLEngine_FullCheckLinearUnit in " + arrayName + ". Found bad value")
+                print("   valIndex = " + str(np.unravel_index(flatIndex, valueArray.shape)))
+                print("   value = " + str(values[flatIndex]))
+            fValid = False
             break
-    # End - for inputVecNum in range(numDataSamples):
-
-    if (fValid):
-        for valIndex, currentVal in enumerate(biasVector):
-            if ((math.isnan(currentVal)) 
-                    or (currentVal > MAX_VALID_MATRIX_VALUE)
-                    or (currentVal < -MAX_VALID_MATRIX_VALUE)
-                    or ((currentVal > 0) and (currentVal < MIN_VALID_MATRIX_VALUE)) 
-                    or ((currentVal < 0) and (currentVal > -MIN_VALID_MATRIX_VALUE))):
-                if (currentVal != tdf.TDF_INVALID_VALUE):
-                    continue
-
-                if (fDebug):
-                    print("\n\n\n MLEngine_FullCheckLinearUnit in biasVector. Found bad value")
-                    print("   biasVector = " + str(biasVector))
-                    print("   valIndex = " + str(valIndex) + ", currentVal = " + str(currentVal))
-
-                fValid = False
-                break
-        # End - for valIndex, currentVal in enumerate(biasVector):
-    # End - if (fValid)
+    # End - for valueArray, arrayName in ((weightMatrix, "Matrix"), (biasVector, "biasVector")):
 
     return fValid, weightMatrix, biasVector, arrayDimList, numDimensions, numDataSamples
 # End - MLEngine_FullCheckLinearUnit
@@ -346,137 +555,78 @@ def MLEngine_FullCheckLinearUnit(linearUnit, unitName):
 
 ################################################################################
 #
-# [MLEngine_RepairLinearUnit]
+# [MLEngine_RepairLinearUnit_InPlace]
 #
-# linearUnit is a Tensor and may be 1, 2, or 3 dimensional.
+# Repair the weights and bias of a linear unit in place. This changes the existing
+# tensors, so the linear unit keeps the same parameters and the optimizer state
+# for them stays attached.
 ################################################################################
-def MLEngine_RepairLinearUnit(weightMatrix, biasVector, arrayDimList, numDimensions, numDataSamples):
+@torch.no_grad()
+def MLEngine_RepairLinearUnit_InPlace(linearUnit):
     fDebug = False
     fRepaired = True
-                    
     if (fDebug):
-        print("MLEngine_RepairLinearUnit")
-        print(" weightMatrix = " + str(weightMatrix))
-        print(" type(weightMatrix) = " + str(type(weightMatrix)))
-        print(" biasVector = " + str(biasVector))
-        print(" type(biasVector) = " + str(type(biasVector)))
-        print(" arrayDimList = " + str(arrayDimList))
-        print(" numDimensions = " + str(numDimensions))
-        print(" numDataSamples = " + str(numDataSamples))
-
-
-    for inputVecNum in range(numDataSamples):
-        if (numDimensions == 3):
-            vec = weightMatrix[inputVecNum][0]
-        else:
-            vec = weightMatrix[inputVecNum]
+        print("MLEngine_RepairLinearUnit_InPlace")
+        print(" linearUnit.weight = " + str(linearUnit.weight))
+        print(" linearUnit.bias = " + str(linearUnit.bias))
+
+    # Repair every value with a few masked assignments on the tensor itself.
+    # TDF_INVALID_VALUE is a legal value, so it is never changed.
+    for valueTensor, tensorName in ((linearUnit.weight.data, "weight"), (linearUnit.bias.data, "bias")):
+        # The limits are on the magnitude, so compute the absolute values once.
+        # The sign only matters to decide which way to clamp an overflow.
+        absValues = valueTensor.abs()
+        validValueMask = (valueTensor != tdf.TDF_INVALID_VALUE)
+        overflowMask = validValueMask & (absValues > MAX_VALID_MATRIX_VALUE)
+        negativeMask = torch.signbit(valueTensor)
+        tooLargeMask = (validValueMask & torch.isnan(valueTensor)) | (overflowMask & ~negativeMask)
+        tooNegativeMask = overflowMask & negativeMask
+        tooSmallMask = validValueMask & (absValues > 0) & (absValues < MIN_VALID_MATRIX_VALUE)
+
+        valueTensor[tooLargeMask] = LARGE_REASONABLE_MATRIX_VALUE
+        valueTensor[tooNegativeMask] = -LARGE_REASONABLE_MATRIX_VALUE
+        valueTensor[tooSmallMask] = 0.0
+        if (fDebug):
+            print(">>>>>>>>>>>>>>>>>> MLEngine_RepairLinearUnit_InPlace. Repaired " + tensorName)
+            print("    Set to LARGE_REASONABLE_MATRIX_VALUE: " + str(int(tooLargeMask.sum().item())))
+            print("    Set to -LARGE_REASONABLE_MATRIX_VALUE: " + str(int(tooNegativeMask.sum().item())))
+            print("    Set to 0.0: " + str(int(tooSmallMask.sum().item())))
+    # End - for valueTensor, tensorName in ((linearUnit.weight.data, "weight"), (linearUnit.bias.data, "bias")):
 
-        for valIndex, currentVal in enumerate(vec):
-            if (currentVal == tdf.TDF_INVALID_VALUE):
-                continue
-            elif ((math.isnan(currentVal)) or (currentVal > MAX_VALID_MATRIX_VALUE)):
-                if (numDimensions == 3):
-                    weightMatrix[inputVecNum][0][valIndex] = LARGE_REASONABLE_MATRIX_VALUE
-                else:
-                    weightMatrix[inputVecNum][valIndex] = LARGE_REASONABLE_MATRIX_VALUE                    
-                if (fDebug):
-                    print(">>>>>>>>>>>>>>>>>> MLEngine_RepairLinearUnit. Set value to LARGE_REASONABLE_MATRIX_VALUE")
-                    print("    inputVecNum = " + str(inputVecNum) + ", valIndex = " + str(valIndex))
-                    print("    vec = " + str(vec))
-                    print("    weightMatrix = " + str(weightMatrix))
-            elif (currentVal < -MAX_VALID_MATRIX_VALUE):
-                if (numDimensions == 3):
-                    weightMatrix[inputVecNum][0][valIndex] = -LARGE_REASONABLE_MATRIX_VALUE
-                else:
-                    weightMatrix[inputVecNum][valIndex] = -LARGE_REASONABLE_MATRIX_VALUE                    
-                if (fDebug):
-                    print(">>>>>>>>>>>>>>>>>> MLEngine_RepairLinearUnit. Set value to -LARGE_REASONABLE_MATRIX_VALUE")
-                    print("    inputVecNum = " + str(inputVecNum) + ", valIndex = " + str(valIndex))
-                    print("    vec = " + str(vec))
-                    print("    weightMatrix = " + str(weightMatrix))
-            elif (((currentVal > 0) and (currentVal < MIN_VALID_MATRIX_VALUE)) 
-                    or ((currentVal < 0) and (currentVal > -MIN_VALID_MATRIX_VALUE))):
-                if (numDimensions == 3):
-                    weightMatrix[inputVecNum][0][valIndex] = 0.0
-                else:
-                    weightMatrix[inputVecNum][valIndex] = 0.0
-                if (fDebug):
-                    print(">>>>>>>>>>>>>>>>>> MLEngine_RepairLinearUnit. Set value to 0.0")
-                    print("    inputVecNum = " + str(inputVecNum) + ", valIndex = " + str(valIndex))
-                    print("    vec = " + str(vec))
-                    print("    weightMatrix = " + str(weightMatrix))
-        # End - for currentValEntry in vec:
-    # End - for inputVecNum in range(numDataSamples):
+    return fRepaired
+# End - MLEngine_RepairLinearUnit_InPlace
 
-    for valIndex, currentVal in enumerate(biasVector):
-        if (currentVal != tdf.TDF_INVALID_VALUE):
-            continue
-        elif ((math.isnan(currentVal)) or (currentVal > MAX_VALID_MATRIX_VALUE)):
-            biasVector[valIndex] = LARGE_REASONABLE_MATRIX_VALUE
-            if (fDebug):
-                print(">>>>>>>>>>>>>>>>>> MLEngine_RepairLinearUnit. Set biasVector value to LARGE_REASONABLE_MATRIX_VALUE")
-                print("    inputVecNum = " + str(inputVecNum) + ", valIndex = " + str(valIndex))
-                print("    biasVector = " + str(biasVector))
-        elif (currentVal < -MAX_VALID_MATRIX_VALUE):
-            biasVector[valIndex] = -LARGE_REASONABLE_MATRIX_VALUE
-            if (fDebug):
-                print(">>>>>>>>>>>>>>>>>> MLEngine_RepairLinearUnit. Set biasVector value to -LARGE_REASONABLE_MATRIX_VALUE")
-                print("    inputVecNum = " + str(inputVecNum) + ", valIndex = " + str(valIndex))
-                print("    biasVector = " + str(biasVector))
-        elif (((currentVal > 0) and (currentVal < MIN_VALID_MATRIX_VALUE)) 
-                or ((currentVal < 0) and (currentVal > -MIN_VALID_MATRIX_VALUE))):
-            biasVector[valIndex] = 0.0
-            if (fDebug):
-                print(">>>>>>>>>>>>>>>>>> MLEngine_RepairLinearUnit. Set value biasVector to 0.0")
-                print("    inputVecNum = " + str(inputVecNum) + ", valIndex = " + str(valIndex))
-                print("    biasVector = " + str(biasVector))
-    # End - for valIndex, currentVal in enumerate(biasVector):
 
 
-    # WARNING!!!!
-    # Leave these as float32. Changing them to 64 will cause the checksum code to
-    # compute different checksums for Linear Units when they are restored by this
-    # routine compare to when they are initialized.
-    weightTensor = torch.tensor(weightMatrix, dtype=torch.float32)
-    biasTensor = torch.tensor(biasVector, dtype=torch.float32)
-    weightSize = weightTensor.size()
-    inputSize = weightSize[1]
-    outputSize = weightSize[0]
-
-    linearUnit = nn.Linear(inputSize, outputSize)
-    linearUnit.weight = torch.nn.Parameter(weightTensor)
-    linearUnit.bias = torch.nn.Parameter(biasTensor)
-    if (fDebug):
-        print(">>>>>>>>>>>>>>>>>> MLEngine_RepairLinearUnit. Done")
-        print("    linearUnit.weight = " + str(linearUnit.weight))
-        print("    linearUnit.bias = " + str(linearUnit.bias))
 
-    return fRepaired, linearUnit
-# End - MLEngine_RepairLinearUnit
 
 
+################################################################################
+#
+# [MLEngine_SetArrayChecksum]
+#
+################################################################################
+def MLEngine_SetArrayChecksum(job, linearUnit, hashName):
+    weightMatrix, _ = MLEngine_GetLinearUnitArrays(linearUnit)
+    MLEngine_SetMatrixChecksum(job, weightMatrix, hashName)
+# End - MLEngine_SetArrayChecksum
 
 
 
 
 ################################################################################
 #
-# [MLEngine_SetArrayChecksum]
+# [MLEngine_SetMatrixChecksum]
 #
-# inputArray is a numpy array, and may be 1, 2, or 3 dimensional.
+# weightMatrix is a numpy array, and may be 1, 2, or 3 dimensional.
 ################################################################################
-def MLEngine_SetArrayChecksum(job, linearUnit, hashName):
+def MLEngine_SetMatrixChecksum(job, weightMatrix, hashName):
     fDebug = False
     if (fDebug):
-        print("MLEngine_SetArrayChecksum. hashName=" + hashName)
-
-    # Must call clone() to force the data structures to get the latest version of the data
-    # The optimizer seems to play games with multiple versions
-    weightMatrix = linearUnit.weight.clone().detach().numpy()
-    #biasVector = linearUnit.bias.clone().detach().numpy()
+        print("MLEngine_SetMatrixChecksum. hashName=" + hashName)
 
     job.SetArrayChecksum(weightMatrix, hashName)
-# End - MLEngine_SetArrayChecksum
+# End - MLEngine_SetMatrixChecksum
 
 
 
@@ -487,20 +637,29 @@ def MLEngine_SetArrayChecksum(job, linearUnit, hashName):
 #
 ################################################################################
 def MLEngine_ArrayChecksumEqual(job, linearUnit, hashName, fExpectEqual):
-    # Must call clone() to force the data structures to get the latest version of the data
-    # The optimizer seems to play games with multiple versions
-    weightMatrix = linearUnit.weight.clone().detach().numpy()
-    #biasVector = linearUnit.bias.clone().detach().numpy()
+    weightMatrix, _ = MLEngine_GetLinearUnitArrays(linearUnit)
+    return MLEngine_MatrixChecksumEqual(job, weightMatrix, hashName, fExpectEqual)
+# End - MLEngine_ArrayChecksumEqual
 
+
+
+
+################################################################################
+#
+# [MLEngine_MatrixChecksumEqual]
+#
+# weightMatrix is a numpy array, and may be 1, 2, or 3 dimensional.
+################################################################################
+def MLEngine_MatrixChecksumEqual(job, weightMatrix, hashName, fExpectEqual):
     isEqual = job.CompareArrayChecksum(weightMatrix, hashName)
     if ((not isEqual) and (fExpectEqual)):
-        print("MLEngine_ArrayChecksumEqual. Fail equality check when it was expected")
+        print("MLEngine_MatrixChecksumEqual. Fail equality check when it was expected")
         print("    hashName = " + hashName)
         print("    weightMatrix = " + str(weightMatrix))
-        ASSERT_ERROR("MLEngine_ArrayChecksumEqual. Fail equality check when it was expected")
+        ASSERT_ERROR("MLEngine_MatrixChecksumEqual. Fail equality check when it was expected")
 
     return isEqual
-# End - MLEngine_ArrayChecksumEqual
+# End - MLEngine_MatrixChecksumEqual
 
 
 
@@ -523,15 +682,14 @@ class MLEngine_SingleLayerNeuralNet(nn.Module):
 
         self.isLogistic = job.GetIsLogisticNetwork()
 
-        inputNameListStr = job.GetNetworkInputVarNames()
-        inputNameList = inputNameListStr.split(tdf.VARIABLE_LIST_SEPARATOR)
+        inputNameList = MLEngine_GetInputNameList(job.GetNetworkInputVarNames())
         self.NumInputVars = len(inputNameList)
 
         resultValueName = job.GetNetworkOutputVarName()
         if (self.isLogistic):
             self.NumOutputCategories = 1
         else:
-            self.NumOutputCategories = tdf.TDF_GetNumClassesForVariable(resultValueName)
+            self.NumOutputCategories = MLEngine_GetNumClassesForVariable(resultValueName)
 
         # Create the matrix of weights.
         # A nn.Linear is an object that contains a matrix A and bias vector b
@@ -541,28 +699,115 @@ class MLEngine_SingleLayerNeuralNet(nn.Module):
         #
         # The values are initialized from U(−k,k)U(−k​,k​), where k=in_features
         # The values are initialized from U(−k,k)U(−k​,k​) where k=in_features
-        self.inputToOutput = nn.Linear(self.NumInputVars, self.NumOutputCategories)
+        self.inputToOutput = MLEngine_MakeLinearUnit(job, "inputToOutput", self.NumInputVars, self.NumOutputCategories)
 
         # Depending on the result value type, make a Non-linearity.
         layerSpecXML = job.GetNetworkLayerSpec("InputLayer")
         nonLinearTypeStr = dxml.XMLTools_GetChildNodeTextAsStr(layerSpecXML, "NonLinear", "ReLU")
         self.outputNonLinearLayer = MLEngine_MakePyTorchNonLinear(nonLinearTypeStr, self.isLogistic, True)
+
+        # This is reused for the output of every inference pass, so testing does not
+        # allocate a new output tensor for each group of data points. It is a plain
+        # attribute, not a registered buffer, so it is never saved with the weights.
+        self.inferenceOutputBuffer = None
+
+        # See MAX_SKIPPED_VALUE_CHECKS.
+        self.NumHealthyValueChecks = 0
+        self.NumValueChecksToSkip = 0
+
+        # Pick the version of forward() once here, so we do not have to check for 
+        # a non-linear on every forward pass.
+        if (self.outputNonLinearLayer is not None):
+            self.forward = self.ForwardWithNonLinear
+        else:
+            self.forward = self.ForwardLinearOnly
+
+        # When training, the linear unit and its non-linear are the whole network.
+        # They are pure tensor operations, so with torch.compile we compile just them,
+        # with no graph breaks on the job object that forward() takes, and they run
+        # as one fused kernel. The repairs in ValidateAndFixModel change the weights
+        # in place, so the compiled code always sees the current linear unit.
+        # If this compiles them, then MLEngine_CompileNeuralNet will not compile the whole network again.
+        eagerLinearAndNonLinear = self.ComputeLinearAndNonLinear
+        self.TrainingLinearAndNonLinear = MLEngine_CompileNeuralNet(job, eagerLinearAndNonLinear, True, None, True)
+        self.fCompiledInternally = (self.TrainingLinearAndNonLinear is not eagerLinearAndNonLinear)
     # End - __init__
 
 
     #####################################################
-    #
-    # [MLEngine_SingleLayerNeuralNet.forward]
+    # [MLEngine_SingleLayerNeuralNet.ForwardWithNonLinear]
+    # [MLEngine_SingleLayerNeuralNet.ForwardLinearOnly]
     #
     # Forward prop.
     # This will leave pointers for all of the dependencies, 
     # so backward propagation can be done by the base class.
+    #
+    # There is no forward() method in this class. __init__ installs one of these 
+    # as self.forward, depending on whether there is an output non-linear.
     #####################################################
-    def forward(self, job, numDataSamples, inputTensor, trueResultTensor, dayNumArray, 
-                fAddMinibatchDimension, maxDaysWithZeroValue):
-        output = self.inputToOutput(inputTensor)
+    def ForwardWithNonLinear(self, job, numDataSamples, inputTensor, trueResultTensor, dayNumArray, 
+                            fAddMinibatchDimension, maxDaysWithZeroValue):
+        if ((torch.is_grad_enabled()) or (torch.is_autocast_enabled())):
+            output = self.TrainingLinearAndNonLinear(inputTensor)
+        else:
+            output = self.outputNonLinearLayer(self.ComputeLinearUnit(inputTensor))
         return numDataSamples, output, trueResultTensor, None
-    # End - forward
+
+    def ForwardLinearOnly(self, job, numDataSamples, inputTensor, trueResultTensor, dayNumArray, 
+                            fAddMinibatchDimension, maxDaysWithZeroValue):
+        if ((torch.is_grad_enabled()) or (torch.is_autocast_enabled())):
+            output = self.TrainingLinearAndNonLinear(inputTensor)
+        else:
+            output = self.ComputeLinearUnit(inputTensor)
+        return numDataSamples, output, trueResultTensor, None
+    # End - ForwardWithNonLinear/ForwardLinearOnly
+
+
+    #####################################################
+    #
+    # [MLEngine_SingleLayerNeuralNet.ComputeLinearUnit]
+    #
+    # When training, this is just the nn.Linear, so autograd can record it.
+    # When testing, autograd is off and we write (x * A-transpose) + b into 
+    # inferenceOutputBuffer with addmm, so we reuse the same memory every time.
+    # The result is a view of the buffer, so the caller must read it before the
+    # next forward pass.
+    #####################################################
+    def ComputeLinearUnit(self, inputTensor):
+        # Autocast does not apply to ops that write to an out= tensor, so when we
+        # run in bfloat16, let nn.Linear allocate the output.
+        if ((torch.is_grad_enabled()) or (torch.is_autocast_enabled())):
+            return self.inputToOutput(inputTensor)
+
+        weightMatrix = self.inputToOutput.weight
+        inputMatrix = inputTensor.reshape(-1, self.NumInputVars)
+        numRows = inputMatrix.shape[0]
+        if ((self.inferenceOutputBuffer is None) 
+                or (self.inferenceOutputBuffer.shape[0] < numRows)
+                or (self.inferenceOutputBuffer.device != weightMatrix.device)
+                or (self.inferenceOutputBuffer.dtype != weightMatrix.dtype)):
+            self.inferenceOutputBuffer = torch.empty(numRows, self.NumOutputCategories, 
+                                                     device=weightMatrix.device, dtype=weightMatrix.dtype)
+
+        outputMatrix = self.inferenceOutputBuffer[:numRows]
+        torch.addmm(self.inputToOutput.bias, inputMatrix, weightMatrix.t(), out=outputMatrix)
+        return outputMatrix.view(*inputTensor.shape[:-1], self.NumOutputCategories)
+    # End - ComputeLinearUnit
+
+
+    #####################################################
+    #
+    # [MLEngine_SingleLayerNeuralNet.ComputeLinearAndNonLinear]
+    #
+    # The training path: the nn.Linear followed by the non-linear, if there is one.
+    # __init__ may replace self.TrainingLinearAndNonLinear with a compiled version of this.
+    #####################################################
+    def ComputeLinearAndNonLinear(self, inputTensor):
+        output = self.inputToOutput(inputTensor)
+        if (self.outputNonLinearLayer is not None):
+            output = self.outputNonLinearLayer(output)
+        return output
+    # End - ComputeLinearAndNonLinear
 
 
 
@@ -571,20 +816,15 @@ class MLEngine_SingleLayerNeuralNet(nn.Module):
     #####################################################
     def SaveNeuralNetstate(self, job):
         # Save the matrix itself to the job.
-        MLEngine_SaveLinearUnitToJob(self.inputToOutput, job, "inputToOutput")
+        weightMatrix = MLEngine_SaveLinearUnitToJob(self.inputToOutput, job, "inputToOutput")
 
-        # Debug: Save a checksum of the first matrix
-        if (not job.ChecksumExists("SimInMatInit")):
-            MLEngine_SetArrayChecksum(job, self.inputToOutput, "SimInMatInit")
-        else:
-            if (MLEngine_ArrayChecksumEqual(job, self.inputToOutput, "SimInMatInit", False)):
-                #ASSERT_ERROR("Save a matrix checksum that is same as initial")
-                pass
+        # Save a checksum of the latest matrix.
+        job.UpdateArrayChecksum(weightMatrix, "SimpleNetInputMatrix", False)
 
-        # Now save a checksum of the latest matrix.
-        MLEngine_SetArrayChecksum(job, self.inputToOutput, "SimpleNetInputMatrix")
-        if (not MLEngine_ArrayChecksumEqual(job, self.inputToOutput, "SimpleNetInputMatrix", True)):
-            ASSERT_ERROR("Failed to save a matrix checksum")
+        # Debug: Save a checksum of the first matrix. This is the same matrix, so
+        # copy the checksum we just computed rather than hash it again.
+        if (not job.ChecksumExists("SimInMatInit")):
+            job.CopySavedArrayChecksum("SimpleNetInputMatrix", "SimInMatInit")
     # End - SaveNeuralNetstate
 
 
@@ -600,11 +840,10 @@ class MLEngine_SingleLayerNeuralNet(nn.Module):
             print("MLEngine_SingleLayerNeuralNet.RestoreNetState")
 
         # Read the matrix from the job
-        restoredTensor = MLEngine_ReadLinearUnitFromJob(job, "inputToOutput")
+        fRestored = MLEngine_ReadLinearUnitFromJob(job, "inputToOutput", self.inputToOutput)
         # We always try to restore, so will also restore even on the first time
         # we used the matrix. In that case, there is no saved state.
-        if (restoredTensor is not None):
-            self.inputToOutput = restoredTensor
+        if (fRestored):
             if (not MLEngine_ArrayChecksumEqual(job, self.inputToOutput, "SimpleNetInputMatrix", True)):
                 print("MLEngine_SingleLayerNeuralNet. Fail Assert. Failed to correctly restore a neural net state")
                 ASSERT_ERROR("Failed to save a matrix checksum: " + "inputToOutput")
@@ -617,34 +856,35 @@ class MLEngine_SingleLayerNeuralNet(nn.Module):
     #
     # Make sure that backprop correctly updated the local network 
     #####################################################
+    @torch.no_grad()
     def ValidateAndFixModel(self, job, loss, predictionTensor, trueResultTensor):
         fValid = True
 
+        # Get the arrays once, and use them for both the checks and the checksums.
+        weightMatrix, biasVector = MLEngine_GetLinearUnitArrays(self.inputToOutput)
+
         if (REPAIR_MATRICES_DURING_VALIDATION):
-            fValid, weightMatrix, biasVector, arrayDimList, numDimensions, numDataSamples = MLEngine_FullCheckLinearUnit(self.inputToOutput, 
-                                                                                                                    "SimpleNetInputMatrix")
+            fValid, weightMatrix, biasVector, arrayDimList, numDimensions, numDataSamples = MLEngine_FullCheckLinearUnit(weightMatrix, 
+                                                                                                    biasVector, "SimpleNetInputMatrix")
             if (not fValid):
-                fValid, repairedLinearUnit = MLEngine_RepairLinearUnit(weightMatrix,
-                                                  biasVector, arrayDimList, numDimensions, numDataSamples)
+                fValid = MLEngine_RepairLinearUnit_InPlace(self.inputToOutput)
                 if (fValid):
-                    self.inputToOutput = repairedLinearUnit
+                    weightMatrix, biasVector = MLEngine_GetLinearUnitArrays(self.inputToOutput)
                 else:
                     ASSERT_ERROR("MLEngine_SingleLayerNeuralNet: Cannot repair SimpleNetInputMatrix")
                     return fValid
             # End - if (not fValid):
         else:  # if (not REPAIR_MATRICES_DURING_VALIDATION):
-            MLEngine_SimpleCheckArray(self.inputToOutput, "SimpleNetInputMatrix")
+            self.CheckValuesWithBackoff(job)
         # End - if (not REPAIR_MATRICES_DURING_VALIDATION):
 
-        # The matrix should now be different than the previous state
-        if (MLEngine_ArrayChecksumEqual(job, self.inputToOutput, "SimpleNetInputMatrix", False)):
+        # Save a checksum of the new matrix state. The matrix should now be different
+        # than the previous state.
+        # When we repair the matrices, we have just checked every value, so the
+        # checksum does not need to check them for NaN again.
+        if (job.UpdateArrayChecksum(weightMatrix, "SimpleNetInputMatrix", REPAIR_MATRICES_DURING_VALIDATION)):
             ASSERT_ERROR("MLEngine_SingleLayerNeuralNet: Training did not update the weight matrix - Nonce=" + str(job.GetNonce()))
 
-        # Save a checksum of the new matrix state
-        MLEngine_SetArrayChecksum(job, self.inputToOutput, "SimpleNetInputMatrix")
-        if (not MLEngine_ArrayChecksumEqual(job, self.inputToOutput, "SimpleNetInputMatrix", True)):
-            ASSERT_ERROR("Failed to save a matrix checksum")
-
         return fValid
     # End - ValidateAndFixModel
 
@@ -663,6 +903,7 @@ class MLEngine_SingleLayerNeuralNet(nn.Module):
     #####################################################
     # MLEngine_SingleLayerNeuralNet.CheckState
     #####################################################
+    @torch.no_grad()
     def CheckState(self, job):
         fDebug = False
         fFail = False
@@ -674,7 +915,7 @@ class MLEngine_SingleLayerNeuralNet(nn.Module):
             print("Nonce = " + str(job.GetNonce()))
             ASSERT_ERROR("Matrix is None")
 
-        MLEngine_SimpleCheckArray(self.inputToOutput, "SimpleNetInputMatrix")
+        self.CheckValuesWithBackoff(job)
 
         #<><>
         return
@@ -693,12 +934,36 @@ class MLEngine_SingleLayerNeuralNet(nn.Module):
     # End - CheckState
 
 
+    #####################################################
+    # MLEngine_SingleLayerNeuralNet.CheckValuesWithBackoff
+    #
+    # Check the linear unit for NaN values, but after a run of healthy
+    # checks, skip some of the following checks. See MAX_SKIPPED_VALUE_CHECKS.
+    #####################################################
+    def CheckValuesWithBackoff(self, job):
+        if ((self.NumValueChecksToSkip > 0) and (not job.GetDebug())):
+            self.NumValueChecksToSkip -= 1
+            return True
+
+        fValid = MLEngine_SimpleCheckArray(self.inputToOutput, "SimpleNetInputMatrix")
+        if (fValid):
+            self.NumHealthyValueChecks += 1
+            self.NumValueChecksToSkip = min(self.NumHealthyValueChecks, MAX_SKIPPED_VALUE_CHECKS)
+        else:
+            self.NumHealthyValueChecks = 0
+            self.NumValueChecksToSkip = 0
+
+        return fValid
+    # End - CheckValuesWithBackoff
+
+
     #####################################################
     # MLEngine_SingleLayerNeuralNet.DebugPrint
     #####################################################
     def DebugPrint(self):
-        weightMatrix = self.inputToOutput.weight.clone().detach().numpy()
-        biasVector = self.inputToOutput.bias.clone().detach().numpy()
+        # This only reads the values, so there is no need to clone them first.
+        weightMatrix = self.inputToOutput.weight.detach().numpy()
+        biasVector = self.inputToOutput.bias.detach().numpy()
 
         print("Weight Matrix = " + str(weightMatrix))
         print("biasVector = " + str(biasVector))
@@ -742,16 +1007,19 @@ class MLEngine_DeepNeuralNet(nn.Module):
         err = E_NO_ERROR
 
         self.isLogistic = job.GetIsLogisticNetwork()
-        inputNameListStr = job.GetNetworkInputVarNames()
-        inputNameList = inputNameListStr.split(tdf.VARIABLE_LIST_SEPARATOR)
+        inputNameList = MLEngine_GetInputNameList(job.GetNetworkInputVarNames())
         self.NumInputVars = len(inputNameList)
 
         resultValueName = job.GetNetworkOutputVarName()
-        self.NumOutputCategories = tdf.TDF_GetNumClassesForVariable(resultValueName)
+        self.NumOutputCategories = MLEngine_GetNumClassesForVariable(resultValueName)
 
         # If the recurrent state size is 0, then this is a simple deep neural network.
         self.RecurrentStateSize = job.GetNetworkStateSize()
         self.IsRNN = (self.RecurrentStateSize > 0)
+        # Read this hyperparameter once here, rather than parsing it out of the job XML
+        # on every call to forward().
+        self.MaxDaysSkippedInSameSequence = job.GetTrainingParamInt(mlJob.TRAINING_MAX_SKIPPED_DAYS_IN_SAME_SEQUENCE,
+                                                                    DEFAULT_MAX_SKIPPED_DAYS_IN_SAME_SEQUENCE)
         if (fDebug):
             print("self.RecurrentStateSize = " + str(self.RecurrentStateSize))
             print("self.IsRNN = " + str(self.IsRNN))
@@ -776,7 +1044,7 @@ class MLEngine_DeepNeuralNet(nn.Module):
         if (self.IsRNN):
             inputSize = self.RecurrentStateSize + self.NumInputVars
 
-        err, newLayerInfo, newLinearUnit, layerOutputSize = self.MakeOneNetworkLayer(layerSpecXML, 
+        err, newLayerInfo, newLinearUnit, layerOutputSize = self.MakeOneNetworkLayer(job, layerSpecXML, 
                                                                        0, inputSize, False)
         if (err != E_NO_ERROR):
             print("Error in MLEngine_DeepNeuralNet::__init__")
@@ -793,7 +1061,7 @@ class MLEngine_DeepNeuralNet(nn.Module):
         # Create each hidden layer
         layerSpecXML = job.GetNetworkLayerSpec("HiddenLayer")
         while (layerSpecXML is not None):
-            err, newLayerInfo, newLinearUnit, layerOutputSize = self.MakeOneNetworkLayer(layerSpecXML, 
+            err, newLayerInfo, newLinearUnit, layerOutputSize = self.MakeOneNetworkLayer(job, layerSpecXML, 
                                                                  layerNum, currentLayerInputSize, False)
             if (err != E_NO_ERROR):
                 raise Exception()
@@ -816,7 +1084,7 @@ class MLEngine_DeepNeuralNet(nn.Module):
         if (layerSpecXML is None):
             raise Exception()
 
-        err, newLayerInfo, newLinearUnit, layerOutputSize = self.MakeOneNetworkLayer(layerSpecXML, 
+        err, newLayerInfo, newLinearUnit, layerOutputSize = self.MakeOneNetworkLayer(job, layerSpecXML, 
                                                                layerNum, currentLayerInputSize, True)
         if (err != E_NO_ERROR):
             raise Exception()
@@ -833,9 +1101,48 @@ class MLEngine_DeepNeuralNet(nn.Module):
         if (self.IsRNN):
             inputSize = self.RecurrentStateSize + self.NumInputVars + self.NumOutputCategories
             outputSize = self.RecurrentStateSize
-            self.rnnStateLinearUnit = nn.Linear(inputSize, outputSize)
+            self.rnnStateLinearUnit = MLEngine_MakeLinearUnit(job, RECURRENT_STATE_LINEAR_UNIT_NAME, inputSize, outputSize)
+
+            # The initial state of every sequence. This is a buffer so it moves with the module
+            # when the network is put on the GPU, and is not reallocated on the CPU each time a
+            # new sequence starts. It is not persistent, so it is not part of the saved state.
+            self.register_buffer('InitialRecurrentState', torch.zeros(self.RecurrentStateSize), persistent=False)
         # End - if (self.IsRNN)
 
+        # The linear unit, non-linear and MixAnalogDigital flag of each layer, in order.
+        # The forward pass loops over these, rather than looking up self.NetworkLayers 
+        # and self.LinearUnitList for every layer of every sample.
+        self.LayerTuples = tuple((self.LinearUnitList[layerNum], 
+                                  self.NetworkLayers[layerNum]['NonLinear'],
+                                  self.NetworkLayers[layerNum]['MixAnalogDigital']) for layerNum in range(self.NumLayers))
+
+        # If no layer mixes the raw inputs back in, then a network that is not recurrent is a 
+        # simple chain of layers. Run it as an nn.Sequential, rather than looking up the info 
+        # for each layer in a Python loop. This uses the same linear units as self.LinearUnitList.
+        # Those are already registered there, so keep the nn.Sequential in a plain list, where
+        # nn.Module does not register it. Otherwise, every layer would be registered a second 
+        # time under LayerSequence in the parameters and state of the module.
+        self.LayerSequenceList = []
+        if ((not self.IsRNN) and (not any(layerInfo['MixAnalogDigital'] for layerInfo in self.NetworkLayers))):
+            sequenceModuleList = []
+            for layerNum in range(self.NumLayers):
+                sequenceModuleList.append(self.LinearUnitList[layerNum])
+                if (self.NetworkLayers[layerNum]['NonLinear'] is not None):
+                    sequenceModuleList.append(self.NetworkLayers[layerNum]['NonLinear'])
+            # End - for layerNum in range(self.NumLayers):
+            self.LayerSequenceList.append(nn.Sequential(*sequenceModuleList))
+        # End - if ((not self.IsRNN) and ...
+
+        # A network that is not recurrent is just a chain of linear units and non-linears,
+        # so with torch.compile we compile just that chain, and the non-linears can be fused
+        # into the matrix multiplies. The minibatch size changes, so compile it with dynamic shapes.
+        # If this compiles it, then MLEngine_CompileNeuralNet will not compile the whole network again.
+        eagerFeedForward = self.ComputeFeedForward
+        self.FeedForward = eagerFeedForward
+        if (not self.IsRNN):
+            self.FeedForward = MLEngine_CompileNeuralNet(job, eagerFeedForward, True, True, False)
+        self.fCompiledInternally = (self.FeedForward is not eagerFeedForward)
+
         if (fDebug):
             print("MLEngine_DeepNeuralNet.__init__")
             print("   Len(self.LinearUnitList) = " + str(len(self.LinearUnitList)))
@@ -861,7 +1168,7 @@ class MLEngine_DeepNeuralNet(nn.Module):
     #                    -> [VecNToOutput] -> outputs
     #
     #####################################################
-    def MakeOneNetworkLayer(self, layerSpecXML, layerNum, currentLayerInputSize, fIsFinalLayer):
+    def MakeOneNetworkLayer(self, job, layerSpecXML, layerNum, currentLayerInputSize, fIsFinalLayer):
         fDebug = False
 
         newLayerInfo = {'layerNum': layerNum}
@@ -912,7 +1219,7 @@ class MLEngine_DeepNeuralNet(nn.Module):
         # in a module class object. As a result, they do not appear as Parameters, 
         # and so will not be part of the backprop or gradient updates. 
         # As a result, use nn.ModuleDict instead of dict and nn.ModuleList instead of list
-        newLinearUnit = nn.Linear(currentLayerInputSize, layerOutputSize)
+        newLinearUnit = MLEngine_MakeLinearUnit(job, newLayerInfo['Name'], currentLayerInputSize, layerOutputSize)
 
         # Be careful.
         # Consider just layer 1. Initially, after allocation, every node in layer 1 is identical.
@@ -956,9 +1263,6 @@ class MLEngine_DeepNeuralNet(nn.Module):
                 dayNumArray, fAddMinibatchDimension, maxDaysWithZeroValue):
         fDebug = False
 
-        vec = inputTensor
-        combinedInput = None
-
         # The network will look like:
         #    Inputs -> [InputToVec1] -> Vec1
         #                -> [Vec1ToVec2] -> Vec2
@@ -974,18 +1278,7 @@ class MLEngine_DeepNeuralNet(nn.Module):
         ###########################################################
         # Non-Recurrent Network - the simple case which does a single batch
         if (not self.IsRNN):
-            for layerNum in range(self.NumLayers):
-                layerInfo = self.NetworkLayers[layerNum]
-
-                if (layerInfo['MixAnalogDigital']):
-                    vec = torch.cat((vec, inputTensor), 2)
-                # End - if (layerInfo['MixAnalogDigital']):
-
-                vec = self.LinearUnitList[layerNum](vec)
-                if (layerInfo['NonLinear'] is not None):
-                    vec = layerInfo['NonLinear'](vec)
-            # End - for layerNum in range(self.NumLayers):
-
+            vec = self.FeedForward(inputTensor)
             return numDataSamples, vec, trueResultTensor, None
         # End - if (not self.IsRNN)
 
@@ -993,8 +1286,7 @@ class MLEngine_DeepNeuralNet(nn.Module):
         # Recurrent Network - the slow case which does each input sequentially
         else:   # if (not self.IsRNN):
             # Get Hyperparameters that only apply to an RNN
-            maxDaysSkippedInSameSequence = job.GetTrainingParamInt(mlJob.TRAINING_MAX_SKIPPED_DAYS_IN_SAME_SEQUENCE,
-                                    DEFAULT_MAX_SKIPPED_DAYS_IN_SAME_SEQUENCE)
+            maxDaysSkippedInSameSequence = self.MaxDaysSkippedInSameSequence
             if (fDebug):
                 print("MLEngine_DeepNeuralNet.forward. maxDaysSkippedInSameSequence=" + str(maxDaysSkippedInSameSequence))
 
@@ -1004,108 +1296,143 @@ class MLEngine_DeepNeuralNet(nn.Module):
             # One training sequence does not convey any information about 
             # another training sequence.
             # As a result, the order we train the input sequences does not matter.
-            recurrentState = torch.zeros(self.RecurrentStateSize)
-            #recurrentState = recurrentState.to(gpuDevice)
-            #recurrentState = recurrentState.cpu()
-
-            # Make a list of all possible results. This is likely more space than we need and we will trim it
-            # down to the final size when this procedure is about to return.
-            if (fAddMinibatchDimension):
-                resultList = torch.zeros(numDataSamples, 1, self.NumOutputCategories)
-            else:
-                resultList = torch.zeros(numDataSamples, self.NumOutputCategories)
-            numDaysForResult = torch.zeros(numDataSamples)
+            # The recurrent state is never modified in place, so every sequence can start from
+            # the same buffer.
+            recurrentState = self.InitialRecurrentState
+
+            # Collect only the valid results, and make them into tensors once when the loop is done.
+            # This avoids allocating a tensor for every possible result on every call and then
+            # trimming it, and avoids an indexed copy into that tensor for each result.
+            validResultVecList = []
+            numDaysForResultList = []
             numValidResults = 0
-            prevDayNum = -1
             numInputsInCurrentSequence = 0
+
+            # Find where each new sequence starts with one vectorized compare of the day deltas.
+            # A sample starts a new sequence when the previous day is valid and we skipped 
+            # too many days since it. The first sample never needs a reset.
+            timelineDayNums = np.asarray(dayNumArray[:numDataSamples])
+            newSequenceMask = ((timelineDayNums[:-1] > 0) 
+                                & ((timelineDayNums[1:] - timelineDayNums[:-1]) > maxDaysSkippedInSameSequence))
+            newSequenceList = [False] + newSequenceMask.tolist()
+
+            # Find every sample that ends a sequence with one vectorized compare, rather than
+            # reading each true result back with .item() inside the loop. On a GPU, each .item()
+            # is a device sync, so this replaces one sync per sample with a single sync.
+            validResultMask = (trueResultTensor.reshape(numDataSamples, -1)[:, 0] > tdf.TDF_INVALID_VALUE)
+            validResultList = validResultMask.tolist()
+
+            # The first layer computes W * [x, h] + b, where x is the input and h is the recurrent state.
+            # Split W into [Wx | Wh]. Only Wh * h depends on the recurrent state, so compute
+            # Wx * x + b for the whole timeline here in one large matrix multiply, and then the loop
+            # only has to do the small Wh * h multiply for each step.
+            inputLinearUnit, inputLayerNonLinear, _ = self.LayerTuples[0]
+            hiddenLayerTuples = self.LayerTuples[1:]
+            inputLayerStateWeights = inputLinearUnit.weight[:, self.NumInputVars:(self.NumInputVars + self.RecurrentStateSize)]
+            inputLayerInputsTimeline = torch.nn.functional.linear(inputTensor.reshape(numDataSamples, self.NumInputVars),
+                                                                  inputLinearUnit.weight[:, :self.NumInputVars],
+                                                                  inputLinearUnit.bias)
+
+            # The next recurrent state is computed the same way. It is W * [h, x, y] + b, where 
+            # y is the output of the last layer. Split W into [Wh | Wx | Wy], compute Wx * x + b 
+            # for the whole timeline here, and only do Wh * h and Wy * y in the loop. This also 
+            # avoids a torch.cat to build a new combined input vector for each step.
+            stateInputStart = self.RecurrentStateSize
+            stateOutputStart = self.RecurrentStateSize + self.NumInputVars
+            stateLinearUnit = self.rnnStateLinearUnit
+            stateStateWeights = stateLinearUnit.weight[:, :stateInputStart]
+            stateOutputWeights = stateLinearUnit.weight[:, stateOutputStart:]
+            stateInputsTimeline = torch.nn.functional.linear(inputTensor.reshape(numDataSamples, self.NumInputVars),
+                                                             stateLinearUnit.weight[:, stateInputStart:stateOutputStart],
+                                                             stateLinearUnit.bias)
+
             for inputVecNum in range(numDataSamples):
                 currentDayNum = dayNumArray[inputVecNum]
                 if (fAddMinibatchDimension):
-                    vec = inputTensor[inputVecNum][0]
-                    trueResult = trueResultTensor[inputVecNum][0][0].item()
+                    currentInputVec = inputTensor[inputVecNum][0]
                 else:
-                    vec = inputTensor[inputVecNum]
-                    trueResult = trueResultTensor[inputVecNum][0].item()
-                savedInputVecForCurrentSample = vec
+                    currentInputVec = inputTensor[inputVecNum]
                 if (fDebug):
                     print("MLEngine_DeepNeuralNet.forward")
                     print("     currentDayNum = " + str(currentDayNum))
-                    print("     vec = " + str(vec))
-                    print("     trueResult = " + str(trueResult))
+                    print("     currentInputVec = " + str(currentInputVec))
+                    print("     fValidResult = " + str(validResultList[inputVecNum]))
 
                 # If we skipped a few days, then this is a new sequence.
-                if ((prevDayNum > 0) and ((currentDayNum - prevDayNum) > maxDaysSkippedInSameSequence)):
-                    recurrentState = torch.zeros(self.RecurrentStateSize)
+                if (newSequenceList[inputVecNum]):
+                    recurrentState = self.InitialRecurrentState
                     numInputsInCurrentSequence = 0
                     if (fDebug):
-                        print("MLEngine_DeepNeuralNet.forward. Start a new Sequence. currentDayNum=" + str(currentDayNum) + ", prevDayNum=" + str(prevDayNum))
-                # End - if ((prevDayNum > 0) and ((currentDayNum - prevDayNum) > maxDaysSkippedInSameSequence)):
-                prevDayNum = currentDayNum
+                        print("MLEngine_DeepNeuralNet.forward. Start a new Sequence. currentDayNum=" + str(currentDayNum) + ", prevDayNum=" + str(dayNumArray[inputVecNum - 1]))
+                # End - if (newSequenceList[inputVecNum]):
                 numInputsInCurrentSequence += 1
 
-                # The first layer takes in a combined vector
-                # made from both the inputs and the recurrent state.
+                # The first layer takes in a combined vector made from both the inputs and 
+                # the recurrent state. The part from the inputs was computed before the loop.
                 if (fDebug):
-                    print("MLEngine_DeepNeuralNet.forward. Make input vector")
-                    print("     Old vec=" + str(vec))
+                    print("MLEngine_DeepNeuralNet.forward. Compute the first layer")
                     print("     recurrentState=" + str(recurrentState))
-                vec = torch.cat((vec, recurrentState), 0)
+                vec = inputLayerInputsTimeline[inputVecNum] + torch.nn.functional.linear(recurrentState, 
+                                                                                          inputLayerStateWeights)
+                if (inputLayerNonLinear is not None):
+                    vec = inputLayerNonLinear(vec)
                 if (fDebug):
                     print("     New vec=" + str(vec))
 
-                # Pass the vector through each layer of the neural net
-                for layerNum in range(self.NumLayers):
-                    layerInfo = self.NetworkLayers[layerNum]
-
-                    if (layerInfo['MixAnalogDigital']):
-                        vec = torch.cat((vec, inputTensor), 2)
-                    # End - if (layerInfo['MixAnalogDigital']):
+                # Pass the vector through each remaining layer of the neural net
+                for linearUnit, nonLinear, fMixAnalogDigital in hiddenLayerTuples:
+                    # Each step is a single vector, so mix in the inputs for just this step.
+                    if (fMixAnalogDigital):
+                        vec = torch.cat((vec, currentInputVec), 0)
 
-                    vec = self.LinearUnitList[layerNum](vec)
-                    if (layerInfo['NonLinear'] is not None):
-                        vec = layerInfo['NonLinear'](vec)
-                # End - for layerNum in range(self.NumLayers):
+                    vec = linearUnit(vec)
+                    if (nonLinear is not None):
+                        vec = nonLinear(vec)
+                # End - for linearUnit, nonLinear, fMixAnalogDigital in hiddenLayerTuples:
 
                 # Compute the next recurrent state
-                combinedInput = torch.cat((recurrentState, savedInputVecForCurrentSample, vec), 0)
-                recurrentState = self.rnnStateLinearUnit(combinedInput)
+                recurrentState = (stateInputsTimeline[inputVecNum] 
+                                    + torch.nn.functional.linear(recurrentState, stateStateWeights)
+                                    + torch.nn.functional.linear(vec, stateOutputWeights))
 
                 if (fDebug):
                     print("MLEngine_DeepNeuralNet.forward. Done with layers")
                     print("     vec=" + str(vec))
-                    print("     combinedInput=" + str(combinedInput))
                     print("     New recurrentState=" + str(recurrentState))
-                    print("     trueResult=" + str(trueResult) + ", tdf.TDF_INVALID_VALUE=" + str(tdf.TDF_INVALID_VALUE))
-                    print("     trueResult > tdf.TDF_INVALID_VALUE=" + str(trueResult > tdf.TDF_INVALID_VALUE))
+                    print("     fValidResult=" + str(validResultList[inputVecNum]))
 
                 # Save this value if it marks the end of a series
-                if (trueResult > tdf.TDF_INVALID_VALUE):
-                    # Save the result with its gradient. Also, compact the results that we will keep.
+                if (validResultList[inputVecNum]):
+                    # Save the result with its gradient. 
+                    # The true results are compacted with the mask in a single step after the loop.
                     # Don't waste time on compacting inputTensor or dayNumArray, we do not return those.
-                    if (fAddMinibatchDimension):
-                        resultList[numValidResults][0] = vec
-                        trueResultTensor[numValidResults][0][0] = trueResult
-                    else:
-                        resultList[numValidResults] = vec
-                        trueResultTensor[numValidResults][0] = trueResult
-                    numDaysForResult[numValidResults] = numInputsInCurrentSequence
+                    validResultVecList.append(vec)
+                    numDaysForResultList.append(numInputsInCurrentSequence)
                     numValidResults += 1
 
                     if (fDebug):
                         print("MLEngine_DeepNeuralNet.forward. Got a prediction with an associated valid result")
                         print("     numValidResults=" + str(numValidResults))
-                        print("     resultList=" + str(resultList))
-                        print("     trueResultTensor=" + str(trueResultTensor))
-                        print("     resultList.dim()=" + str(resultList.dim()))
-                        print("     trueResultTensor.dim()=" + str(trueResultTensor.dim()))
-                        print("     trueResult.type=" + str(type(trueResult)))
+                        print("     vec=" + str(vec))
 
                     # We do not have to start a new sequence. We do that above only when we see data 
                     # that is not in the same time sequence as the previous data.
                     #recurrentState = torch.zeros(self.RecurrentStateSize)
-                # End - if (trueResult > tdf.TDF_INVALID_VALUE):
+                # End - if (validResultList[inputVecNum]):
             # End - for inputVecNum in range(numDataSamples):
 
+            # Make the results into a single tensor. The results are on the same device as the inputs.
+            if (numValidResults > 0):
+                resultList = torch.stack(validResultVecList)
+            else:
+                resultList = torch.zeros(0, self.NumOutputCategories, device=inputTensor.device, dtype=inputTensor.dtype)
+            if (fAddMinibatchDimension):
+                resultList = resultList.unsqueeze(1)
+            numDaysForResult = torch.tensor(numDaysForResultList, dtype=torch.float32, device=inputTensor.device)
+
+            # Keep only the true results that end a sequence, in the same order as resultList.
+            trueResultTensor = trueResultTensor[validResultMask]
+
             # Truncate the result tensors to just contain valid results.
             if (fAddMinibatchDimension):
                 # Don't waste time on compacting inputTensor or dayNumArray, we do not return those.
@@ -1117,7 +1444,6 @@ class MLEngine_DeepNeuralNet(nn.Module):
                 #inputArray = inputArray[:numValidResults, :self.NumInputVars]
                 resultList = resultList[:numValidResults, :1]
                 trueResultTensor = trueResultTensor[:numValidResults, :1]
-            numDaysForResult = numDaysForResult[:numValidResults]
 
             if (fDebug):
                 print("MLEngine_DeepNeuralNet.forward. Done")
@@ -1133,6 +1459,34 @@ class MLEngine_DeepNeuralNet(nn.Module):
 
 
 
+    #####################################################
+    #
+    # [MLEngine_DeepNeuralNet.ComputeFeedForward]
+    #
+    # Forward prop for a network that is not recurrent. This is a single batch 
+    # through every layer. __init__ may replace self.FeedForward with a compiled 
+    # version of this.
+    #####################################################
+    def ComputeFeedForward(self, inputTensor):
+        if (len(self.LayerSequenceList) > 0):
+            return self.LayerSequenceList[0](inputTensor)
+
+        vec = inputTensor
+        for linearUnit, nonLinear, fMixAnalogDigital in self.LayerTuples:
+            if (fMixAnalogDigital):
+                vec = torch.cat((vec, inputTensor), 2)
+
+            vec = linearUnit(vec)
+            if (nonLinear is not None):
+                vec = nonLinear(vec)
+        # End - for linearUnit, nonLinear, fMixAnalogDigital in self.LayerTuples:
+
+        return vec
+    # End - ComputeFeedForward
+
+
+
+
     #####################################################
     #
     # [MLEngine_DeepNeuralNet.SaveNeuralNetstate]
@@ -1150,25 +1504,20 @@ class MLEngine_DeepNeuralNet(nn.Module):
             layerInfo = self.NetworkLayers[layerNum]
 
             # Do the actual save
-            MLEngine_SaveLinearUnitToJob(self.LinearUnitList[layerNum], job, layerInfo['Name'])
+            weightMatrix = MLEngine_SaveLinearUnitToJob(self.LinearUnitList[layerNum], job, layerInfo['Name'])
 
-            # Save a checksum of the matrix
+            # Save a checksum of the same matrix we just saved.
             checksumName = g_SaveChecksumPrefix + layerInfo['Name']
-            MLEngine_SetArrayChecksum(job, self.LinearUnitList[layerNum], checksumName)
-            # Make sure the save worked
-            if (not MLEngine_ArrayChecksumEqual(job, self.LinearUnitList[layerNum], checksumName, True)):
-                ASSERT_ERROR("MLEngine_DeepNeuralNet.SaveNeuralNetstate. Failed to save a matrix checksum: " + checksumName)
+            MLEngine_SetMatrixChecksum(job, weightMatrix, checksumName)
         # End - for layerNum in range(self.NumLayers):
 
 
         # If this is an RNN, then save the linear unit for the RecurrentVector
         if (self.IsRNN):
-            MLEngine_SaveLinearUnitToJob(self.rnnStateLinearUnit, job, RECURRENT_STATE_LINEAR_UNIT_NAME)
+            weightMatrix = MLEngine_SaveLinearUnitToJob(self.rnnStateLinearUnit, job, RECURRENT_STATE_LINEAR_UNIT_NAME)
 
             # Save the new checksum
-            MLEngine_SetArrayChecksum(job, self.rnnStateLinearUnit, g_SaveChecksumPrefix + RECURRENT_STATE_LINEAR_UNIT_NAME)
-            if (not MLEngine_ArrayChecksumEqual(job, self.rnnStateLinearUnit, g_SaveChecksumPrefix + RECURRENT_STATE_LINEAR_UNIT_NAME, True)):
-                ASSERT_ERROR("Failed to save a matrix checksum: " + RECURRENT_STATE_LINEAR_UNIT_NAME)
+            MLEngine_SetMatrixChecksum(job, weightMatrix, g_SaveChecksumPrefix + RECURRENT_STATE_LINEAR_UNIT_NAME)
         # End - if (self.IsRNN):
     # End - SaveNeuralNetstate
 
@@ -1190,35 +1539,33 @@ class MLEngine_DeepNeuralNet(nn.Module):
         for layerNum in range(self.NumLayers):
             layerInfo = self.NetworkLayers[layerNum]
 
-            restoredTensor = MLEngine_ReadLinearUnitFromJob(job, layerInfo['Name'])
+            fRestored = MLEngine_ReadLinearUnitFromJob(job, layerInfo['Name'], self.LinearUnitList[layerNum])
 
             # We always try to restore, so will also restore even on the first time
             # we used the matrix. In that case, there is no saved state, but that is not an error.
-            if (restoredTensor is not None):
+            if (fRestored):
                 if (fDebug):
                     print("MLEngine_DeepNeuralNet.Restore Tensor for layer " + str(layerNum) + ", " + layerInfo['Name'])
-                self.LinearUnitList[layerNum] = restoredTensor
 
                 # Make sure the tensor we restored matches the checksum.
                 checksumName = g_SaveChecksumPrefix + layerInfo['Name']
-                if (not MLEngine_ArrayChecksumEqual(job, restoredTensor, checksumName, True)):
+                if (not MLEngine_ArrayChecksumEqual(job, self.LinearUnitList[layerNum], checksumName, True)):
                     print("MLEngine_DeepNeuralNet.RestoreNetState. Restored matrix does not match checksum: " + checksumName)
                     print("     checksumName = " + str(checksumName))
                     print("     layerNum = " + str(layerNum))
                     ASSERT_ERROR("MLEngine_DeepNeuralNet.RestoreNetState. Restored matrix does not match checksum")
-            # End - if (restoredTensor is not None):
+            # End - if (fRestored):
         # End - for layerNum in range(self.NumLayers):
 
         # If this is an RNN, then restore the linear unit for the RecurrentVector
         if (self.IsRNN):
-            restoredTensor = MLEngine_ReadLinearUnitFromJob(job, RECURRENT_STATE_LINEAR_UNIT_NAME)
-            if (restoredTensor is not None):
+            fRestored = MLEngine_ReadLinearUnitFromJob(job, RECURRENT_STATE_LINEAR_UNIT_NAME, self.rnnStateLinearUnit)
+            if (fRestored):
                 if (fDebug):
-                    print("MLEngine_DeepNeuralNet.Restore Recurrent State Tensor for RNN is None")
-                self.rnnStateLinearUnit = restoredTensor
+                    print("MLEngine_DeepNeuralNet.Restore Recurrent State Tensor for RNN")
                 if (not MLEngine_ArrayChecksumEqual(job, self.rnnStateLinearUnit, g_SaveChecksumPrefix + RECURRENT_STATE_LINEAR_UNIT_NAME, True)):
                     ASSERT_ERROR("MLEngine_DeepNeuralNet.RestoreNetState. Failed to Restore RNN matrix checksum: " + RECURRENT_STATE_LINEAR_UNIT_NAME)
-            # End - if (restoredTensor is not None):
+            # End - if (fRestored):
         # End - if (self.IsRNN):
     # End - RestoreNetState
 
@@ -1232,45 +1579,52 @@ class MLEngine_DeepNeuralNet(nn.Module):
     #
     # Make sure that backprop correctly updated the local network 
     #####################################################
+    @torch.no_grad()
     def ValidateAndFixModel(self, job, loss, predictionTensor, trueResultTensor):
         fDebug = True
         fVerbose = False
         fValid = True
         fAbortOnError = False
 
+        # Get the arrays for each linear unit once, and use them for both the checks and the checksums.
+        weightMatrixList = [None] * self.NumLayers
+        rnnStateWeightMatrix = None
+
         ##################################################
         if (REPAIR_MATRICES_DURING_VALIDATION):
             for layerNum in range(self.NumLayers):
                 layerInfo = self.NetworkLayers[layerNum]
-                fValid, weightMatrix, biasVector, arrayDimList, numDimensions, numDataSamples = MLEngine_FullCheckLinearUnit(self.LinearUnitList[layerNum], 
-                                                                                                                        layerInfo['Name'])
+                weightMatrix, biasVector = MLEngine_GetLinearUnitArrays(self.LinearUnitList[layerNum])
+                fValid, weightMatrix, biasVector, arrayDimList, numDimensions, numDataSamples = MLEngine_FullCheckLinearUnit(weightMatrix, 
+                                                                                                        biasVector, layerInfo['Name'])
                 if (not fValid):
-                    fValid, repairedLinearUnit = MLEngine_RepairLinearUnit(weightMatrix,
-                                                    biasVector, arrayDimList, numDimensions, numDataSamples)
+                    fValid = MLEngine_RepairLinearUnit_InPlace(self.LinearUnitList[layerNum])
                     if (fValid):
-                        self.LinearUnitList[layerNum] = repairedLinearUnit
+                        weightMatrix, biasVector = MLEngine_GetLinearUnitArrays(self.LinearUnitList[layerNum])
                     else:
                         print("ValidateAndFixModel: Failing. name=" + str(layerInfo['Name']))
                         if (fAbortOnError):
                             raise Exception()
                         return False
                 # End - if (not fValid):
+                weightMatrixList[layerNum] = weightMatrix
             # End - for layerNum in range(self.NumLayers):
 
             # If this is an RNN, then also check the linear unit for the RecurrentVector
             if (self.IsRNN):
-                fValid, weightMatrix, biasVector, arrayDimList, numDimensions, numDataSamples = MLEngine_FullCheckLinearUnit(self.rnnStateLinearUnit, 
-                                                                                                                    RECURRENT_STATE_LINEAR_UNIT_NAME)
+                weightMatrix, biasVector = MLEngine_GetLinearUnitArrays(self.rnnStateLinearUnit)
+                fValid, weightMatrix, biasVector, arrayDimList, numDimensions, numDataSamples = MLEngine_FullCheckLinearUnit(weightMatrix, 
+                                                                                                biasVector, RECURRENT_STATE_LINEAR_UNIT_NAME)
                 if (not fValid):
-                    fValid, repairedLinearUnit = MLEngine_RepairLinearUnit(weightMatrix,
-                                                    biasVector, arrayDimList, numDimensions, numDataSamples)
+                    fValid = MLEngine_RepairLinearUnit_InPlace(self.rnnStateLinearUnit)
                     if (fValid):
-                        self.rnnStateLinearUnit = repairedLinearUnit
+                        weightMatrix, biasVector = MLEngine_GetLinearUnitArrays(self.rnnStateLinearUnit)
                     else:
                         print("ValidateAndFixModel: Failing. name=" + str(RECURRENT_STATE_LINEAR_UNIT_NAME))
                         if (fAbortOnError):
                             raise Exception()
                         return False
+                rnnStateWeightMatrix = weightMatrix
             # End - if (self.IsRNN):
         ##################################################
         else:  # if (not REPAIR_MATRICES_DURING_VALIDATION):
@@ -1294,14 +1648,24 @@ class MLEngine_DeepNeuralNet(nn.Module):
                         raise Exception()
                     return False
             # End - if (self.IsRNN):
+
+            for layerNum in range(self.NumLayers):
+                weightMatrixList[layerNum], _ = MLEngine_GetLinearUnitArrays(self.LinearUnitList[layerNum])
+            if (self.IsRNN):
+                rnnStateWeightMatrix, _ = MLEngine_GetLinearUnitArrays(self.rnnStateLinearUnit)
         # End - if (not REPAIR_MATRICES_DURING_VALIDATION):
 
 
         ##################################################
-        # Each matrix should now be different than its previous state
+        # Save a checksum of the new matrix state. Each matrix should now be different
+        # than its previous state.
+        # When we repair the matrices, we have just checked every value, so the
+        # checksum does not need to check them for NaN again.
+        # Layer 0 is the layer that takes direct inputs
+        # Layer self.NumLayers-1 is the last layer that provides outputs
         for layerNum in range(self.NumLayers):
             layerInfo = self.NetworkLayers[layerNum]
-            if (MLEngine_ArrayChecksumEqual(job, self.LinearUnitList[layerNum], layerInfo['Name'], False)):
+            if (job.UpdateArrayChecksum(weightMatrixList[layerNum], layerInfo['Name'], REPAIR_MATRICES_DURING_VALIDATION)):
                 paramList = list(self.parameters())
                 if (fVerbose):
                     print("\n\nMLEngine_DeepNeuralNet.ValidateAndFixModel Error. Training did not update the weight matrix: " 
@@ -1319,46 +1683,26 @@ class MLEngine_DeepNeuralNet(nn.Module):
                     print(str(list(self.parameters())))
                     ASSERT_ERROR("Training did not update the weight matrix: " + layerInfo['Name'] + ", Nonce=" + str(job.GetNonce()))
                 # End - if (fVerbose):
-            # End - if (MLEngine_ArrayChecksumEqual(job, self.LinearUnitList[layerNum], layerInfo['Name'])):
+            # End - if (job.UpdateArrayChecksum(weightMatrixList[layerNum], layerInfo['Name'], REPAIR_MATRICES_DURING_VALIDATION)):
         # End - for layerNum in range(self.NumLayers):
 
         # If this is an RNN, then also check the linear unit for the RecurrentVector
         if (self.IsRNN):
-            if (MLEngine_ArrayChecksumEqual(job, self.rnnStateLinearUnit, RECURRENT_STATE_LINEAR_UNIT_NAME, False)):
+            if (job.UpdateArrayChecksum(rnnStateWeightMatrix, RECURRENT_STATE_LINEAR_UNIT_NAME, 
+                                        REPAIR_MATRICES_DURING_VALIDATION)):
                 # Do not panic here. The recurrent state seems to cycle through a few states, 
                 # particularly at the beginning.
                 if (False):
-                    #weightMatrix = self.rnnStateLinearUnit.weight.detach().numpy()
-                    #biasVector = self.rnnStateLinearUnit.bias.clone().detach().numpy()
                     print("\n==========")
                     print("Fail Assert. Params=" + str(list(self.parameters())))
                     print("self.rnnStateLinearUnit=" + str(self.rnnStateLinearUnit))
-                    print("self.rnnStateLinearUnit=" + str(weightMatrix))
+                    print("self.rnnStateLinearUnit=" + str(rnnStateWeightMatrix))
                     print("Saved Checksum=" + str(job.GetSavedArrayChecksum(RECURRENT_STATE_LINEAR_UNIT_NAME)))
-                    print("New Checksum=" + str(job.ComputeArrayChecksum(weightMatrix)))
+                    print("New Checksum=" + str(job.ComputeArrayChecksum(rnnStateWeightMatrix)))
                 #print("Hmmm.... Training did not update the RNN weight matrix: " + RECURRENT_STATE_LINEAR_UNIT_NAME)
                 #ASSERT_ERROR("Training did not update the RNN weight matrix: " + RECURRENT_STATE_LINEAR_UNIT_NAME)
         # End - if (self.IsRNN):
 
-        ###############
-        # Save a checksum of the new matrix state
-        # Layer 0 is the layer that takes direct inputs
-        # Layer self.NumLayers-1 is the last layer that provides outputs
-        for layerNum in range(self.NumLayers):
-            layerInfo = self.NetworkLayers[layerNum]
-            MLEngine_SetArrayChecksum(job, self.LinearUnitList[layerNum], layerInfo['Name'])
-            if (not MLEngine_ArrayChecksumEqual(job, self.LinearUnitList[layerNum], layerInfo['Name'], True)):
-                print("\n==========\nFail Assert. Params=" + str(list(self.parameters())) + "\n==============")
-                ASSERT_ERROR("Failed to save a matrix checksum: " + layerInfo['Name'])
-
-        # If this is an RNN, then save the linear unit for the RecurrentVector
-        if (self.IsRNN):
-            MLEngine_SetArrayChecksum(job, self.rnnStateLinearUnit, RECURRENT_STATE_LINEAR_UNIT_NAME)
-            if (not MLEngine_ArrayChecksumEqual(job, self.rnnStateLinearUnit, RECURRENT_STATE_LINEAR_UNIT_NAME, True)):
-                print("\n==========\nFail Assert. Params=" + str(list(self.parameters())) + "\n==============")
-                ASSERT_ERROR("Failed to save a matrix checksum: " + RECURRENT_STATE_LINEAR_UNIT_NAME)
-        # End - if (self.IsRNN):
-
         return fValid
     # End - ValidateAndFixModel
 
@@ -1379,6 +1723,7 @@ class MLEngine_DeepNeuralNet(nn.Module):
     # MLEngine_DeepNeuralNet.CheckState
     #
     #####################################################
+    @torch.no_grad()
     def CheckState(self, job):
         for layerNum in range(self.NumLayers):
             layerInfo = self.NetworkLayers[layerNum]
@@ -1438,14 +1783,15 @@ class MLEngine_LSTMNeuralNet(nn.Module):
         super().__init__()
 
         self.isLogistic = job.GetIsLogisticNetwork()
-        inputNameListStr = job.GetNetworkInputVarNames()
-        inputNameList = inputNameListStr.split(tdf.VARIABLE_LIST_SEPARATOR)
+        inputNameList = MLEngine_GetInputNameList(job.GetNetworkInputVarNames())
         self.NumInputVars = len(inputNameList)
 
         resultValueName = job.GetNetworkOutputVarName()
-        self.NumOutputCategories = tdf.TDF_GetNumClassesForVariable(resultValueName)
+        self.NumOutputCategories = MLEngine_GetNumClassesForVariable(resultValueName)
 
         self.RecurrentStateSize = job.GetNetworkStateSize()
+        self.MaxDaysSkippedInSameSequence = job.GetTrainingParamInt(mlJob.TRAINING_MAX_SKIPPED_DAYS_IN_SAME_SEQUENCE,
+                                                                    DEFAULT_MAX_SKIPPED_DAYS_IN_SAME_SEQUENCE)
         self.NumLayers = 24
         if (fDebug):
             print("self.RecurrentStateSize = " + str(self.RecurrentStateSize))
@@ -1475,7 +1821,8 @@ class MLEngine_LSTMNeuralNet(nn.Module):
             layerOutputSize = self.NumOutputCategories
 
         # Make the linear unit that maps the final hidden state to the output domain
-        self.HiddenToOutput = nn.Linear(self.RecurrentStateSize, layerOutputSize)
+        self.HiddenToOutput = MLEngine_MakeLinearUnit(job, LSTM_LINEAR_UNIT_SAVED_STATE_NAME, 
+                                                      self.RecurrentStateSize, layerOutputSize)
 
         # Create a non-linear.
         nonLinearTypeStr = dxml.XMLTools_GetChildNodeTextAsStr(layerSpecXML, "NonLinear", "ReLU").lower()
@@ -1504,8 +1851,7 @@ class MLEngine_LSTMNeuralNet(nn.Module):
         fDebug = False
 
         # Get Hyperparameters that only apply to an RNN
-        maxDaysSkippedInSameSequence = job.GetTrainingParamInt(mlJob.TRAINING_MAX_SKIPPED_DAYS_IN_SAME_SEQUENCE,
-                                DEFAULT_MAX_SKIPPED_DAYS_IN_SAME_SEQUENCE)
+        maxDaysSkippedInSameSequence = self.MaxDaysSkippedInSameSequence
         if (fDebug):
             print("MLEngine_LSTMNeuralNet.forward. maxDaysSkippedInSameSequence=" + str(maxDaysSkippedInSameSequence))
 
@@ -1738,7 +2084,7 @@ class MLEngine_LSTMNeuralNet(nn.Module):
         self.LSTM = torch.load(ioBuffer)
 
         # Restore the linear unit for the RecurrentVector
-        self.HiddenToOutput = MLEngine_ReadLinearUnitFromJob(job, LSTM_LINEAR_UNIT_SAVED_STATE_NAME)
+        MLEngine_ReadLinearUnitFromJob(job, LSTM_LINEAR_UNIT_SAVED_STATE_NAME, self.HiddenToOutput)
     # End - RestoreNetState
 
 
@@ -1875,7 +2221,10 @@ def MLEngine_MakePyTorchNonLinear(nonLinearTypeStr, fIsLogistic, fIsFinalLayer):
     elif (nonLinearTypeStr == "tanh"):
         newNonLinear = torch.nn.Tanh()
     elif (nonLinearTypeStr == "relu"):
-        newNonLinear = torch.nn.ReLU()
+        # The non-linear always directly follows a linear unit, and the backward pass of a 
+        # linear unit does not need its own output. So, the ReLU can overwrite that output 
+        # in place rather than allocating another tensor of the same size.
+        newNonLinear = torch.nn.ReLU(inplace=True)
     elif (nonLinearTypeStr == "logsoftmax"):
         # A typical deep network will output a 3-dimensional matrix. 
         # This is using Pytorch, so we will always add a miniBatch dimension, and so the 
@@ -1929,39 +2278,26 @@ def MLEngine_NormalizeInputs(job, numDataSets, inputArray, fAddMinibatchDimensio
         print("     preflightInputMins=" + str(preflightInputMins))
         print("     preflightInputRanges=" + str(preflightInputRanges))
 
-    for sampleNum in range(numDataSets):
-        if (fAddMinibatchDimension):
-            inputVec = inputArray[sampleNum][0]
-        else:
-            inputVec = inputArray[sampleNum]
-
-        for inputNum in range(numInputVars):
-            if (preflightInputRanges[inputNum] == 0):
-                # Do not freak about this....some values may always be 0.
-                if (False):
-                    print("ERROR!!!! MLEngine_NormalizeInputs (preflightInputRanges[inputNum] == 0). inputNum=" + str(inputNum))
-                    print("     preflightInputRanges[inputNum]=" + str(preflightInputRanges[inputNum]))
-                    print("     preflightInputMins[inputNum]=" + str(preflightInputMins[inputNum]))
-                    inputNameListStr = job.GetNetworkInputVarNames()
-                    inputNameList = inputNameListStr.split(tdf.VARIABLE_LIST_SEPARATOR)
-                    print("     inputName=" + str(inputNameList[inputNum]))
-                # End - if (False):
-                normValue = 0
-            else:                
-                diffFromMin = (inputVec[inputNum] - preflightInputMins[inputNum])
-                normValue = diffFromMin / preflightInputRanges[inputNum]
-
-            if (fDebug):
-                print("MLEngine_NormalizeInputs. preflightInputMins[inputNum]=" + str(preflightInputMins[inputNum]))
-                print("     preflightInputRanges[inputNum]=" + str(preflightInputRanges[inputNum]))
-                print("     normValue=" + str(normValue))
+    # Normalize the whole timeline with a single array operation rather than
+    # looping over every sample and every variable in Python.
+    # Some values may always be 0, so their range is 0. Do not freak about this,
+    # just normalize those to 0.
+    inputMins = np.asarray(preflightInputMins[:numInputVars], dtype=np.float64)
+    inputRanges = np.asarray(preflightInputRanges[:numInputVars], dtype=np.float64)
+    zeroRangeMask = (inputRanges == 0)
+    inputRanges = np.where(zeroRangeMask, 1.0, inputRanges)
+
+    if (fAddMinibatchDimension):
+        inputView = inputArray[:numDataSets, 0, :numInputVars]
+    else:
+        inputView = inputArray[:numDataSets, :numInputVars]
 
-            if (fAddMinibatchDimension):
-                inputArray[sampleNum][0][inputNum] = normValue
-            else:
-                inputArray[sampleNum][inputNum] = normValue
-        # End - for inputNum in range(numInputVars):
-    # End - for sampleNum in range(numDataSets)
+    normValues = (inputView - inputMins) / inputRanges
+    normValues[:, zeroRangeMask] = 0
+    # The view shares memory with inputArray, so this updates it in place.
+    inputView[...] = normValues
+    if (fDebug):
+        print("MLEngine_NormalizeInputs. normValues=" + str(normValues))
 
     return inputArray
 # End - MLEngine_NormalizeInputs
@@ -1986,16 +2322,22 @@ def MLEngine_NormalizeInputs(job, numDataSets, inputArray, fAddMinibatchDimensio
 #
 ################################################################################
 def MLEngine_TrainGroupOfDataPoints(job, localNeuralNet, localLossFunction, localOptimizer, 
-                                    lossTypeStr, fUsePytorch, cudaIsAvailable, gpuDevice,
+                                    fUsePytorch, cudaIsAvailable, gpuDevice,
                                     inputArray, trueResultArray, dayNumArray, numDataSamples, 
-                                    fAddMinibatchDimension, maxDaysWithZeroValue):
+                                    fAddMinibatchDimension, maxDaysWithZeroValue,
+                                    numAccumulationSteps=1, fApplyUpdate=True):
     fDebug = False
     if (fDebug):
         print("\n==========================================")
         print("MLEngine_TrainGroupOfDataPoints. numDataSamples=" + str(numDataSamples))
         print("trueResultArray = " + str(trueResultArray))
 
-    localNeuralNet.CheckState(job)
+    # Scanning every matrix is expensive, and this runs several times for each timeline.
+    # Only do these checks when we are debugging the job.
+    fCheckState = job.GetDebug()
+
+    if (fCheckState):
+        localNeuralNet.CheckState(job)
     fEveryInputMakesPrediction = localNeuralNet.NeedTrueResultForEveryInput()
     epochNum = job.GetEpochNum()
 
@@ -2011,21 +2353,17 @@ def MLEngine_TrainGroupOfDataPoints(job, localNeuralNet, localLossFunction, loca
             print("MLEngine_TrainGroupOfDataPoints. Normalized inputArray=" + str(inputArray))
 
         # Convert numpy matrices to Pytorch Tensors
+        # The reader returns float32 inputs, so .float() does not copy them.
         inputTensor = torch.from_numpy(inputArray).float()
         trueResultTensor = torch.from_numpy(trueResultArray).float()
 
         # Compare output and ground-truth target in the job.
         # This is NOT a loss function, but rather it only updates job statistics.
         if (epochNum == 0):
-            for index in range(numDataSamples):
-                if (fAddMinibatchDimension):
-                    inputVec = inputArray[index][0]
-                    trueResult = trueResultArray[index][0][0]
-                else:
-                    inputVec = inputArray[index]
-                    trueResult = trueResultArray[index][0]
-                job.RecordTrainingSample(inputVec, trueResult)
-            # End - for index in range(numDataSamples):
+            if (fAddMinibatchDimension):
+                job.RecordTrainingSamples(trueResultArray[:numDataSamples, 0, 0])
+            else:
+                job.RecordTrainingSamples(trueResultArray[:numDataSamples, 0])
         # End - if (epochNum):
 
         if (fDebug):
@@ -2036,8 +2374,10 @@ def MLEngine_TrainGroupOfDataPoints(job, localNeuralNet, localLossFunction, loca
             print("   dayNumArray=" + str(dayNumArray))
 
         if (cudaIsAvailable):
-            inputTensor = inputTensor.to(gpuDevice)
-            trueResultTensor = trueResultTensor.to(gpuDevice)
+            # Copy from page-locked memory so the transfer is an async DMA that can
+            # overlap with the work still queued on the GPU.
+            inputTensor = inputTensor.pin_memory().to(gpuDevice, non_blocking=True)
+            trueResultTensor = trueResultTensor.pin_memory().to(gpuDevice, non_blocking=True)
             print("Converting from CPU to GPU")
             raise Exception()
         # End - if (cudaIsAvailable):
@@ -2050,11 +2390,18 @@ def MLEngine_TrainGroupOfDataPoints(job, localNeuralNet, localLossFunction, loca
         # only contain true values that correspond to a prediction. So, it eliminates all true values that 
         # are placeholders that were associated with one of the intermetdiate inputs.
         localNeuralNet.train()
-        localNeuralNet.CheckState(job)
-        numDataSamples, predictionTensor, trueResultTensor, numDaysForResult = localNeuralNet.forward(job, numDataSamples, 
+        if (fCheckState):
+            localNeuralNet.CheckState(job)
+        with MLEngine_MakeAutocastContext(job, inputTensor.device.type):
+            numDataSamples, predictionTensor, trueResultTensor, numDaysForResult = localNeuralNet.forward(job, numDataSamples, 
                                                                     inputTensor, trueResultTensor, dayNumArray, 
                                                                     fAddMinibatchDimension, maxDaysWithZeroValue)
-        localNeuralNet.CheckState(job)
+        # Always compute the loss in float32. Some loss functions, like BCELoss, are
+        # not safe to run in reduced precision.
+        if ((MLEngine_UseMixedPrecision(job)) and (predictionTensor is not None)):
+            predictionTensor = predictionTensor.float()
+        if (fCheckState):
+            localNeuralNet.CheckState(job)
 
         # Transfer the output back to the CPU so we can access the results
         if ((cudaIsAvailable) and (predictionTensor is not None)):
@@ -2085,8 +2432,10 @@ def MLEngine_TrainGroupOfDataPoints(job, localNeuralNet, localLossFunction, loca
         # Loss (or Divergence or Div). This will also backpropagate and update the weights.
         MLEngine_ComputeTrainingLossAndUpdate(job, predictionTensor, trueResultTensor, 
                                             localNeuralNet, localOptimizer,
-                                            lossTypeStr, localLossFunction)
-        localNeuralNet.CheckState(job)
+                                            localLossFunction,
+                                            numAccumulationSteps, fApplyUpdate)
+        if (fCheckState):
+            localNeuralNet.CheckState(job)
     # End - if (fUsePytorch):
 # End - MLEngine_TrainGroupOfDataPoints
 
@@ -2100,10 +2449,16 @@ def MLEngine_TrainGroupOfDataPoints(job, localNeuralNet, localLossFunction, loca
 # [MLEngine_ComputeTrainingLossAndUpdate]
 # 
 # This procedure is only called for Pytorch.
+#
+# If numAccumulationSteps > 1, then the gradients from several timelines are
+# added together before we update the weights. In that case, the caller passes
+# fApplyUpdate=True only on the last timeline of each group, and the other calls
+# just compute the loss and accumulate its gradients.
 ################################################################################
 def MLEngine_ComputeTrainingLossAndUpdate(job, predictionTensor, trueResultTensor, 
                                         localNeuralNet, localOptimizer,
-                                        lossTypeStr, localLossFunction):
+                                        localLossFunction,
+                                        numAccumulationSteps=1, fApplyUpdate=True):
     fDebug = False
     if (fDebug):
         print("===================================================")
@@ -2111,44 +2466,21 @@ def MLEngine_ComputeTrainingLossAndUpdate(job, predictionTensor, trueResultTenso
         print("     trueResultTensor.size=" + str(trueResultTensor.size()) + " predictionTensor.size=" + str(predictionTensor.size()))
         print("     trueResultTensor=" + str(trueResultTensor))
         print("     predictionTensor=" + str(predictionTensor))
+    fCheckState = job.GetDebug()
 
     # Compute the loss between the prediction and the actual result.
-    # Initially:
-    #   predictionTensor is a 3-d array: [ N, miniBatch=1, C ]
-    #   trueResultTensor is a 3-d array: [ N, miniBatch=1, C ]
-    # Where N is sequence size and C = number of classes
-    # We may have to convert this for different loss functions.
-
-    ##################
-    # nllloss takes parameters:
-    #    predictionTensor is (N,C) 
-    #    trueResult (also called Target) which is (N)
-    if (lossTypeStr == "nllloss"):
-        predictionTensor = predictionTensor[:, -1, :]
-        trueResultTensor = trueResultTensor[:, -1, -1]
-        trueResultTensor = trueResultTensor.long()
-        if (fDebug):
-            print("MLEngine_ComputeTrainingLossAndUpdate. nllloss")
-    # End - if (lossTypeStr == "nllloss"):
-    ##################
-    # bceloss takes parameters:
-    #    predictionTensor is (N, batch, C) 
-    #    trueResult (also called Target) is the same size: (N, batch, C)
-    ##################
-    # L2 Loss (MSELoss) takes 2 matrices of the same size.
-    #   predictionTensor: (N,∗) where ∗*∗ means any number of additional dimensions
-    #   actualResult (also called Target) (N,∗), same shape as the input
-
+    # localLossFunction was built by MLEngine_MakeLossClosure, so it already
+    # reshapes the tensors for the type of loss function in the job.
     loss = localLossFunction(predictionTensor, trueResultTensor)
     if (fDebug):
         print("MLEngine_ComputeTrainingLossAndUpdate. loss.size=" + str(loss.size()))
         print("     loss=" + str(loss) + ",  loss.data=" + str(loss.data) + ", loss.data.item()=" + str(loss.data.item()))
 
-    # Initialize the gradients to 0. This prevents gradients from any previous
-    # data set (ie a timeline) from influencing the learning for the current data set.
-    if (localOptimizer is not None):
-        localOptimizer.zero_grad()
-    localNeuralNet.zero_grad()
+    # When we accumulate gradients over several timelines, scale each loss so the
+    # sum of the gradients is the average over the group.
+    backpropLoss = loss
+    if (numAccumulationSteps > 1):
+        backpropLoss = loss / numAccumulationSteps
 
     # Back-propagate. 
     # This function generates the gradients.
@@ -2158,15 +2490,51 @@ def MLEngine_ComputeTrainingLossAndUpdate(job, predictionTensor, trueResultTenso
     # calculated it. Additionally, each variable in the neural network recorded which
     # vectors and weights were used to compute it, so we can traverse the network in 
     # reverse order, from outputs back to inputs.
+    # Each timeline builds a new graph and we only call backward once on it, so
+    # there is no need to retain the graph after the gradients are computed.
+    # The gradients are reset to 0 after each update, so this adds to any gradients
+    # that were accumulated from the previous timelines in the group.
     try:
-        loss.backward(retain_graph=True)
+        backpropLoss.backward()
     except Exception:  # cuDNN as err:
         print("!!! Error. Caught exception in backward()")
         print("     predictionTensor=" + str(predictionTensor))
         print("     loss=" + str(loss))
         ASSERT_ERROR("MLEngine_ComputeTrainingLossAndUpdate")
 
-    localNeuralNet.CheckState(job)
+    if (fCheckState):
+        localNeuralNet.CheckState(job)
+
+    if (fApplyUpdate):
+        MLEngine_ApplyGradientUpdate(job, localNeuralNet, localOptimizer, 
+                                     loss, predictionTensor, trueResultTensor)
+
+    job.RecordTrainingLoss(loss.data.item())
+
+    if (fCheckState):
+        localNeuralNet.CheckState(job)
+# End - MLEngine_ComputeTrainingLossAndUpdate
+
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_ApplyGradientUpdate]
+# 
+# Update the weights from the gradients that backprop left in the network, then
+# reset the gradients to 0. This prevents gradients from any previous
+# data set (ie a timeline) from influencing the learning for the next data set.
+#
+# loss, predictionTensor and trueResultTensor are only used to print debugging 
+# information, and may be None.
+################################################################################
+def MLEngine_ApplyGradientUpdate(job, localNeuralNet, localOptimizer, 
+                                 loss, predictionTensor, trueResultTensor):
+    fDebug = False
+    fCheckState = job.GetDebug()
 
     if (localOptimizer is not None):
         if (fDebug):
@@ -2176,31 +2544,39 @@ def MLEngine_ComputeTrainingLossAndUpdate(job, predictionTensor, trueResultTenso
         learningRate = float(job.GetTrainingParamStr(mlJob.TRAINING_OPTION_LEARNING_RATE, "0.1"))
         if (learningRate == 0):
             print("!!! Error. 0 Learning Rate")
-            ASSERT_ERROR("MLEngine_ComputeTrainingLossAndUpdate")
+            ASSERT_ERROR("MLEngine_ApplyGradientUpdate")
 
         if (fDebug):
             print("No Optimizer. step=" + str(learningRate))
+        # Update each parameter in place. Assigning to the loop variable would only
+        # rebind a local name and leave the network unchanged.
+        # The foreach version updates all parameters with a single multi-tensor
+        # kernel, rather than a separate dispatch for each tensor.
         with torch.no_grad():
-            for currentParam in localNeuralNet.parameters():
-                if (currentParam.grad is not None):
-                    currentParam = currentParam - (learningRate * currentParam.grad)
+            paramList = [currentParam for currentParam in localNeuralNet.parameters() 
+                                if (currentParam.grad is not None)]
+            gradList = [currentParam.grad for currentParam in paramList]
+            if (hasattr(torch, "_foreach_add_")):
+                torch._foreach_add_(paramList, gradList, alpha=-learningRate)
+            else:
+                for currentParam, currentGrad in zip(paramList, gradList):
+                    currentParam.add_(currentGrad, alpha=-learningRate)
     # End - Update matrices
 
-    localNeuralNet.CheckState(job)
+    if (localOptimizer is not None):
+        localOptimizer.zero_grad()
+    localNeuralNet.zero_grad()
+
+    if (fCheckState):
+        localNeuralNet.CheckState(job)
 
     # Debug - make sure that backprop correctly updated the local network 
     fValid = localNeuralNet.ValidateAndFixModel(job, loss, predictionTensor, trueResultTensor)
     if (not fValid):
-        print("\n\nBail in MLEngine_ComputeTrainingLossAndUpdate")
+        print("\n\nBail in MLEngine_ApplyGradientUpdate")
         raise Exception()
     job.IncrementNonce()
-
-    localNeuralNet.CheckState(job)
-
-    job.RecordTrainingLoss(loss.data.item())
-
-    localNeuralNet.CheckState(job)
-# End - MLEngine_ComputeTrainingLossAndUpdate
+# End - MLEngine_ApplyGradientUpdate
 
 
 
@@ -2254,8 +2630,10 @@ def MLEngine_TestGroupOfDataPoints(job, localNeuralNet, fUsePytorch, cudaIsAvail
     # Transfer the input tensor to GPU. We transferred the recurrent state to the GPU
     # once before the loop began.
     if (cudaIsAvailable):
-        inputGroupSequenceTensor = inputGroupSequenceTensor.to(gpuDevice)
-        trueResultTensor = trueResultTensor.to(gpuDevice)
+        # Copy from page-locked memory so the transfer is an async DMA that can
+        # overlap with the work still queued on the GPU.
+        inputGroupSequenceTensor = inputGroupSequenceTensor.pin_memory().to(gpuDevice, non_blocking=True)
+        trueResultTensor = trueResultTensor.pin_memory().to(gpuDevice, non_blocking=True)
 
     # NOTE!
     # forward() may only return some of the outputs. If the neural network takes a series of inputs to 
@@ -2264,11 +2642,16 @@ def MLEngine_TestGroupOfDataPoints(job, localNeuralNet, fUsePytorch, cudaIsAvail
     # input matrix. For simplicity, forward will also return a list of truncated true values, which will
     # only contain true values that correspond to a prediction. So, it eliminates all true values that 
     # are placeholders that were associated with one of the intermetdiate inputs.
-    with torch.no_grad():
+    # inference_mode is like no_grad, but it also skips the version counters and view 
+    # tracking that autograd would need if these tensors were ever used in training.
+    with torch.inference_mode(), MLEngine_MakeAutocastContext(job, inputGroupSequenceTensor.device.type):
         numDataSamples, predictionTensor, trueResultTensor, numDaysForResult = localNeuralNet.forward(job, numDataSamples, 
                                                                     inputGroupSequenceTensor, trueResultTensor, dayNumArray, 
                                                                     fAddMinibatchDimension, maxDaysWithZeroValue)
-    # End - with torch.no_grad():
+    # End - with torch.inference_mode():
+    # The results are compared to float32 true values, so convert them back from bfloat16.
+    if ((MLEngine_UseMixedPrecision(job)) and (predictionTensor is not None)):
+        predictionTensor = predictionTensor.float()
 
     # Transfer the output back to the CPU so we can access the results
     if (cudaIsAvailable):
@@ -2278,21 +2661,26 @@ def MLEngine_TestGroupOfDataPoints(job, localNeuralNet, fUsePytorch, cudaIsAvail
     predictedResultList = MLEngine_MakeListOfResults(job, predictionTensor, numDataSamples, 
                                                      fUsePytorch, networkOutputDataType)
 
+    # Copy the true results and sequence lengths out of the tensors once, rather than
+    # calling .item() for every sample. On a GPU, each .item() waits for the device.
+    # Pytorch uses a 3rd dimension, for minibatches
+    if (fAddMinibatchDimension):
+        trueResultList = trueResultTensor[:numDataSamples, 0, 0].tolist()
+    else:
+        trueResultList = trueResultTensor[:numDataSamples, 0].tolist()
+    if (numDaysForResult is not None):
+        numDaysForResultList = numDaysForResult[:numDataSamples].tolist()
+
     # Compare predicted outputs to the ground-truth targets.
     # We store the results in the Job, and include lots of statistics like what
     # the accuracy was for different groups of result. 
     for index in range(numDataSamples):
-        # Pytorch uses a 3rd dimension, for minibatches
-        if (fAddMinibatchDimension):
-            trueResult = trueResultTensor[index][0][0].item()
-        else:
-            trueResult = trueResultTensor[index][0].item()
-
+        trueResult = trueResultList[index]
         if (trueResult == tdf.TDF_INVALID_VALUE):
             continue
 
         if (numDaysForResult is not None):
-            subGroupNum = int(numDaysForResult[index])
+            subGroupNum = int(numDaysForResultList[index])
         else:
             subGroupNum = -1
 
@@ -2333,7 +2721,8 @@ def MLEngine_MakeListOfResults(job, predictedResultTensor, numDataSamples, fUseP
             and (networkOutputDataType in (tdf.TDF_DATA_TYPE_FUTURE_EVENT_CLASS, tdf.TDF_DATA_TYPE_BOOL))
             and (not isLogistic)):
         #mostProbableCategoryList = np.asarray([np.argmax(line) for line in predictedResultTensor])
-        predictedResultList = [round(value) for value in predictedResultTensor]
+        # Round all of the outputs in one array operation. Like round(), rint rounds halves to even.
+        predictedResultList = np.rint(np.asarray(predictedResultTensor)).astype(int).tolist()
         return predictedResultList
     # End - if xgBoost and Categorical
 
@@ -2362,24 +2751,16 @@ def MLEngine_MakeListOfResults(job, predictedResultTensor, numDataSamples, fUseP
     # End - if (isLogistic):
     # A category output is a list of probabilities. Get the class ID with the top probability
     elif (networkOutputDataType in (tdf.TDF_DATA_TYPE_FUTURE_EVENT_CLASS, tdf.TDF_DATA_TYPE_BOOL)):
-        predictedResultList = [0] * numDataSamples
-        for index in range(numDataSamples):
-            if (fUsePytorch):
-                topProbability, topIndexTensor = predictedResultTensor[index][0].topk(1)
-                predictedResult = topIndexTensor.item()
-                if (fDebug):
-                    print("MLEngine_MakeListOfResults. topProbability: " + str(topProbability))
-                    print("     topIndexTensor=" + str(topIndexTensor))
-                    print("     topIndexTensor.type=" + str(type(topIndexTensor)))
-                    print("     topIndexTensor.size=" + str(topIndexTensor.shape))
-            else:
-                # <> TODO: Lift making mostProbableCategoryList out of the loop
-                mostProbableCategoryList = np.asarray([np.argmax(line) for line in predictedResultTensor])
-                predictedResult = mostProbableCategoryList[index]
-                if (fDebug):
-                    print("MLEngine_MakeListOfResults. mostProbableCategoryList = " + str(mostProbableCategoryList))
-            predictedResultList[index] = predictedResult
-        # End - for index in range(numDataSamples):
+        # Find the most probable class for every sample at once. argmax is a single pass 
+        # over each row and, unlike topk(1), does not also build a tensor of the top values.
+        if (fUsePytorch):
+            # predictedResultTensor is N x 1 x C where minibatch dim is 1.
+            predictedResultList = predictedResultTensor[:numDataSamples, 0, :].argmax(dim=-1).tolist()
+        else:
+            mostProbableCategoryList = np.argmax(np.asarray(predictedResultTensor), axis=-1)
+            predictedResultList = mostProbableCategoryList[:numDataSamples].tolist()
+        if (fDebug):
+            print("MLEngine_MakeListOfResults. Most probable categories = " + str(predictedResultList))
     # End - elif (tdf.TDF_DATA_TYPE_FUTURE_EVENT_CLASS or tdf.TDF_DATA_TYPE_BOOL)):
 
 
@@ -2468,9 +2849,7 @@ def MLEngine_PreflightOneFilePartitionImpl(job, currentPartitionStart, currentPa
 
         if (numReturnedDataSets >= 1):
             numSamples = inputArray.shape[0]
-            for sampleNum in range(numSamples):
-                job.PreflightData(inputArray[sampleNum], resultArray[sampleNum].item())
-            # End - for sampleNum in range(numSamples):
+            job.PreflightDataArray(inputArray, resultArray)
 
             # This is tricky - a single timeline may have several different classes of result.
             # We consider the timeline to be in its most rare class.
@@ -2517,6 +2896,182 @@ def MLEngine_PreflightOneFilePartitionImpl(job, currentPartitionStart, currentPa
 
 
 
+################################################################################
+#
+# [MLEngine_TrainBatchOfTimelines]
+#
+# Train the data from one or more timelines with a single forward and backward pass.
+# The lists are emptied when this returns, so the caller can start the next batch.
+# This returns the new number of gradients that have not been applied yet.
+################################################################################
+def MLEngine_TrainBatchOfTimelines(job, localNeuralNet, localLossFunction, localOptimizer, 
+                                    fUsePytorch, cudaIsAvailable, gpuDevice,
+                                    batchInputList, batchResultList, batchDayNumList,
+                                    fAddMinibatchDimension, maxDaysWithZeroValue, 
+                                    numAccumulationSteps, numPendingGradients, batchBuffers):
+    if (len(batchInputList) == 1):
+        inputArray = batchInputList[0]
+        resultArray = batchResultList[0]
+        dayNumArray = batchDayNumList[0]
+    else:
+        # Copy the timelines into buffers that are reused for every batch, rather 
+        # than allocate new arrays each time.
+        numDataSamples = sum(len(timelineArray) for timelineArray in batchInputList)
+        inputArray = MLEngine_GetBatchBuffer(batchBuffers, 'input', numDataSamples, batchInputList[0])
+        resultArray = MLEngine_GetBatchBuffer(batchBuffers, 'result', numDataSamples, batchResultList[0])
+        dayNumArray = MLEngine_GetBatchBuffer(batchBuffers, 'dayNum', numDataSamples, batchDayNumList[0])
+        np.concatenate(batchInputList, axis=0, out=inputArray)
+        np.concatenate(batchResultList, axis=0, out=resultArray)
+        np.concatenate(batchDayNumList, axis=0, out=dayNumArray)
+    numDataSamples = len(inputArray)
+    batchInputList.clear()
+    batchResultList.clear()
+    batchDayNumList.clear()
+
+    fCheckState = job.GetDebug()
+    if (fCheckState):
+        localNeuralNet.CheckState(job)
+
+    numPendingGradients += 1
+    fApplyUpdate = (numPendingGradients >= numAccumulationSteps)
+    MLEngine_TrainGroupOfDataPoints(job, localNeuralNet, localLossFunction, localOptimizer, 
+                                    fUsePytorch, cudaIsAvailable, gpuDevice,
+                                    inputArray, resultArray, dayNumArray,
+                                    numDataSamples, fAddMinibatchDimension, 
+                                    maxDaysWithZeroValue, 
+                                    numAccumulationSteps, fApplyUpdate)
+    if (fApplyUpdate):
+        numPendingGradients = 0
+
+    if (fCheckState):
+        localNeuralNet.CheckState(job)
+
+    return numPendingGradients
+# End - MLEngine_TrainBatchOfTimelines
+
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_GetBatchBuffer]
+#
+# Return the first numRows rows of the named buffer in batchBuffers. Each row has
+# the same shape and type as the rows of exampleArray. The buffer is kept and 
+# reused for later batches, and only grows when a batch needs more rows than any
+# earlier one. The rows are not cleared, so the caller must fill all of them.
+################################################################################
+def MLEngine_GetBatchBuffer(batchBuffers, bufferName, numRows, exampleArray):
+    buffer = batchBuffers.get(bufferName)
+    if ((buffer is None) 
+            or (len(buffer) < numRows)
+            or (buffer.shape[1:] != exampleArray.shape[1:])
+            or (buffer.dtype != exampleArray.dtype)):
+        # Grow by at least 2x, so a run of slightly larger batches does not
+        # reallocate each time.
+        numAllocatedRows = numRows
+        if ((buffer is not None) and (buffer.shape[1:] == exampleArray.shape[1:])):
+            numAllocatedRows = max(numRows, 2 * len(buffer))
+        buffer = np.empty((numAllocatedRows,) + exampleArray.shape[1:], dtype=exampleArray.dtype)
+        batchBuffers[bufferName] = buffer
+    # End - if ((buffer is None) ...
+
+    return buffer[:numRows]
+# End - MLEngine_GetBatchBuffer
+
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_ReadTimelinesInBackground]
+#
+# This runs on a background thread while the main thread trains. It parses each
+# timeline in order and hands the arrays to the trainer through a bounded queue,
+# so parsing the next timeline overlaps with the forward/backward pass of the
+# current one. A None entry marks the end of the list. If the parser fails, the
+# exception is put on the queue so the training thread can re-raise it.
+# If the trainer stops early, it sets stopEvent, and this returns before the
+# next timeline.
+#
+# If timelineCache is not None, then it holds the arrays of timelines parsed on 
+# earlier epochs, keyed by the file position of the timeline. Those are copied 
+# from the cache rather than parsed again. The trainer normalizes the inputs in 
+# place, so it always gets a copy and never the cached arrays themselves.
+#
+################################################################################
+def MLEngine_ReadTimelinesInBackground(tdfReader, timelineOrderList, 
+                                       requirePropertyRelationList, requirePropertyNameList, 
+                                       requirePropertyValueList, fAddMinibatchDimension, 
+                                       fEveryInputMakesPrediction, dataQueue, timelineCache, stopEvent):
+    try:
+        for timelineInfo in timelineOrderList:
+            if (stopEvent.is_set()):
+                return
+
+            if ((timelineCache is not None) and (timelineInfo["a"] in timelineCache['timelines'])):
+                numReturnedDataSets, inputArray, resultArray, dayNumArray = timelineCache['timelines'][timelineInfo["a"]]
+                dataQueue.put((numReturnedDataSets, inputArray.copy(), resultArray.copy(), dayNumArray.copy()))
+                continue
+
+            tdfReader.GotoNextTimelineInPartition(timelineInfo["a"], timelineInfo["b"], -1, False)
+            numReturnedDataSets, inputArray, resultArray, dayNumArray = tdfReader.GetDataForCurrentTimeline(requirePropertyRelationList,
+                                                                                requirePropertyNameList,
+                                                                                requirePropertyValueList,
+                                                                                fAddMinibatchDimension,
+                                                                                fEveryInputMakesPrediction,
+                                                                                None)
+            if (numReturnedDataSets >= 1):
+                # The returned arrays are views of larger arrays, so cache compact copies.
+                if (timelineCache is not None):
+                    numBytes = inputArray.nbytes + resultArray.nbytes + dayNumArray.nbytes
+                    if ((timelineCache['numBytes'] + numBytes) <= timelineCache['maxBytes']):
+                        timelineCache['timelines'][timelineInfo["a"]] = (numReturnedDataSets, inputArray.copy(), 
+                                                                        resultArray.copy(), dayNumArray.copy())
+                        timelineCache['numBytes'] += numBytes
+                # End - if (timelineCache is not None):
+                dataQueue.put((numReturnedDataSets, inputArray, resultArray, dayNumArray))
+        # End - for timelineInfo in timelineOrderList:
+    except Exception as err:
+        dataQueue.put(err)
+        return
+
+    dataQueue.put(None)
+# End - MLEngine_ReadTimelinesInBackground
+
+
+
+
+################################################################################
+#
+# [MLEngine_StopBackgroundReader]
+#
+# Stop the thread running MLEngine_ReadTimelinesInBackground and wait for it to exit.
+# The reader may be blocked putting an entry on the full queue, so keep emptying
+# the queue until the thread is done. This is safe to call after the reader has
+# already finished.
+################################################################################
+def MLEngine_StopBackgroundReader(readerThread, dataQueue, stopEvent):
+    stopEvent.set()
+    while (readerThread.is_alive()):
+        try:
+            while (True):
+                dataQueue.get_nowait()
+        except queue.Empty:
+            pass
+        readerThread.join(0.1)
+    # End - while (readerThread.is_alive()):
+# End - MLEngine_StopBackgroundReader
+
+
+
+
+
+
 ################################################################################
 #
 # [MLEngine_TrainOneFilePartitionImpl]
@@ -2529,15 +3084,18 @@ def MLEngine_PreflightOneFilePartitionImpl(job, currentPartitionStart, currentPa
 #   fEOF - True iff we hit the end of the file
 #
 ################################################################################
-def MLEngine_TrainOneFilePartitionImpl(job, currentPartitionStart, currentPartitionStop, 
+def MLEngine_TrainOneFilePartitionImpl(job, partitionConfig, currentPartitionStart, currentPartitionStop, 
                                        localNeuralNet, localLossFunction, localOptimizer, 
-                                       fUsePytorch, cudaIsAvailable, gpuDevice, TimelinesForTrainingPriority):
+                                       fUsePytorch, cudaIsAvailable, gpuDevice, TimelinesForTrainingPriority,
+                                       nextPartitionStart, nextPartitionStop, timelineCache, batchBuffers):
     fDebug = False
     
-    tdfFilePathName = job.GetDataParam("TrainData", "")
-    inputNameListStr = job.GetNetworkInputVarNames()
-    resultValueName = job.GetNetworkOutputVarName()
-    _, requirePropertyRelationList, requirePropertyNameList, requirePropertyValueList = job.GetFilterProperties()
+    tdfFilePathName = partitionConfig['tdfFilePathName']
+    inputNameListStr = partitionConfig['inputNameListStr']
+    resultValueName = partitionConfig['resultValueName']
+    requirePropertyRelationList = partitionConfig['requirePropertyRelationList']
+    requirePropertyNameList = partitionConfig['requirePropertyNameList']
+    requirePropertyValueList = partitionConfig['requirePropertyValueList']
     if (fDebug):
         print("MLEngine_TrainOneFilePartitionImpl. currentPartitionStart = " + str(currentPartitionStart))
         print("     currentPartitionStop = " + str(currentPartitionStop))
@@ -2547,12 +3105,30 @@ def MLEngine_TrainOneFilePartitionImpl(job, currentPartitionStart, currentPartit
                                             requirePropertyNameList)
     maxDaysWithZeroValue = tdfReader.GetMaxDaysWithZeroValue()
 
-    # Get some properties that are used for each training.
-    lossTypeStr = job.GetTrainingParamStr(mlJob.TRAINING_OPTION_LOSS_FUNCTION_ELEMENT_NAME, "").lower()
-    priorityPolicy = job.GetTrainingParamStr(mlJob.TRAINING_OPTION_RESULT_PRIORITY_POLICY_ELEMENT_NAME, "").lower()
+    # We read the timelines in this partition in a random order, so the kernel will not 
+    # read ahead for us. Ask it to load this whole partition now. Also ask it to start on 
+    # the next partition, so that is read from disk while we train this one.
+    tdfReader.PrefetchFileRange(currentPartitionStart, currentPartitionStop)
+    if (nextPartitionStart >= 0):
+        tdfReader.PrefetchFileRange(nextPartitionStart, nextPartitionStop)
 
     fEveryInputMakesPrediction = localNeuralNet.NeedTrueResultForEveryInput()
 
+    # We may add up the gradients from several timelines and then update the weights once.
+    numAccumulationSteps = partitionConfig['numAccumulationSteps']
+    numPendingGradients = 0
+
+    # If every input makes its own prediction, then we can stack the data points from 
+    # several timelines and train them all with a single forward and backward pass.
+    # Recurrent networks carry state from one data point to the next, so they still train
+    # each timeline on its own.
+    numTimelinesPerBatch = partitionConfig['numTimelinesPerBatch']
+    if ((numTimelinesPerBatch < 1) or (not fEveryInputMakesPrediction)):
+        numTimelinesPerBatch = 1
+    batchInputList = []
+    batchResultList = []
+    batchDayNumList = []
+
     # In some cases, we add a batches dimension to all data:
     #   Pytorch wants data in the form: (NumSamples x NumBatches x NumFeatures)
     #   XGBoost wants data in the form: (NumSamples x NumFeatures)
@@ -2585,44 +3161,15 @@ def MLEngine_TrainOneFilePartitionImpl(job, currentPartitionStart, currentPartit
     # Now, train one timeline from each level of data priority.
     # The more rare results are higher priority which is a lower index.
     # So, priority 0 is the highest priority and most rare.
-    numTimelinesProcessed = 0
-    numDataPointsProcessed = 0
+    # The order does not depend on the training results, so build it up front
+    # and let a background thread parse the timelines in that order.
+    timelineOrderList = []
     for timelineIndexAtEachPriority in range(maxNumPtsAtAnyPriority):
         numPrioritiesProcessed = 0
         for priorityLevel in range(numTrainingPriorities):
-            ptList = TimelinesForTrainingPriority[priorityLevel]
             if (timelineIndexAtEachPriority < NumTimelinesAtEachPriority[priorityLevel]):                
-                timelineInfo = ptList[timelineIndexAtEachPriority]
+                timelineOrderList.append(TimelinesForTrainingPriority[priorityLevel][timelineIndexAtEachPriority])
                 numPrioritiesProcessed += 1
-
-                tdfReader.GotoNextTimelineInPartition(timelineInfo["a"], timelineInfo["b"], -1, False)
-                numReturnedDataSets, inputArray, resultArray, dayNumArray = tdfReader.GetDataForCurrentTimeline(requirePropertyRelationList,
-                                                                                    requirePropertyNameList,
-                                                                                    requirePropertyValueList,
-                                                                                    fAddMinibatchDimension,
-                                                                                    fEveryInputMakesPrediction,
-                                                                                    None)
-                if (numReturnedDataSets >= 1):
-                    if (fDebug):
-                        print("MLEngine_TrainOneFilePartitionInChildProcess")
-                        print("     maxDaysWithZeroValue=" + str(maxDaysWithZeroValue))
-                        print("     fEveryInputMakesPrediction=" + str(fEveryInputMakesPrediction))
-                        print("     numReturnedDataSets=" + str(numReturnedDataSets))
-                        print("     inputArray=" + str(inputArray))
-                        print("     resultArray=" + str(resultArray))
-
-                    localNeuralNet.CheckState(job)
-                    MLEngine_TrainGroupOfDataPoints(job, localNeuralNet, localLossFunction, localOptimizer, 
-                                                    lossTypeStr, fUsePytorch, cudaIsAvailable, gpuDevice,
-                                                    inputArray, resultArray, dayNumArray,
-                                                    numReturnedDataSets, fAddMinibatchDimension, 
-                                                    maxDaysWithZeroValue)
-                    localNeuralNet.CheckState(job)
-
-                    numTimelinesProcessed += 1
-                    numDataPointsProcessed += numReturnedDataSets
-                # if (numReturnedDataSets >= 1):
-            # End - if (timelineIndexAtEachPriority < NumTimelinesAtEachPriority[priorityLevel]):
         # End - for priorityLevel in range(numTrainingPriorities):
 
         # Stop processing when one of several conditions are met
@@ -2632,7 +3179,74 @@ def MLEngine_TrainOneFilePartitionImpl(job, currentPartitionStart, currentPartit
             break
     # End - for timelineIndexAtEachPriority in range(maxNumPtsAtAnyPriority):
 
-    tdfReader.Shutdown()
+    # Keep the queue short. Each entry holds the full arrays for one timeline,
+    # and the reader usually only needs to stay a little ahead of the trainer.
+    dataQueue = queue.Queue(maxsize=partitionConfig['prefetchDepth'])
+    stopReaderEvent = threading.Event()
+    readerThread = threading.Thread(target=MLEngine_ReadTimelinesInBackground,
+                                    args=(tdfReader, timelineOrderList, 
+                                          requirePropertyRelationList, requirePropertyNameList, 
+                                          requirePropertyValueList, fAddMinibatchDimension, 
+                                          fEveryInputMakesPrediction, dataQueue, timelineCache,
+                                          stopReaderEvent),
+                                    daemon=True)
+    readerThread.start()
+
+    numTimelinesProcessed = 0
+    numDataPointsProcessed = 0
+    # This worker process is reused for later jobs, so if training fails, we must still
+    # stop the reader thread and close the file. Otherwise, every failure would leave a 
+    # thread blocked on the queue and the file still mapped.
+    try:
+        while (True):
+            queueEntry = dataQueue.get()
+            if (queueEntry is None):
+                break
+            if (isinstance(queueEntry, Exception)):
+                raise queueEntry
+            numReturnedDataSets, inputArray, resultArray, dayNumArray = queueEntry
+
+            if (fDebug):
+                print("MLEngine_TrainOneFilePartitionInChildProcess")
+                print("     maxDaysWithZeroValue=" + str(maxDaysWithZeroValue))
+                print("     fEveryInputMakesPrediction=" + str(fEveryInputMakesPrediction))
+                print("     numReturnedDataSets=" + str(numReturnedDataSets))
+                print("     inputArray=" + str(inputArray))
+                print("     resultArray=" + str(resultArray))
+
+            batchInputList.append(inputArray)
+            batchResultList.append(resultArray)
+            batchDayNumList.append(dayNumArray)
+            if (len(batchInputList) >= numTimelinesPerBatch):
+                numPendingGradients = MLEngine_TrainBatchOfTimelines(job, localNeuralNet, localLossFunction, 
+                                            localOptimizer, fUsePytorch, 
+                                            cudaIsAvailable, gpuDevice,
+                                            batchInputList, batchResultList, batchDayNumList,
+                                            fAddMinibatchDimension, maxDaysWithZeroValue, 
+                                            numAccumulationSteps, numPendingGradients, batchBuffers)
+
+            numTimelinesProcessed += 1
+            numDataPointsProcessed += numReturnedDataSets
+        # End - while (True):
+    finally:
+        MLEngine_StopBackgroundReader(readerThread, dataQueue, stopReaderEvent)
+        tdfReader.Shutdown()
+    # End - try
+
+    # Train any timelines left over in the last, partial batch.
+    if (len(batchInputList) > 0):
+        numPendingGradients = MLEngine_TrainBatchOfTimelines(job, localNeuralNet, localLossFunction, 
+                                                    localOptimizer, fUsePytorch, 
+                                                    cudaIsAvailable, gpuDevice,
+                                                    batchInputList, batchResultList, batchDayNumList,
+                                                    fAddMinibatchDimension, maxDaysWithZeroValue, 
+                                                    numAccumulationSteps, numPendingGradients, batchBuffers)
+
+    # Apply any gradients left over from the last, partial group of timelines.
+    # Otherwise, they would be lost when this process exits.
+    if ((fUsePytorch) and (numPendingGradients > 0)):
+        MLEngine_ApplyGradientUpdate(job, localNeuralNet, localOptimizer, None, None, None)
+
     localNeuralNet.CheckState(job)
 
     return job, numTimelinesProcessed, numDataPointsProcessed
@@ -2652,15 +3266,17 @@ def MLEngine_TrainOneFilePartitionImpl(job, currentPartitionStart, currentPartit
 #   fEOF - True iff we hit the end of the file
 #
 ################################################################################
-def MLEngine_TestOneFilePartitionImpl(job, currentPartitionStart, currentPartitionStop, 
+def MLEngine_TestOneFilePartitionImpl(job, partitionConfig, currentPartitionStart, currentPartitionStop, 
                                       localNeuralNet, fUsePytorch, cudaIsAvailable, gpuDevice):
     fDebug = False
 
-    tdfFilePathName = job.GetDataParam("TestData", "")
-    inputNameListStr = job.GetNetworkInputVarNames()
-    resultValueName = job.GetNetworkOutputVarName()
-    _, requirePropertyRelationList, requirePropertyNameList, requirePropertyValueList = job.GetFilterProperties()
-    networkOutputDataType = job.GetResultValueType()
+    tdfFilePathName = partitionConfig['tdfFilePathName']
+    inputNameListStr = partitionConfig['inputNameListStr']
+    resultValueName = partitionConfig['resultValueName']
+    requirePropertyRelationList = partitionConfig['requirePropertyRelationList']
+    requirePropertyNameList = partitionConfig['requirePropertyNameList']
+    requirePropertyValueList = partitionConfig['requirePropertyValueList']
+    networkOutputDataType = partitionConfig['networkOutputDataType']
 
     # Pytorch wants data (NumSamples x NumBatches x NumFeatures) while
     # XGBoost wants data (NumSamples x NumFeatures)
@@ -2676,20 +3292,55 @@ def MLEngine_TestOneFilePartitionImpl(job, currentPartitionStart, currentPartiti
                                             requirePropertyNameList)
     maxDaysWithZeroValue = tdfReader.GetMaxDaysWithZeroValue()
 
+    # Testing goes through the file in order, and the next partition is the same size and 
+    # starts where this one stops. Ask the kernel to start reading it now, while we test this one.
+    tdfReader.PrefetchFileRange(currentPartitionStop, currentPartitionStop + (currentPartitionStop - currentPartitionStart))
+
+    # If every input makes its own prediction, then the timelines do not depend on each 
+    # other, so read the whole partition into one set of arrays and test it with a 
+    # single forward pass. Recurrent networks still test each timeline on its own.
+    if (fEveryInputMakesPrediction):
+        numTimelinesProcessed, numDataPoints, inputArray, resultArray, dayNumArray, _, fEOF = tdfReader.GetDataForAllTimelinesInPartition(
+                                                                            currentPartitionStart, currentPartitionStop,
+                                                                            requirePropertyRelationList,
+                                                                            requirePropertyNameList,
+                                                                            requirePropertyValueList,
+                                                                            fAddMinibatchDimension,
+                                                                            fEveryInputMakesPrediction)
+        if (numDataPoints >= 1):
+            MLEngine_TestGroupOfDataPoints(job, localNeuralNet, fUsePytorch, cudaIsAvailable, gpuDevice,
+                                           inputArray, resultArray, dayNumArray,
+                                           numDataPoints, fAddMinibatchDimension, 
+                                           networkOutputDataType, maxDaysWithZeroValue)
+
+        tdfReader.ReleaseFileRange(currentPartitionStart, currentPartitionStop)
+        tdfReader.Shutdown()
+        return job, numTimelinesProcessed, fEOF
+    # End - if (fEveryInputMakesPrediction):
+
     #######################################
     # This loop looks at each timeline in the current partition
     # Unlike training, the order does not matter. The arrays are not changing
     # and We compute the accuracy for every timeline, no matter the order.
     numTimelinesProcessed = 0
-    fFoundTimeline, fEOF, _, _ = tdfReader.GotoFirstTimelineInPartition(-1, -1, currentPartitionStart, currentPartitionStop, False)
-    while ((not fEOF) and (fFoundTimeline)):
+    # Find where all of the timelines are first, and then read each one at its known position.
+    timelinePositionList, fEOF = tdfReader.FindAllTimelinesInPartition(currentPartitionStart, currentPartitionStop)
+    for timelinePosition in timelinePositionList:
+        fFoundTimeline, _, _, _ = tdfReader.GotoNextTimelineInPartition(timelinePosition["start"], timelinePosition["stop"], 
+                                                                    -1, False)
+        if (not fFoundTimeline):
+            break
+
         # Get all data points for a single timeline. 
+        # We are done with the arrays before we read the next timeline, so the reader can
+        # fill the same buffers each time rather than allocating new ones.
         numReturnedDataSets, inputArray, resultArray, dayNumArray = tdfReader.GetDataForCurrentTimeline(requirePropertyRelationList,
                                                                             requirePropertyNameList,
                                                                             requirePropertyValueList,
                                                                             fAddMinibatchDimension,
                                                                             fEveryInputMakesPrediction,
-                                                                            None)
+                                                                            None,
+                                                                            fReuseBuffers=True)
         if (numReturnedDataSets >= 1):
             if (fDebug):
                 print("MLEngine_TestOneFilePartitionImpl. numReturnedDataSets=" + str(numReturnedDataSets))
@@ -2699,11 +3350,11 @@ def MLEngine_TestOneFilePartitionImpl(job, currentPartitionStart, currentPartiti
                                            networkOutputDataType, maxDaysWithZeroValue)
         # End - if (numReturnedDataSets >= 1):
 
-        # Go to the next timeline in this partition
         numTimelinesProcessed += 1
-        fFoundTimeline, fEOF, _, _ = tdfReader.GotoNextTimelineInPartition(-1, -1, currentPartitionStop, False)
-    # End - while ((not fEOF) and (fFoundTimeline)):
+    # End - for timelinePosition in timelinePositionList:
 
+    # Testing reads each partition only once, so let the kernel drop it from the page cache.
+    tdfReader.ReleaseFileRange(currentPartitionStart, currentPartitionStop)
     tdfReader.Shutdown()
 
     return job, numTimelinesProcessed, fEOF
@@ -2742,6 +3393,104 @@ def MLEngine_CreateNeuralNetFromJobSpec(job):
 
 
 
+################################################################################
+#
+# [MLEngine_MakeAutocastContext]
+#
+# Return the context to run a forward pass in. With mixed precision, the linear
+# units run in bfloat16, which halves the memory traffic and lets the GPU use its
+# tensor cores. bfloat16 has the same exponent range as float32, so unlike float16
+# it does not need a GradScaler to keep the gradients from underflowing.
+################################################################################
+def MLEngine_MakeAutocastContext(job, deviceTypeStr):
+    if (not MLEngine_UseMixedPrecision(job)):
+        return contextlib.nullcontext()
+
+    return torch.autocast(device_type=deviceTypeStr, dtype=torch.bfloat16)
+# End - MLEngine_MakeAutocastContext
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_UseMixedPrecision]
+#
+# Mixed precision is on if it is on for every job, or if this job asks for it.
+################################################################################
+def MLEngine_UseMixedPrecision(job):
+    if (not hasattr(torch, "autocast")):
+        return False
+    return ((USE_MIXED_PRECISION) or (job.GetMixedPrecision()))
+# End - MLEngine_UseMixedPrecision
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_CompileNeuralNet]
+#
+# torch.compile traces the forward pass and generates fused kernels, so the 
+# linear units and the non-linears that follow them do not each go through a
+# separate Python dispatch. 
+#
+# We let torch.compile decide which dimensions are dynamic. The first compile
+# specializes on every dimension. When a new timeline length shows up, it recompiles
+# once with only the sequence dimension made symbolic. The number of input values
+# and the minibatch dimension are fixed for a job, so they stay constants in the
+# generated kernels. Forcing dynamic=True would make those symbolic too.
+#
+# We do not use torch.jit.script here. Every forward() takes the job object and
+# reads hyperparameters from it, and TorchScript cannot compile calls on an
+# arbitrary Python object. torch.compile instead falls back to Python for those
+# calls and still compiles the tensor operations around them.
+#
+# compileTarget is either a whole network or one of its methods. Some networks
+# compile just the tensor operations of their forward pass in their constructor.
+# This is the only place that calls torch.compile, so every network is compiled
+# the same way:
+#   - Debug jobs are never compiled, so they can be stepped through.
+#   - fReduceOverhead replays the kernels with CUDA graphs. This only helps on a 
+#     GPU, so it is ignored when we do not use one.
+#   - dynamicShapes is passed to torch.compile as dynamic. None lets torch.compile
+#     decide, as described above.
+#
+# This returns compileTarget itself if it is not compiled.
+################################################################################
+def MLEngine_CompileNeuralNet(job, compileTarget, fReduceOverhead, dynamicShapes, fFullGraph):
+    if ((not USE_TORCH_COMPILE) or (not hasattr(torch, "compile")) or (job.GetDebug())):
+        return compileTarget
+
+    # Some networks already compiled the tensor operations of their forward pass.
+    if (getattr(compileTarget, "fCompiledInternally", False)):
+        return compileTarget
+
+    compileModeStr = "default"
+    if ((fReduceOverhead) and (USE_GPU)):
+        compileModeStr = "reduce-overhead"
+
+    try:
+        # torch.compile is lazy, so a failure shows up on the first forward pass.
+        # Then run that part in eager mode rather than failing the whole job.
+        import torch._dynamo
+        torch._dynamo.config.suppress_errors = True
+        compiledTarget = torch.compile(compileTarget, mode=compileModeStr, 
+                                       dynamic=dynamicShapes, fullgraph=fFullGraph)
+    except Exception:
+        print("MLEngine_CompileNeuralNet. torch.compile failed, using the eager network")
+        return compileTarget
+
+    return compiledTarget
+# End - MLEngine_CompileNeuralNet
+
+
+
+
+
+
 ################################################################################
 #
 # [MLEngine_CreateLossFunctionForJob]
@@ -2800,12 +3549,54 @@ def MLEngine_CreateLossFunctionForJob(job):
 
 
 
+################################################################################
+#
+# [MLEngine_MakeLossClosure]
+#
+# Wrap the loss function in a closure that takes (predictionTensor, trueResultTensor).
+# The choice of how to reshape the tensors depends only on the loss type, so
+# we make it once when the worker builds its training state, rather than
+# comparing strings each time we train a timeline.
+#
+# Initially:
+#   predictionTensor is a 3-d array: [ N, miniBatch=1, C ]
+#   trueResultTensor is a 3-d array: [ N, miniBatch=1, C ]
+# Where N is sequence size and C = number of classes
+#
+# nllloss takes parameters:
+#    predictionTensor is (N,C) 
+#    trueResult (also called Target) which is (N)
+# bceloss takes parameters:
+#    predictionTensor is (N, batch, C) 
+#    trueResult (also called Target) is the same size: (N, batch, C)
+# L2 Loss (MSELoss) takes 2 matrices of the same size.
+#   predictionTensor: (N,∗) where ∗*∗ means any number of additional dimensions
+#   actualResult (also called Target) (N,∗), same shape as the input
+################################################################################
+def MLEngine_MakeLossClosure(lossTypeStr, localLossFunction):
+    if (lossTypeStr == "nllloss"):
+        def ComputeNLLLoss(predictionTensor, trueResultTensor):
+            return localLossFunction(predictionTensor[:, -1, :], trueResultTensor[:, -1, -1].long())
+        return ComputeNLLLoss
+    # End - if (lossTypeStr == "nllloss"):
+
+    # The other loss functions take the tensors as they are.
+    return localLossFunction
+# End - MLEngine_MakeLossClosure
+
+
+
+
+
+
 ################################################################################
 #
 # [MLEngine_ReturnResultsFromChildProcess]
 #
+# Package up the results of one partition. The worker pool sends the returned 
+# dictionary back to the control process.
 ################################################################################
-def MLEngine_ReturnResultsFromChildProcess(sendPipeEnd, job, numTimelinesProcessed, numSkippedTimelines, numDataPointsProcessed,
+def MLEngine_ReturnResultsFromChildProcess(job, numTimelinesProcessed, numSkippedTimelines, numDataPointsProcessed,
                                             fEOF, startPosFirstTimelineInPartition, stopPosLastTimelineInPartition, 
                                             err, timelinePositionList):
     resultDict = {'jobStr': "", 
@@ -2820,9 +3611,7 @@ def MLEngine_ReturnResultsFromChildProcess(sendPipeEnd, job, numTimelinesProcess
     if (job is not None):
         resultDict['jobStr'] = job.WriteJobToString()
 
-    sendPipeEnd.send(resultDict)
-
-    sendPipeEnd.close()
+    return resultDict
 # End - MLEngine_ReturnResultsFromChildProcess
 
 
@@ -2832,74 +3621,357 @@ def MLEngine_ReturnResultsFromChildProcess(sendPipeEnd, job, numTimelinesProcess
 
 ################################################################################
 #
-# [MLEngine_TrainOneFilePartitionInChildProcess]
+# [MLEngine_ReturnErrorFromChildProcess]
 #
-# This runs in a worker process, which may be another process on the same machine
-# or else a process on a remote server on the network.
-# All inputs and outputs are passed as strings and integers.
-# The job is serialized/deserialized as a string of XML text, so it can be passed
-# as a parameter string, modified, then returned as a result string.
-################################################################################
-def MLEngine_TrainOneFilePartitionInChildProcess(sendPipeEnd, jobStr,
-                                            currentPartitionStart, currentPartitionStop,
-                                            TimelinesForTrainingPriorityStr):
-    global g_ChildProcessPipe
-    g_ChildProcessPipe = sendPipeEnd
-    totalSkippedTimelines = 0
-    fDebug = False
+# Package up a failure in the worker. This only carries the error code and a
+# message, since the control process stops as soon as it sees an error and
+# never looks at the other results.
+################################################################################
+def MLEngine_ReturnErrorFromChildProcess(err, errMsg):
+    return {'err': err, 'errMsg': errMsg}
+# End - MLEngine_ReturnErrorFromChildProcess
 
-    #<> Debugging Only!
-    torch.autograd.set_detect_anomaly(True)
 
-    if (fDebug):
-        print("MLEngine_TrainOneFilePartitionInChildProcess start.")
-        print("     currentPartitionStart = " + str(currentPartitionStart))
-        print("     currentPartitionStop = " + str(currentPartitionStop))
 
-    # Regenerate the runtime job object from its serialized string form. 
-    job = mlJob.MLJob_CreateMLJobFromString(jobStr)
 
-    # Convert other strings passed accross address spaces to a runtime data structure.
-    TimelinesForTrainingPriority = json.loads(TimelinesForTrainingPriorityStr)
 
-    # Create the neural network in this address space.
-    localNeuralNet = MLEngine_CreateNeuralNetFromJobSpec(job)
-    if (localNeuralNet is None):
-        if (fDebug):
-            print("MLEngine_TrainOneFilePartitionInChildProcess Failed making neural net.")
-        MLEngine_ReturnResultsFromChildProcess(sendPipeEnd, job, 0, 0, 0, False, -1, -1, E_SERVER_ERROR, "")
-        return
 
-    # Many of the models are in Pytorch, but not all anymore, and some parts
-    # of training and testing rely on the type of software used.
-    fUsePytorch = False
-    if (localNeuralNet.GetLibraryName() == "Pytorch"):
-        fUsePytorch = True
+################################################################################
+#
+# [MLEngine_WaitForWorkerResult]
+#
+# Wait for a partition to finish in the worker process and return its result dictionary.
+# If the worker raised an exception, like an ASSERT_ERROR, then this returns a 
+# result that says E_ASSERT_ERROR, so the control process can stop cleanly.
+################################################################################
+def MLEngine_WaitForWorkerResult(future):
+    try:
+        resultDict = future.result()
+    except Exception as err:
+        print("MLEngine_WaitForWorkerResult. Worker process failed: " + str(err))
+        resultDict = MLEngine_ReturnErrorFromChildProcess(E_ASSERT_ERROR, str(err))
 
-    # Check if we can use the GPU.
-    cudaIsAvailable = False
-    gpuDevice = None
-    if ((fUsePytorch) and (USE_GPU) and (job.OKToUseGPU())):
-        cudaIsAvailable = torch.cuda.is_available()
-        if (cudaIsAvailable):
-            numGPUs = torch.cuda.device_count()
-            gpuDevice = torch.device('cuda')
-            if ((numGPUs <= 0) or (gpuDevice is None)):
-                cudaIsAvailable = False
-        # End - if (cudaIsAvailable):
-    # End - if (USE_GPU)
+    return resultDict
+# End - MLEngine_WaitForWorkerResult
 
-    if (cudaIsAvailable):
-        localNeuralNet = localNeuralNet.to(gpuDevice)
 
-    # Create the loss function in this address space.
+
+
+
+
+################################################################################
+#
+# [MLEngine_InitWorkerProcess]
+#
+# This is the initializer for a worker pool that only runs one job, so it runs once 
+# when the worker process starts. See MLEngine_LoadJobInWorker.
+################################################################################
+def MLEngine_InitWorkerProcess(jobStr, numWorkers):
+    MLEngine_LoadJobInWorker(jobStr, numWorkers)
+# End - MLEngine_InitWorkerProcess
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_LoadJobInWorker]
+#
+# This runs in the worker process when it starts on a new job. The job is parsed
+# here one time, and it then stays in the worker for the whole training or testing 
+# phase. Each partition only passes a few numbers back and forth, and the control
+# process gets the job back once at the end.
+# Anything left from a previous job in this worker is dropped.
+################################################################################
+def MLEngine_LoadJobInWorker(jobStr, numWorkers):
+    global g_WorkerJob, g_WorkerTrainingState, g_WorkerPartitionConfig, g_WorkerTestingState, g_WorkerTimelineCache
+    MLEngine_SetWorkerThreads(numWorkers)
+    g_WorkerTrainingState = None
+    g_WorkerPartitionConfig = None
+    g_WorkerTestingState = None
+    g_WorkerTimelineCache = None
+    g_CheckScratchArrays.clear()
+    g_WorkerJob = mlJob.MLJob_CreateMLJobFromString(jobStr)
+    MLEngine_SetMatmulPrecision(g_WorkerJob)
+# End - MLEngine_LoadJobInWorker
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_UnloadJobInWorker]
+#
+# This runs in the worker process when the control process is done with its job.
+# It frees the network, the cached timelines and the job, so an idle worker 
+# does not hold on to them until the next job.
+################################################################################
+def MLEngine_UnloadJobInWorker():
+    global g_WorkerJob, g_WorkerTrainingState, g_WorkerPartitionConfig, g_WorkerTestingState, g_WorkerTimelineCache
+    g_WorkerJob = None
+    g_WorkerTrainingState = None
+    g_WorkerPartitionConfig = None
+    g_WorkerTestingState = None
+    g_WorkerTimelineCache = None
+    g_CheckScratchArrays.clear()
+# End - MLEngine_UnloadJobInWorker
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_GetSingleWorkerPool]
+#
+# This runs in the control process. It returns the pool with the one worker process
+# that trains and tests a job, after loading the job into that worker.
+# The pool is started on the first job and then reused for every job after that.
+# If the worker process died, then this starts a new one.
+################################################################################
+def MLEngine_GetSingleWorkerPool(job):
+    global g_SingleWorkerPool
+
+    jobStr = job.WriteJobToString()
+    for attemptNum in range(2):
+        if (g_SingleWorkerPool is None):
+            g_SingleWorkerPool = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+
+        try:
+            g_SingleWorkerPool.submit(MLEngine_LoadJobInWorker, jobStr, 1).result()
+            return g_SingleWorkerPool
+        except concurrent.futures.BrokenExecutor as err:
+            print("MLEngine_GetSingleWorkerPool. Worker process died, starting a new one: " + str(err))
+            MLEngine_ShutdownWorkerPool()
+    # End - for attemptNum in range(2):
+
+    ASSERT_ERROR("MLEngine_GetSingleWorkerPool. Could not start a worker process")
+# End - MLEngine_GetSingleWorkerPool
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_ReleaseSingleWorkerPool]
+#
+# This runs in the control process when it is done with the job in the worker.
+# The worker process keeps running, so the next job can use it.
+################################################################################
+def MLEngine_ReleaseSingleWorkerPool(workerPool):
+    try:
+        workerPool.submit(MLEngine_UnloadJobInWorker)
+    except Exception:
+        pass
+# End - MLEngine_ReleaseSingleWorkerPool
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_ShutdownWorkerPool]
+#
+# Stop the worker process that MLEngine_GetSingleWorkerPool started. Callers do not
+# have to call this, since the pool is also shut down when the program exits.
+################################################################################
+def MLEngine_ShutdownWorkerPool():
+    global g_SingleWorkerPool
+
+    if (g_SingleWorkerPool is not None):
+        g_SingleWorkerPool.shutdown(wait=False, cancel_futures=True)
+        g_SingleWorkerPool = None
+# End - MLEngine_ShutdownWorkerPool
+
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_SetWorkerThreads]
+#
+# Split the CPUs this process may run on evenly between the worker processes.
+# Otherwise, every worker inherits a Pytorch thread pool as big as the whole
+# machine, and several workers would fight over the same cores.
+################################################################################
+def MLEngine_SetWorkerThreads(numWorkers):
+    try:
+        numCores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # sched_getaffinity is not available on all platforms, like MacOS.
+        numCores = os.cpu_count()
+    if (numCores is None):
+        return
+
+    torch.set_num_threads(max(1, numCores // max(1, numWorkers)))
+# End - MLEngine_SetWorkerThreads
+
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_GetPartitionConfigInWorker]
+#
+# Return a dictionary of the job properties used to read and train or test each 
+# partition. The first call reads them from the job, and later calls in the same 
+# worker return the saved dictionary, so we do not look them up again for every partition.
+# dataFileParamName is either "TrainData" or "TestData".
+################################################################################
+def MLEngine_GetPartitionConfigInWorker(job, dataFileParamName):
+    global g_WorkerPartitionConfig
+
+    if ((g_WorkerPartitionConfig is not None) 
+            and (g_WorkerPartitionConfig['dataFileParamName'] == dataFileParamName)):
+        return g_WorkerPartitionConfig
+
+    _, requirePropertyRelationList, requirePropertyNameList, requirePropertyValueList = job.GetFilterProperties()
+
+    # We may add up the gradients from several timelines and then update the weights once.
+    numAccumulationSteps = job.GetTrainingParamInt(mlJob.TRAINING_OPTION_GRADIENT_ACCUMULATION_STEPS, 1)
+    if (numAccumulationSteps < 1):
+        numAccumulationSteps = 1
+
+    g_WorkerPartitionConfig = {'dataFileParamName': dataFileParamName,
+                    'tdfFilePathName': job.GetDataParam(dataFileParamName, ""),
+                    'inputNameListStr': job.GetNetworkInputVarNames(),
+                    'resultValueName': job.GetNetworkOutputVarName(),
+                    'requirePropertyRelationList': requirePropertyRelationList,
+                    'requirePropertyNameList': requirePropertyNameList,
+                    'requirePropertyValueList': requirePropertyValueList,
+                    'networkOutputDataType': job.GetResultValueType(),
+                    'numAccumulationSteps': numAccumulationSteps,
+                    'numTimelinesPerBatch': job.GetTrainingParamInt(mlJob.TRAINING_OPTION_BATCHSIZE, 1),
+                    'prefetchDepth': max(1, job.GetTrainingParamInt(mlJob.TRAINING_OPTION_PREFETCH_DEPTH, DEFAULT_PREFETCH_DEPTH))}
+    return g_WorkerPartitionConfig
+# End - MLEngine_GetPartitionConfigInWorker
+
+
+################################################################################
+# [MLEngine_StartTrainingEpochInWorker]
+# [MLEngine_FinishTrainingEpochInWorker]
+# [MLEngine_StartTestingInWorker]
+# [MLEngine_GetJobStrFromWorker]
+#
+# These run in the worker process, and update or return the job that lives there.
+################################################################################
+def MLEngine_StartTrainingEpochInWorker():
+    g_WorkerJob.StartTrainingEpoch()
+
+def MLEngine_FinishTrainingEpochInWorker():
+    g_WorkerJob.FinishTrainingEpoch()
+
+def MLEngine_StartTestingInWorker():
+    global g_WorkerTrainingState, g_WorkerTestingState, g_WorkerTimelineCache
+
+    # If this worker just trained the network, then test that same network rather than
+    # build a new one from the job. Save the trained weights to the job first, so they
+    # go back to the control process with the test results.
+    if (g_WorkerTrainingState is not None):
+        MLEngine_SaveTrainingStateToJob(g_WorkerJob, g_WorkerTrainingState)
+        localNeuralNet = g_WorkerTrainingState['neuralNet']
+        if (g_WorkerTrainingState['cudaIsAvailable']):
+            localNeuralNet = localNeuralNet.to(g_WorkerTrainingState['gpuDevice'])
+        g_WorkerTestingState = {'neuralNet': localNeuralNet,
+                                'fUsePytorch': g_WorkerTrainingState['fUsePytorch'],
+                                'cudaIsAvailable': g_WorkerTrainingState['cudaIsAvailable'],
+                                'gpuDevice': g_WorkerTrainingState['gpuDevice']}
+        g_WorkerTrainingState = None
+    # End - if (g_WorkerTrainingState is not None):
+
+    g_WorkerTimelineCache = None
+    g_WorkerJob.StartTesting()
+
+def MLEngine_GetJobStrFromWorker():
+    if (g_WorkerTrainingState is not None):
+        MLEngine_SaveTrainingStateToJob(g_WorkerJob, g_WorkerTrainingState)
+    return g_WorkerJob.WriteJobToString()
+# End - MLEngine_GetJobStrFromWorker
+
+
+################################################################################
+#
+# [MLEngine_ReadJobFromWorker]
+#
+# This runs in the control process. It copies the job that the worker has been
+# updating back into the local job. If the worker died, then we keep the local job.
+################################################################################
+def MLEngine_ReadJobFromWorker(workerPool, job):
+    try:
+        jobStr = workerPool.submit(MLEngine_GetJobStrFromWorker).result()
+    except Exception as err:
+        print("MLEngine_ReadJobFromWorker. Worker process failed: " + str(err))
+        return job
+
+    if ((jobStr is not None) and (jobStr != "")):
+        job.ReadJobFromString(jobStr)
+
+    return job
+# End - MLEngine_ReadJobFromWorker
+
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_CreateTrainingStateInWorker]
+#
+# Build the neural network, loss function and optimizer for training, and restore
+# their state from the job. This returns a dictionary of all of them, or None 
+# if something could not be created.
+################################################################################
+def MLEngine_CreateTrainingStateInWorker(job):
+    fDebug = False
+
+    # Create the neural network in this address space.
+    localNeuralNet = MLEngine_CreateNeuralNetFromJobSpec(job)
+    if (localNeuralNet is None):
+        if (fDebug):
+            print("MLEngine_CreateTrainingStateInWorker Failed making neural net.")
+        return None
+
+    # Many of the models are in Pytorch, but not all anymore, and some parts
+    # of training and testing rely on the type of software used.
+    fUsePytorch = False
+    if (localNeuralNet.GetLibraryName() == "Pytorch"):
+        fUsePytorch = True
+
+    # Check if we can use the GPU.
+    cudaIsAvailable = False
+    gpuDevice = None
+    if ((fUsePytorch) and (USE_GPU) and (job.OKToUseGPU())):
+        cudaIsAvailable = torch.cuda.is_available()
+        if (cudaIsAvailable):
+            numGPUs = torch.cuda.device_count()
+            gpuDevice = torch.device('cuda')
+            if ((numGPUs <= 0) or (gpuDevice is None)):
+                cudaIsAvailable = False
+        # End - if (cudaIsAvailable):
+    # End - if (USE_GPU)
+
+    if (cudaIsAvailable):
+        localNeuralNet = localNeuralNet.to(gpuDevice)
+    localNeuralNet = MLEngine_CompileNeuralNet(job, localNeuralNet, False, None, False)
+
+    # Create the loss function in this address space.
     if (fUsePytorch):
         localLossFunction, lossDimension = MLEngine_CreateLossFunctionForJob(job)
         if ((localLossFunction is None) or (lossDimension < 0)):
             if (fDebug):
-                print("MLEngine_TrainOneFilePartitionInChildProcess Error. Failed to make loss function.")
-            MLEngine_ReturnResultsFromChildProcess(sendPipeEnd, job, 0, 0, 0, False, -1, -1, E_SERVER_ERROR, "")
-            return
+                print("MLEngine_CreateTrainingStateInWorker Error. Failed to make loss function.")
+            return None
+        lossTypeStr = job.GetTrainingParamStr(mlJob.TRAINING_OPTION_LOSS_FUNCTION_ELEMENT_NAME, "").lower()
+        localLossFunction = MLEngine_MakeLossClosure(lossTypeStr, localLossFunction)
     else:
         localLossFunction = None
         lossDimension = 0
@@ -2913,25 +3985,24 @@ def MLEngine_TrainOneFilePartitionInChildProcess(sendPipeEnd, jobStr,
         if (optimizerType == "sgd"):
             learningRate = float(job.GetTrainingParamStr(mlJob.TRAINING_OPTION_LEARNING_RATE, "0.1"))
             if (learningRate == 0):
-                ASSERT_ERROR("MLEngine_TrainOneFilePartitionInChildProcess. 0 Learning Rate")
+                ASSERT_ERROR("MLEngine_CreateTrainingStateInWorker. 0 Learning Rate")
 
             localOptimizer = optim.SGD(localNeuralNet.parameters(), lr=learningRate)
         elif (optimizerType == "adam"):
             learningRate = float(job.GetTrainingParamStr(mlJob.TRAINING_OPTION_LEARNING_RATE, "0.1"))
             if (learningRate == 0):
-                ASSERT_ERROR("MLEngine_TrainOneFilePartitionInChildProcess. Error. 0 Learning Rate")
+                ASSERT_ERROR("MLEngine_CreateTrainingStateInWorker. Error. 0 Learning Rate")
 
             weightDecay = 0
             localOptimizer = optim.Adam(localNeuralNet.parameters(), lr=learningRate, weight_decay=weightDecay)
         elif (optimizerType in ("", "none")):
             localOptimizer = None
         else:
-            MLEngine_ReturnResultsFromChildProcess(sendPipeEnd, job, 0, 0, 0, False, -1, -1, E_SERVER_ERROR, "")
-            return
+            return None
     # End - if (fUsePytorch):
 
-    # Restore the state of the optimizer. This was saved by the
-    # previous child process when it completed.
+    # Restore the state of the optimizer. This was saved in the job
+    # when a previous training run finished.
     if (localOptimizer is not None):
         valStr = job.GetNamedStateAsStr(mlJob.RUNTIME_OPTIMIZER_STATE, "")
         if (valStr != ""):
@@ -2943,21 +4014,34 @@ def MLEngine_TrainOneFilePartitionInChildProcess(sendPipeEnd, jobStr,
         # End - if (valStr != ""):
     # End - if (localOptimizer is not None):
 
-    localNeuralNet.CheckState(job)
+    trainingState = {'neuralNet': localNeuralNet,
+                    'lossFunction': localLossFunction,
+                    'lossDimension': lossDimension,
+                    'optimizer': localOptimizer,
+                    'fUsePytorch': fUsePytorch,
+                    'cudaIsAvailable': cudaIsAvailable,
+                    'gpuDevice': gpuDevice,
+                    'batchBuffers': {}}
+    return trainingState
+# End - MLEngine_CreateTrainingStateInWorker
 
 
-    # Do the actual work. 
-    job, numTimelinesProcessed, numDataPointsProcessed = MLEngine_TrainOneFilePartitionImpl(job, 
-                                                                    currentPartitionStart, currentPartitionStop,
-                                                                    localNeuralNet, localLossFunction, localOptimizer,
-                                                                    fUsePytorch, cudaIsAvailable, gpuDevice, 
-                                                                    TimelinesForTrainingPriority)
 
-    localNeuralNet.CheckState(job)
 
 
+
+################################################################################
+#
+# [MLEngine_SaveTrainingStateToJob]
+#
+# Write the weights of the resident neural network and the optimizer state into the job.
+################################################################################
+def MLEngine_SaveTrainingStateToJob(job, trainingState):
+    localNeuralNet = trainingState['neuralNet']
+    localOptimizer = trainingState['optimizer']
+
     # Save the updated weights to the job, for later use.
-    if (cudaIsAvailable):
+    if (trainingState['cudaIsAvailable']):
         # Map net back to the CPU device so we can save its state to the Job
         # We only do this for training, not testing, because only training will
         # read the updated network matrices and save those back to the Job.
@@ -2976,17 +4060,99 @@ def MLEngine_TrainOneFilePartitionInChildProcess(sendPipeEnd, jobStr,
     # End - if (localOptimizer is not None):
     #print("Save optimizer state: " + str(valStr))
     job.SetNamedStateAsStr(mlJob.RUNTIME_OPTIMIZER_STATE, valStr)
+# End - MLEngine_SaveTrainingStateToJob
+
 
-    # Send the results back to the control process.
-    MLEngine_ReturnResultsFromChildProcess(sendPipeEnd, job, numTimelinesProcessed, totalSkippedTimelines, numDataPointsProcessed,
-                                            False, currentPartitionStart, currentPartitionStop,
-                                            E_NO_ERROR, "")
+
+
+
+
+################################################################################
+#
+# [MLEngine_TrainOneFilePartitionInChildProcess]
+#
+# This runs in a worker process, which may be another process on the same machine
+# or else a process on a remote server on the network.
+# The worker process is started once and then reused for every partition.
+# All inputs and outputs are passed as strings and integers.
+# The job was passed once to MLEngine_InitWorkerProcess, and this updates that job.
+################################################################################
+def MLEngine_TrainOneFilePartitionInChildProcess(currentPartitionStart, currentPartitionStop,
+                                            TimelinesForTrainingPriorityStr, partitionNum,
+                                            nextPartitionStart, nextPartitionStop):
+    global g_WorkerTrainingState, g_WorkerTimelineCache
+    totalSkippedTimelines = 0
+    fDebug = False
+
+    MLEngine_SeedPartition(partitionNum)
+
+    #<> Debugging Only!
+    torch.autograd.set_detect_anomaly(True)
+
+    if (fDebug):
+        print("MLEngine_TrainOneFilePartitionInChildProcess start.")
+        print("     currentPartitionStart = " + str(currentPartitionStart))
+        print("     currentPartitionStop = " + str(currentPartitionStop))
+
+    # Use the runtime job object that lives in this worker process.
+    job = g_WorkerJob
+
+    # Convert other strings passed accross address spaces to a runtime data structure.
+    TimelinesForTrainingPriority = json.loads(TimelinesForTrainingPriorityStr)
+
+    # Build the neural network, loss function and optimizer the first time this worker
+    # trains a partition. After that, they stay resident here across all partitions and 
+    # epochs, and the weights are only written back to the job when training finishes.
+    if (g_WorkerTrainingState is None):
+        g_WorkerTrainingState = MLEngine_CreateTrainingStateInWorker(job)
+        if (g_WorkerTrainingState is None):
+            return MLEngine_ReturnErrorFromChildProcess(E_SERVER_ERROR, "Could not create the neural network, loss function or optimizer")
+    # End - if (g_WorkerTrainingState is None):
+
+    localNeuralNet = g_WorkerTrainingState['neuralNet']
+    localNeuralNet.CheckState(job)
+
+    # Every epoch trains the same timelines, only in a different order. Keep the parsed
+    # arrays, up to a memory limit, so only the first epoch has to parse them.
+    if (g_WorkerTimelineCache is None):
+        maxCacheMB = job.GetTrainingParamInt(mlJob.TRAINING_OPTION_DECODED_TIMELINE_CACHE_MB, 
+                                             DEFAULT_DECODED_TIMELINE_CACHE_MB)
+        g_WorkerTimelineCache = {'maxBytes': max(0, maxCacheMB) * 1024 * 1024, 'numBytes': 0, 'timelines': {}}
+    timelineCache = g_WorkerTimelineCache
+    if (timelineCache['maxBytes'] <= 0):
+        timelineCache = None
+
+    # Do the actual work. 
+    job, numTimelinesProcessed, numDataPointsProcessed = MLEngine_TrainOneFilePartitionImpl(job, 
+                                                                    MLEngine_GetPartitionConfigInWorker(job, "TrainData"),
+                                                                    currentPartitionStart, currentPartitionStop,
+                                                                    localNeuralNet, 
+                                                                    g_WorkerTrainingState['lossFunction'], 
+                                                                    g_WorkerTrainingState['optimizer'],
+                                                                    g_WorkerTrainingState['fUsePytorch'], 
+                                                                    g_WorkerTrainingState['cudaIsAvailable'], 
+                                                                    g_WorkerTrainingState['gpuDevice'], 
+                                                                    TimelinesForTrainingPriority,
+                                                                    nextPartitionStart, nextPartitionStop,
+                                                                    timelineCache,
+                                                                    g_WorkerTrainingState['batchBuffers'])
+
+    localNeuralNet.CheckState(job)
 
     if (fDebug):
         print("MLEngine_TrainOneFilePartitionInChildProcess. Finished. nonceNum = " + str(job.GetNonce()))
-        print("MLEngine_TrainOneFilePartitionInChildProcess done, and exiting")
 
-    # Return and exit the process.
+    # Update the results. These are (roughly) the same for each Epoch, so we only update
+    # it once, on the first Epoch.
+    if (job.GetEpochNum() == 0):
+        job.SetNumTimelinesTrainedPerEpoch(job.GetNumTimelinesTrainedPerEpoch() + numTimelinesProcessed)
+        job.SetNumTimelinesSkippedPerEpoch(job.GetNumTimelinesSkippedPerEpoch() + totalSkippedTimelines)
+        job.SetNumDataPointsPerEpoch(job.GetNumDataPointsPerEpoch() + numDataPointsProcessed)
+
+    # Send the results back to the control process. The job stays here.
+    return MLEngine_ReturnResultsFromChildProcess(None, numTimelinesProcessed, totalSkippedTimelines, numDataPointsProcessed,
+                                            False, currentPartitionStart, currentPartitionStop,
+                                            E_NO_ERROR, "")
 # End - MLEngine_TrainOneFilePartitionInChildProcess
 
 
@@ -3001,25 +4167,68 @@ def MLEngine_TrainOneFilePartitionInChildProcess(sendPipeEnd, jobStr,
 #
 # This runs in a worker process, which may be another process on the same machine
 # or else a process on a remote server on the network.
+# The worker process is started once and then reused for every partition.
 # All inputs and outputs are passed as strings and integers.
-# The job is serialized/deserialized as a string of XML text, so it can be passed
-# as a parameter string, modified, then returned as a result string.
+# The job was passed once to MLEngine_InitWorkerProcess, and this updates that job.
+#
+# If fReturnTestResults is True, then this is one of several workers that test at
+# the same time. It returns the test results for just this partition, and the 
+# control process adds those into its own job.
 ################################################################################
-def MLEngine_TestOneFilePartitionInChildProcess(sendPipeEnd, jobStr, currentPartitionStart,
-                                                currentPartitionStop):
-    global g_ChildProcessPipe
-    g_ChildProcessPipe = sendPipeEnd
+def MLEngine_TestOneFilePartitionInChildProcess(currentPartitionStart,
+                                                currentPartitionStop, partitionNum, fReturnTestResults):
+    global g_WorkerTestingState
     numTimelinesProcessed = 0
     fEOF = False
 
-    # Regenerate the runtime job object from its serialized string form. 
-    job = mlJob.MLJob_CreateMLJobFromString(jobStr)
+    MLEngine_SeedPartition(partitionNum)
 
+    # Use the runtime job object that lives in this worker process.
+    job = g_WorkerJob
+    if (fReturnTestResults):
+        job.StartTesting()
+
+    # Build and compile the neural network the first time this worker tests a partition.
+    if (g_WorkerTestingState is None):
+        g_WorkerTestingState = MLEngine_CreateTestingStateInWorker(job)
+        if (g_WorkerTestingState is None):
+            return MLEngine_ReturnErrorFromChildProcess(E_SERVER_ERROR, "Could not create the neural network")
+    # End - if (g_WorkerTestingState is None):
+
+    # Do the actual work
+    job, numTimelinesProcessed, fEOF = MLEngine_TestOneFilePartitionImpl(job, 
+                                                                        MLEngine_GetPartitionConfigInWorker(job, "TestData"),
+                                                                        currentPartitionStart, 
+                                                                        currentPartitionStop, 
+                                                                        g_WorkerTestingState['neuralNet'],
+                                                                        g_WorkerTestingState['fUsePytorch'], 
+                                                                        g_WorkerTestingState['cudaIsAvailable'], 
+                                                                        g_WorkerTestingState['gpuDevice'])
+
+    resultDict = MLEngine_ReturnResultsFromChildProcess(None, numTimelinesProcessed, 0, 0, fEOF, -1, -1, E_NO_ERROR, "")
+    if (fReturnTestResults):
+        resultDict['rawTestResults'] = job.GetRawTestResults()
+    return resultDict
+# End - MLEngine_TestOneFilePartitionInChildProcess
+
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_CreateTestingStateInWorker]
+#
+# Build the neural network for testing from the job, move it to the GPU if we can,
+# and compile it. This returns a dictionary with the network and the device it is on,
+# or None if the network could not be created.
+################################################################################
+def MLEngine_CreateTestingStateInWorker(job):
     # Create the neural network in this address space.
     localNeuralNet = MLEngine_CreateNeuralNetFromJobSpec(job)
     if (localNeuralNet is None):
-        MLEngine_ReturnResultsFromChildProcess(sendPipeEnd, job, 0, 0, 0, False, -1, -1, E_SERVER_ERROR, "")
-        return
+        return None
 
     # Many of the models are in Pytorch, but not all anymore, and some parts
     # of training and testing rely on the type of software used.
@@ -3044,16 +4253,14 @@ def MLEngine_TestOneFilePartitionInChildProcess(sendPipeEnd, jobStr, currentPart
 
     if (cudaIsAvailable):
         localNeuralNet = localNeuralNet.to(gpuDevice)
+    localNeuralNet = MLEngine_CompileNeuralNet(job, localNeuralNet, False, None, False)
 
-    # Do the actual work
-    job, numTimelinesProcessed, fEOF = MLEngine_TestOneFilePartitionImpl(job, currentPartitionStart, 
-                                                                        currentPartitionStop, localNeuralNet,
-                                                                        fUsePytorch, cudaIsAvailable, gpuDevice)
-
-    MLEngine_ReturnResultsFromChildProcess(sendPipeEnd, job, numTimelinesProcessed, 0, 0, fEOF, -1, -1, E_NO_ERROR, "")
-
-    # Return and exit the process.
-# End - MLEngine_TestOneFilePartitionInChildProcess
+    testingState = {'neuralNet': localNeuralNet,
+                    'fUsePytorch': fUsePytorch,
+                    'cudaIsAvailable': cudaIsAvailable,
+                    'gpuDevice': gpuDevice}
+    return testingState
+# End - MLEngine_CreateTestingStateInWorker
 
 
 
@@ -3126,10 +4333,67 @@ def MLEngine_PreflightNeuralNet(job, partitionSize):
 
 
 
+################################################################################
+#
+# [MLEngine_PrefetchStartOfFile]
+#
+# Ask the kernel to start reading the first numBytes of a file into the page cache.
+# This returns right away, and the disk reads happen in the background. 
+# This is only a hint, so any error is ignored.
+################################################################################
+def MLEngine_PrefetchStartOfFile(filePathName, numBytes):
+    if ((filePathName == "") or (not hasattr(os, "posix_fadvise"))):
+        return
+
+    try:
+        fileDescriptor = os.open(filePathName, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fileDescriptor, 0, numBytes, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fileDescriptor)
+# End - MLEngine_PrefetchStartOfFile
+
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_GetPartitionSize]
+#
+# Return the number of bytes in each partition of a TDF file. This is 
+# DEFAULT_PARTITION_SIZE, unless the ML_PARTITION_SIZE environment variable 
+# is set to a positive number.
+################################################################################
+def MLEngine_GetPartitionSize():
+    try:
+        partitionSize = int(os.environ.get(PARTITION_SIZE_ENV_VAR, ""))
+    except ValueError:
+        return DEFAULT_PARTITION_SIZE
+
+    if (partitionSize <= 0):
+        return DEFAULT_PARTITION_SIZE
+    return partitionSize
+# End - MLEngine_GetPartitionSize
+
+
+
+
+
+
 ################################################################################
 #
 # [MLEngine_TrainNeuralNet]
 #
+#
+# This returns the worker pool, which is still running and still holds the trained
+# job. The caller may test in the same worker, and must then read the job back from
+# the worker and release it with MLEngine_ReleaseSingleWorkerPool.
 ################################################################################
 def MLEngine_TrainNeuralNet(job, partitionSize):
     fDebug = False
@@ -3146,13 +4410,32 @@ def MLEngine_TrainNeuralNet(job, partitionSize):
 
     numEpochs = job.GetTrainingParamInt("NumEpochs", 1)
 
+    # This counts every partition we hand to a worker across all epochs, so each one gets its own seed.
+    numPartitionsStarted = 0
+
+    # Seed the parent too, since it shuffles the partition list on each epoch.
+    # This uses a seed that no partition uses.
+    MLEngine_SeedRandomGenerators(CONTROL_PROCESS_RANDOM_SEED)
+
+    # Use one worker process for every partition of every epoch.
+    # Partitions are trained in order, since each one starts with the weights left
+    # by the previous one, so there is only ever one worker.
+    # The job is serialized once here. It lives in the worker until training is done.
+    workerPool = MLEngine_GetSingleWorkerPool(job)
+
     #######################################
     # TRAINING - Iterate once for each Epoch
     for epochNum in range(numEpochs):
         if (fDebug):
             print("\n\n\n\n ==================================\nEpoch: " 
                     + str(epochNum) + "\n\n\n")
-        job.StartTrainingEpoch()
+        MLEngine_WaitForWorkerResult(workerPool.submit(MLEngine_StartTrainingEpochInWorker))
+
+        # Testing starts as soon as the last epoch finishes. Start reading the first
+        # test partition from disk now, so that is not a wait between training and testing.
+        # The test worker prefetches each of the later partitions itself.
+        if ((epochNum == (numEpochs - 1)) or (not job.TrainingCanPauseResume())):
+            MLEngine_PrefetchStartOfFile(job.GetDataParam("TestData", ""), MLEngine_GetPartitionSize())
         
         #######################################
         # This loop looks at each partition in the file. One partition is 
@@ -3165,63 +4448,49 @@ def MLEngine_TrainNeuralNet(job, partitionSize):
             currentPartitionStop = partitionInfo['stop']
             TimelinesForTrainingPriorityStr = partitionInfo['ptPriorityListStr']
 
-            # Make a pipe that will be used to return the results. 
-            recvPipeEnd, sendPipeEnd = multiprocessing.Pipe(False)
+            # Tell the worker which partition comes next, so it can prefetch it from disk.
+            nextPartitionStart = -1
+            nextPartitionStop = -1
+            if ((partitionCount + 1) < len(partitionList)):
+                nextPartitionStart = partitionList[partitionCount + 1]['start']
+                nextPartitionStop = partitionList[partitionCount + 1]['stop']
 
-            # Prepare the arguments to go to the worker process.
+            # Run the partition in the worker process, and wait for the results.
             # This may be another process on this machine or else a remote process on another server.
-            jobStr = job.WriteJobToString()
-
-            # Fork the job process.
-            processInfo = Process(target=MLEngine_TrainOneFilePartitionInChildProcess, args=(sendPipeEnd, 
-                                                        jobStr, 
-                                                        currentPartitionStart, currentPartitionStop, 
-                                                        TimelinesForTrainingPriorityStr))
-            processInfo.start()
-
-            # Wait for the job process to finish and get the results.
-            resultDict = recvPipeEnd.recv()
+            future = workerPool.submit(MLEngine_TrainOneFilePartitionInChildProcess, 
+                                        currentPartitionStart, currentPartitionStop, 
+                                        TimelinesForTrainingPriorityStr, numPartitionsStarted,
+                                        nextPartitionStart, nextPartitionStop)
+            numPartitionsStarted += 1
+            resultDict = MLEngine_WaitForWorkerResult(future)
             if (fDebug):
                 print("MLEngine_TrainNeuralNet. Got result back from child process")
 
+            # An error result only has the error code and a message.
+            childProcessErr = resultDict['err']
+            if (childProcessErr != E_NO_ERROR):
+                print("MLEngine_TrainNeuralNet. Worker failed: " + resultDict['errMsg'])
+                break
+
             numTimelinesProcessed = resultDict['numTimelinesProcessed']
             numSkippedTimelines = resultDict['numSkippedTimelines']
             numDataPointsProcessed = resultDict['numDataPointsProcessed']
-            childProcessErr = resultDict['err']
-            jobStr = resultDict['jobStr']
-            if ((jobStr is not None) and (jobStr != "")):
-                job.ReadJobFromString(jobStr)
             if (fDebug):
                 print("MLEngine_TrainNeuralNet. numTimelinesProcessed=" + str(numTimelinesProcessed))
 
-            # Wait for the process to complete.
-            processInfo.join()
-            if (fDebug):
-                print("MLEngine_TrainNeuralNet. join finished")
-
             if (fDebug):
                 print("MLEngine_TrainNeuralNet")
                 print("    numTimelinesProcessed = " + str(numTimelinesProcessed))
+                print("    numSkippedTimelines = " + str(numSkippedTimelines))
                 print("    numDataPointsProcessed = " + str(numDataPointsProcessed))
                 print("    childProcessErr = " + str(childProcessErr))
 
-
-            if (childProcessErr == E_ASSERT_ERROR):
-                break
-
-            # Update the results. These are (roughly) the same for each Epoch, so we only update
-            # it once, on the first Epoch.
-            if (epochNum == 0):
-                job.SetNumTimelinesTrainedPerEpoch(job.GetNumTimelinesTrainedPerEpoch() + numTimelinesProcessed)
-                job.SetNumTimelinesSkippedPerEpoch(job.GetNumTimelinesSkippedPerEpoch() + numSkippedTimelines)
-                job.SetNumDataPointsPerEpoch(job.GetNumDataPointsPerEpoch() + numDataPointsProcessed)
-
             partitionCount += 1
         # End - for partitionInfo in partitionList:
 
-        job.FinishTrainingEpoch()
+        MLEngine_WaitForWorkerResult(workerPool.submit(MLEngine_FinishTrainingEpochInWorker))
         
-        if (childProcessErr == E_ASSERT_ERROR):
+        if (childProcessErr != E_NO_ERROR):
             break
 
         # Some models (like XGBoost) cannot train different data at different times.
@@ -3234,8 +4503,7 @@ def MLEngine_TrainNeuralNet(job, partitionSize):
         random.shuffle(partitionList)
     # End - for epochNum in range(numEpochs):
 
-    # Return the updated job that has been changed by the child processes.
-    return job, childProcessErr
+    return job, childProcessErr, workerPool
 # End - MLEngine_TrainNeuralNet()
 
 
@@ -3246,11 +4514,24 @@ def MLEngine_TrainNeuralNet(job, partitionSize):
 #
 # [MLEngine_TestNeuralNet]
 #
+# If workerPool is not None, then it is the worker that trained the job, and we 
+# test the network that is still in memory there. Otherwise, this starts a new worker.
+# Either way, this reads the job back from the worker and then releases the worker.
+# This returns the job and an error code. If a worker failed, then the job only
+# has the results for some of the partitions.
 ################################################################################
-def MLEngine_TestNeuralNet(job, partitionSize):
+def MLEngine_TestNeuralNet(job, partitionSize, workerPool):
     #print("MLEngine_TestNeuralNet. Start Testing:")
 
-    job.StartTesting()
+    # Each partition is tested on its own, so several workers can test at once.
+    numWorkers = job.GetTrainingParamInt(mlJob.TRAINING_OPTION_NUM_TEST_WORKERS, 1)
+    if (numWorkers <= 0):
+        numWorkers = os.cpu_count() or 1
+    if (numWorkers > 1):
+        if (workerPool is not None):
+            job = MLEngine_ReadJobFromWorker(workerPool, job)
+            MLEngine_ReleaseSingleWorkerPool(workerPool)
+        return MLEngine_TestNeuralNetInParallel(job, partitionSize, numWorkers)
 
     #######################################
     # This loop looks at each partition in the file. One partition is 
@@ -3259,30 +4540,30 @@ def MLEngine_TestNeuralNet(job, partitionSize):
     currentPartitionStart = 0
     currentPartitionStop = currentPartitionStart + partitionSize
     partitionCount = 0
+    childProcessErr = E_NO_ERROR
+
+    # Use one worker process for every partition.
+    # The job is serialized once here. It lives in the worker until testing is done.
+    if (workerPool is None):
+        job.StartTesting()
+        workerPool = MLEngine_GetSingleWorkerPool(job)
+    else:
+        MLEngine_WaitForWorkerResult(workerPool.submit(MLEngine_StartTestingInWorker))
+
     while (not fEOF):
         job.LogMsg("Start Partition. StartPos=" + str(currentPartitionStart))
 
-        # Make a pipe that will be used to return the results. 
-        recvPipeEnd, sendPipeEnd = multiprocessing.Pipe(False)
-
-        # Prepare the arguments to go to the worker process.
+        # Run the partition in the worker process, and wait for the results.
         # This may be another process on this machine or else a remote process on another server.
-        jobStr = job.WriteJobToString()
-        #print("MLEngine_TestNeuralNet jobStr=" + str(jobStr))
-
-        # Fork the job process.
-        processInfo = Process(target=MLEngine_TestOneFilePartitionInChildProcess, args=(sendPipeEnd, jobStr, 
-                                                    currentPartitionStart, currentPartitionStop))
-        processInfo.start()
+        future = workerPool.submit(MLEngine_TestOneFilePartitionInChildProcess, 
+                                    currentPartitionStart, currentPartitionStop, partitionCount, False)
+        resultDict = MLEngine_WaitForWorkerResult(future)
+        childProcessErr = resultDict['err']
+        if (childProcessErr != E_NO_ERROR):
+            print("MLEngine_TestNeuralNet. Worker failed: " + resultDict['errMsg'])
+            break
 
-        # Get the results.
-        resultDict = recvPipeEnd.recv()
         fEOF = resultDict['fEOF']
-        jobStr = resultDict['jobStr']
-        job.ReadJobFromString(jobStr)
-
-        # Wait for the process to complete.
-        processInfo.join()
 
         # Go to the next partition
         currentPartitionStart = currentPartitionStop
@@ -3291,8 +4572,11 @@ def MLEngine_TestNeuralNet(job, partitionSize):
         partitionCount += 1
     # End - while (not fEOF):
 
+    job = MLEngine_ReadJobFromWorker(workerPool, job)
+    MLEngine_ReleaseSingleWorkerPool(workerPool)
+
     # Return the updated job that has been changed by the child processes.
-    return job
+    return job, childProcessErr
 # End - MLEngine_TestNeuralNet()
 
 
@@ -3300,6 +4584,58 @@ def MLEngine_TestNeuralNet(job, partitionSize):
 
 
 
+################################################################################
+#
+# [MLEngine_TestNeuralNetInParallel]
+#
+# Test every partition of the test file at the same time in a pool of workers.
+# The partitions are the same fixed ranges of the file that MLEngine_TestNeuralNet
+# walks through one at a time, so the same timelines are tested. Each worker 
+# returns the results for its partition, and we add them into this job.
+# This returns the job and an error code, like MLEngine_TestNeuralNet.
+################################################################################
+def MLEngine_TestNeuralNetInParallel(job, partitionSize, numWorkers):
+    childProcessErr = E_NO_ERROR
+    job.StartTesting()
+
+    try:
+        fileSize = os.stat(job.GetDataParam("TestData", "")).st_size
+    except Exception:
+        fileSize = 0
+    numPartitions = max(1, (fileSize + partitionSize - 1) // partitionSize)
+    numWorkers = min(numWorkers, numPartitions)
+
+    workerPool = concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers, 
+                                                        initializer=MLEngine_InitWorkerProcess, 
+                                                        initargs=(job.WriteJobToString(), numWorkers))
+
+    futureList = []
+    for partitionNum in range(numPartitions):
+        currentPartitionStart = partitionNum * partitionSize
+        futureList.append(workerPool.submit(MLEngine_TestOneFilePartitionInChildProcess, 
+                                            currentPartitionStart, currentPartitionStart + partitionSize, 
+                                            partitionNum, True))
+    # End - for partitionNum in range(numPartitions):
+
+    for future in futureList:
+        resultDict = MLEngine_WaitForWorkerResult(future)
+        childProcessErr = resultDict['err']
+        if (childProcessErr != E_NO_ERROR):
+            print("MLEngine_TestNeuralNetInParallel. Worker failed: " + resultDict['errMsg'])
+            break
+        job.AddRawTestResults(resultDict['rawTestResults'])
+    # End - for future in futureList:
+
+    workerPool.shutdown(cancel_futures=True)
+
+    return job, childProcessErr
+# End - MLEngine_TestNeuralNetInParallel()
+
+
+
+
+
+
 ################################################################################
 #
 # [MLEngine_RunJob]
@@ -3307,26 +4643,52 @@ def MLEngine_TestNeuralNet(job, partitionSize):
 # Train and test one job, described in a Job file
 ################################################################################
 def MLEngine_RunJob(jobFilePathName, trainedJobFilePathName, fDebug):
-    err = E_NO_ERROR
-
     # Open the job.
     jobErr, job = mlJob.MLJob_ReadExistingMLJob(jobFilePathName)
     if (mlJob.JOB_E_NO_ERROR != jobErr):
         print("MLEngine_RunJob. Error making network for " + jobFilePathName)
         return
 
+    MLEngine_RunParsedJob(job, trainedJobFilePathName, fDebug)
+# End - MLEngine_RunJob
+
+
+
+
+
+
+################################################################################
+#
+# [MLEngine_RunParsedJob]
+#
+# Train and test one job that the caller has already read from its Job file.
+# This lets a caller that had to open the job anyway, like to check its status,
+# run it without parsing the file a second time.
+################################################################################
+def MLEngine_RunParsedJob(job, trainedJobFilePathName, fDebug):
+    err = E_NO_ERROR
+
     job.SetDebug(fDebug)
 
+    # Check that there is something to do before we set up the engine.
+    dataParamDict = job.GetAllDataParams()
+    trainTDFFilePathName = dataParamDict.get("TrainData", "")
+    testTDFFilePathName = dataParamDict.get("TestData", "")
+    if ((trainTDFFilePathName == "") and (testTDFFilePathName == "")):
+        print("MLEngine_RunParsedJob. No TrainData or TestData in " + str(job.JobFilePathName))
+        return
+
     MLEngine_Init_GPU()
+    MLEngine_SetMatmulPrecision(job)
 
     # Initialize the engine.
     job.StartJobExecution()
 
-    # TODO: Make this a calculated value, depending on the memory size of the machine
-    partitionSize = DEFAULT_PARTITION_SIZE
+    partitionSize = MLEngine_GetPartitionSize()
+
+    # The worker that trains the job also tests it, so the trained network stays in memory.
+    workerPool = None
 
-    trainTDFFilePathName = job.GetDataParam("TrainData", "")
-    #print("MLEngine_Train. trainedFilePathName=" + str(trainedFilePathName))
     if (trainTDFFilePathName != ""):
         # Some models (like XGBoost) cannot train different data at different times.
         # In these cases, we can only do 1 Epoch, and we try to process all data as a single partition.
@@ -3335,31 +4697,36 @@ def MLEngine_RunJob(jobFilePathName, trainedJobFilePathName, fDebug):
                 fileInfo = os.stat(trainTDFFilePathName)
                 partitionSize = fileInfo.st_size
             except Exception:
-                partitionSize = DEFAULT_PARTITION_SIZE
+                partitionSize = MLEngine_GetPartitionSize()
 
-        job, err = MLEngine_TrainNeuralNet(job, partitionSize)
+        job, err, workerPool = MLEngine_TrainNeuralNet(job, partitionSize)
     # End - if (trainTDFFilePathName != ""):
 
-    if (err == E_NO_ERROR):
-        testTDFFilePathName = job.GetDataParam("TestData", "")
-        if (testTDFFilePathName != ""):
-            job = MLEngine_TestNeuralNet(job, DEFAULT_PARTITION_SIZE)
+    if ((err == E_NO_ERROR) and (testTDFFilePathName != "")):
+        job, err = MLEngine_TestNeuralNet(job, MLEngine_GetPartitionSize(), workerPool)
+        workerPool = None
 
-    # <><><> xxxxxxxxxxxxxx
-    #print("\n\n\n\nMLEngine_RunJob - BAIL DUDE!!!!\n\n\n")
-    #raise Exception()
+    # If we trained but did not test, then get the trained job back from the worker.
+    if (workerPool is not None):
+        job = MLEngine_ReadJobFromWorker(workerPool, job)
+        MLEngine_ReleaseSingleWorkerPool(workerPool)
 
     job.FinishJobExecution(err, " ")
 
+    # Write the trained job to disk while we print the reports.
+    saveThread = None
     if ((trainedJobFilePathName is not None) 
             and (trainedJobFilePathName != "")):
-        job.SaveAs(trainedJobFilePathName)
+        saveThread = job.SaveAsInBackground(trainedJobFilePathName)
 
     JobShow.JobShow_WriteReport(job, JobShow.MLJOB_CONSOLE_REPORT, "")
     JobShow.JobShow_WriteReport(job, JobShow.MLJOB_LOG_REPORT, "")
     #JobShow.JobShow_WriteReport(job, MLJOB_FILE_REPORT, "/home/ddean/ddRoot/trainingResults.txt")
     #JobShow.JobShow_WriteReport(job, MLJOB_FILE_REPORT, "/home/ddean/ddRoot/trainingResults.csv")
-# End - MLEngine_RunJob
+
+    if (saveThread is not None):
+        saveThread.join()
+# End - MLEngine_RunParsedJob
 
 
 
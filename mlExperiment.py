@@ -1273,8 +1273,10 @@ def MLExperiment_RunAllJobsInDirectory(dirPathName, fRecursive):
 
         # Read the job to see if it has completed
         fRunJob = True
+        fJobIsParsed = False
         jobErr, job = mlJob.MLJob_ReadExistingMLJob(srcFilePathName)
         if (mlJob.JOB_E_NO_ERROR == jobErr):
+            fJobIsParsed = True
             jobStatus, _, _ = job.GetJobStatus()
             if (fDebug):
                 print("MLExperiment_RunOneJob. jobStatus=" + str(jobStatus))
@@ -1283,7 +1285,10 @@ def MLExperiment_RunAllJobsInDirectory(dirPathName, fRecursive):
                 fRunJob = False
         # End - if (mlJob.JOB_E_NO_ERROR == jobErr):
 
-        if (fRunJob):
+        # Run the job we just read, rather than read and parse the file again.
+        if ((fRunJob) and (fJobIsParsed)):
+            mlEngine.MLEngine_RunParsedJob(job, srcFilePathName, False)
+        elif (fRunJob):
             mlEngine.MLEngine_RunJob(srcFilePathName, srcFilePathName, False)
         else:
             print("    Done")
@@ -124,8 +124,29 @@
 #           SGD
 #
 #       LearningRate
-#       BatchSize
+#       BatchSize - The number of timelines that are trained together in one
+#           forward and backward pass. This only applies to networks where every
+#           input makes its own prediction, not to recurrent networks.
 #       NumEpochs
+#       GradAccumSteps
+#       PrefetchDepth - The number of parsed timelines that the background reader may
+#           hold ready while the trainer is busy. The default is 2. A larger value
+#           can help when the TDF file is on slow or network storage.
+#       DecodedTimelineCacheMB - The training worker keeps the arrays for each timeline
+#           it parses, up to this many megabytes, so later epochs do not parse those 
+#           timelines again. The default is 256. Use 0 to parse every timeline on 
+#           every epoch.
+#       NumTestWorkers - The number of worker processes that test partitions of the
+#           test file at the same time. The default is 1, which tests in the same
+#           worker that trained the network. Use 0 for one worker per CPU.
+#       MixedPrecision - True to run the forward pass in bfloat16 with autocast.
+#           The weights, gradients and loss stay in float32. The default is False.
+#       AllowTF32 - True to let float32 matrix multiplies on the GPU use TF32 tensor
+#           cores. This is faster, but results are not bit-for-bit reproducible
+#           with a run that does not use it. The default is True.
+#       CudnnBenchmark - True to let cuDNN time its algorithms for each new input 
+#           shape and pick the fastest. It may not pick the same one every run, so
+#           results are not reproducible. The default is False.
 #   </Training>
 #
 #   <Results>
@@ -242,11 +263,19 @@ import random
 
 import hashlib  # For Hashing an array
 import json
+import threading
 
 from xml.dom.minidom import getDOMImplementation
 
 import numpy
 
+# xxhash is optional. It is much faster than sha256 on a large array, and the
+# array checksums only detect changes, so they do not need a cryptographic hash.
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 from sklearn.metrics import f1_score
 from sklearn.metrics import auc
 from sklearn.metrics import roc_auc_score
@@ -293,6 +322,13 @@ TRAINING_OPTION_RESULT_PRIORITY_POLICY_ELEMENT_NAME = "PriorityPolicy"
 TRAINING_OPTION_LOSS_FUNCTION_ELEMENT_NAME = "LossFunction"
 TRAINING_MAX_NUM_SKIPPED_RESULT_CLASSES = "MaxSkippedResultClasses"
 TRAINING_MAX_SKIPPED_DAYS_IN_SAME_SEQUENCE = "MaxSkippedDaysInSameSequence"
+TRAINING_OPTION_GRADIENT_ACCUMULATION_STEPS = "GradAccumSteps"
+TRAINING_OPTION_PREFETCH_DEPTH = "PrefetchDepth"
+TRAINING_OPTION_DECODED_TIMELINE_CACHE_MB = "DecodedTimelineCacheMB"
+TRAINING_OPTION_NUM_TEST_WORKERS = "NumTestWorkers"
+TRAINING_OPTION_MIXED_PRECISION = "MixedPrecision"
+TRAINING_OPTION_ALLOW_TF32 = "AllowTF32"
+TRAINING_OPTION_CUDNN_BENCHMARK = "CudnnBenchmark"
 
 # <Training><ValueInfo>
 TRAINING_PRIORITY_VALUE_INFO = "ValueInfo"
@@ -309,6 +345,11 @@ TRAINING_PRIORITY_CLASS_PRIORITIES = "ClassPriorities"
 RUNTIME_ELEMENT_NAME = "Runtime"
 RUNTIME_LOG_NODE_ELEMENT_NAME = "Log"
 RUNTIME_HASH_DICT_ELEMENT_NAME = "HashDict"
+# Each checksum in the HashDict starts with the name of the hash that made it, so a job saved 
+# on a machine with a different hash library can still be checked. Checksums saved before
+# these prefixes were added have no prefix, and are sha256.
+CHECKSUM_XXH3_PREFIX = "xxh3:"
+CHECKSUM_SHA256_PREFIX = "sha256:"
 RUNTIME_FILE_PATHNAME_ELEMENT_NAME = "JobFilePathname"
 RUNTIME_START_ELEMENT_NAME = "StartRequestTimeStr"
 RUNTIME_STOP_ELEMENT_NAME = "StopRequestTimeStr"
@@ -531,6 +572,17 @@ class MLJobTestResults():
         self.TestNumItemsPerClass = [0] * self.NumResultClasses
         self.TestNumPredictionsPerClass = [0] * self.NumResultClasses
         self.TestNumCorrectPerClass = [0] * self.NumResultClasses
+
+        # Also clear everything else that RecordTestingResult adds to. A test worker may
+        # test several partitions, and GetRawTestResults must only return the results
+        # since the last StartTesting, or the control process would add them in again.
+        # This also drops any totals read from the job XML of an earlier run.
+        self.AllPredictions = []
+        self.AllTrueResults = []
+        self.TotalAbsoluteError = 0
+        self.NumPredictions = 0
+        self.LogisticResultsTrueValueList = []
+        self.LogisticResultsPredictedProbabilityList = []
     # End - StartTesting
 
 
@@ -687,6 +739,59 @@ class MLJobTestResults():
 
 
 
+    #####################################################
+    #
+    # [MLJobTestResults::GetRawTestResults]
+    #
+    # Return the counts and lists that RecordTestingResult builds up, as a
+    # dictionary of plain values that can be sent between processes.
+    #####################################################
+    def GetRawTestResults(self):
+        return {'NumSamplesTested': self.NumSamplesTested,
+                'TestResults': dict(self.TestResults),
+                'AllPredictions': self.AllPredictions,
+                'AllTrueResults': self.AllTrueResults,
+                'TotalAbsoluteError': self.TotalAbsoluteError,
+                'NumPredictions': self.NumPredictions,
+                'TestNumItemsPerClass': self.TestNumItemsPerClass,
+                'TestNumPredictionsPerClass': self.TestNumPredictionsPerClass,
+                'TestNumCorrectPerClass': self.TestNumCorrectPerClass,
+                'LogisticResultsTrueValueList': self.LogisticResultsTrueValueList,
+                'LogisticResultsPredictedProbabilityList': self.LogisticResultsPredictedProbabilityList}
+    # End of GetRawTestResults
+
+
+
+    #####################################################
+    #
+    # [MLJobTestResults::AddRawTestResults]
+    #
+    # Add the results from GetRawTestResults into these results. This is the same
+    # as if RecordTestingResult had been called here for every one of those samples.
+    #####################################################
+    def AddRawTestResults(self, rawResults):
+        self.NumSamplesTested += rawResults['NumSamplesTested']
+        for valName, value in rawResults['TestResults'].items():
+            self.TestResults[valName] = self.TestResults.get(valName, 0) + value
+
+        self.AllPredictions.extend(rawResults['AllPredictions'])
+        self.AllTrueResults.extend(rawResults['AllTrueResults'])
+        self.TotalAbsoluteError += rawResults['TotalAbsoluteError']
+        self.NumPredictions += rawResults['NumPredictions']
+
+        for index, value in enumerate(rawResults['TestNumItemsPerClass']):
+            self.TestNumItemsPerClass[index] += value
+        for index, value in enumerate(rawResults['TestNumPredictionsPerClass']):
+            self.TestNumPredictionsPerClass[index] += value
+        for index, value in enumerate(rawResults['TestNumCorrectPerClass']):
+            self.TestNumCorrectPerClass[index] += value
+
+        self.LogisticResultsTrueValueList.extend(rawResults['LogisticResultsTrueValueList'])
+        self.LogisticResultsPredictedProbabilityList.extend(rawResults['LogisticResultsPredictedProbabilityList'])
+    # End of AddRawTestResults
+
+
+
     #####################################################
     #
     # [MLJobTestResults::ReadTestResultsFromXML
@@ -922,6 +1027,7 @@ class MLJob():
 
         self.NetworkType = ""
         self.AllowGPU = False
+        self.MixedPrecision = False
 
         self.HashDict = {}
         self.RuntimeNonce = 0
@@ -1099,6 +1205,34 @@ class MLJob():
 
 
 
+    #####################################################
+    #
+    # [MLJob::SaveAsInBackground]
+    #
+    # This is like SaveAs, but only the serialization happens on the calling thread.
+    # That reads the job, so it must finish before anyone changes the job again.
+    # The text is then written to the file on a background thread, so the caller does
+    # not wait for the disk. The caller must join() the returned thread before it exits.
+    #
+    # The text goes to a temporary file that is renamed over the real one when it
+    # is complete, so nobody ever reads a partially written job.
+    #####################################################
+    def SaveAsInBackground(self, jobFilePathName):
+        # Update the file name. If we renamed a file when it was closed,
+        # we need to save this new file name.
+        self.JobFilePathName = jobFilePathName
+
+        contentsText = self.WriteJobToString()
+
+        saveThread = threading.Thread(target=MLJob_WriteFileAtomically, 
+                                      args=(jobFilePathName, contentsText),
+                                      daemon=False)
+        saveThread.start()
+        return saveThread
+    # End of SaveAsInBackground
+
+
+
     #####################################################
     #
     # [MLJob::SaveJobWithoutRuntime]
@@ -1248,6 +1382,10 @@ class MLJob():
             if (resultStr in ("off", "false", "no", "0")):
                 self.AllowGPU = True
 
+        # This is read on every forward pass, so parse it once here.
+        self.MixedPrecision = dxml.XMLTools_GetChildNodeTextAsBool(self.TrainingXMLNode, 
+                                                                TRAINING_OPTION_MIXED_PRECISION, False)
+
         xmlNode = dxml.XMLTools_GetChildNode(self.JobControlXMLNode, JOB_CONTROL_LOG_FILE_PATHNAME_ELEMENT_NAME)
         if (xmlNode is not None):
             resultStr = dxml.XMLTools_GetTextContents(xmlNode)
@@ -1726,6 +1864,53 @@ class MLJob():
 
 
 
+    #####################################################
+    #
+    # [MLJob::PreflightDataArray
+    #
+    # This is the same as calling PreflightData on each row of inputArray and resultArray,
+    # but it works on whole columns. Each input variable is one column, so we take the min 
+    # and max of each column at once, rather than comparing one value at a time.
+    #####################################################
+    def PreflightDataArray(self, inputArray, resultArray):
+        numInputVars = self.numInputVars
+        inputArray = numpy.asarray(inputArray)[:, :numInputVars]
+        if (len(inputArray) == 0):
+            return
+
+        # Assign in place, so the values are stored in the same type as before.
+        self.PreflightInputMins[:numInputVars] = numpy.minimum(self.PreflightInputMins[:numInputVars], 
+                                                               inputArray.min(axis=0))
+        self.PreflightInputMaxs[:numInputVars] = numpy.maximum(self.PreflightInputMaxs[:numInputVars], 
+                                                               inputArray.max(axis=0))
+
+        # Be careful, results may sometimes be invalid if we are processing a
+        # sequence. There may not be a result for every intermediate step, only
+        # the last step.
+        resultArray = numpy.asarray(resultArray).reshape(-1)
+        resultArray = resultArray[resultArray != tdf.TDF_INVALID_VALUE]
+        if (len(resultArray) == 0):
+            return
+
+        minResult = resultArray.min().item()
+        if (minResult < self.PreflightResultMin):
+            self.PreflightResultMin = minResult
+        maxResult = resultArray.max().item()
+        if (maxResult > self.PreflightResultMax):
+            self.PreflightResultMax = maxResult
+        self.PreflightResultTotal += resultArray.sum().item()
+        self.PreflightResultCount += len(resultArray)
+
+        offsetArray = numpy.maximum(resultArray - self.PreflightEstimatedMinResultValueForPriority, 0)
+        bucketArray = (offsetArray / self.PreflightResultBucketSize).astype(numpy.int64)
+        bucketArray = numpy.minimum(bucketArray, self.PreflightNumResultPriorities - 1)
+        bucketCounts = numpy.bincount(bucketArray, minlength=self.PreflightNumResultPriorities)
+        for bucketNum in numpy.flatnonzero(bucketCounts):
+            self.PreflightNumResultsInEachBucket[bucketNum] += int(bucketCounts[bucketNum])
+    # End - PreflightDataArray
+
+
+
     #####################################################
     #
     # [MLJob::FinishPreflight
@@ -1978,6 +2163,51 @@ class MLJob():
 
 
 
+    #####################################################
+    #
+    # [MLJob::RecordTrainingSamples
+    # 
+    # This is a public procedure, it is called by the client.
+    #
+    # This is the same as calling RecordTrainingSample for each value in actualValueArray,
+    # but it buckets all of the values with a few array operations.
+    #####################################################
+    def RecordTrainingSamples(self, actualValueArray):
+        # We only record the stats on the first epoch.
+        if (self.CurrentEpochNum > 0):
+            return
+
+        actualValueArray = numpy.asarray(actualValueArray, dtype=numpy.float64)
+        actualValueArray = actualValueArray[actualValueArray != tdf.TDF_INVALID_VALUE]
+        if (len(actualValueArray) == 0):
+            return
+        self.NumSamplesTrainedPerEpoch += len(actualValueArray)
+
+        #####################
+        if (self.ResultValueType in (tdf.TDF_DATA_TYPE_INT, tdf.TDF_DATA_TYPE_FLOAT)):
+            offsetArray = numpy.maximum(actualValueArray - self.ResultValMinValue, 0)
+            bucketArray = (offsetArray / self.ResultValBucketSize).astype(numpy.int64)
+            bucketArray = numpy.minimum(bucketArray, ML_JOB_NUM_NUMERIC_VALUE_BUCKETS - 1)
+        #####################
+        elif (self.ResultValueType == tdf.TDF_DATA_TYPE_BOOL):
+            bucketArray = numpy.minimum(actualValueArray.astype(numpy.int64), 1)
+        #####################
+        elif (self.ResultValueType == tdf.TDF_DATA_TYPE_FUTURE_EVENT_CLASS):
+            bucketArray = numpy.minimum(actualValueArray.astype(numpy.int64), tdf.TDF_NUM_FUTURE_EVENT_CATEGORIES - 1)
+        else:
+            return
+
+        # Count each bucket once, then add the counts to the list.
+        # Like a list index, a negative bucket counts from the end.
+        numClasses = len(self.TrainNumItemsPerClass)
+        bucketCounts = numpy.bincount(bucketArray % numClasses, minlength=numClasses)
+        for bucketNum in numpy.flatnonzero(bucketCounts):
+            self.TrainNumItemsPerClass[bucketNum] += int(bucketCounts[bucketNum])
+    # End -  RecordTrainingSamples
+
+
+
+
     #####################################################
     #
     # [MLJob::FinishTrainingEpoch
@@ -2040,6 +2270,39 @@ class MLJob():
 
 
 
+    #####################################################
+    #
+    # [MLJob::GetRawTestResults]
+    # 
+    # Return the test results for the totals bucket and then each subgroup.
+    # These are plain values, so a worker process can send them back to the
+    # control process, which adds them into its own job with AddRawTestResults.
+    #####################################################
+    def GetRawTestResults(self):
+        rawResultsList = [self.AllTestResults.GetRawTestResults()]
+        for index in range(self.NumResultsSubgroups):
+            rawResultsList.append(self.TestResultsSubgroupList[index].GetRawTestResults())
+
+        return rawResultsList
+    # End -  GetRawTestResults
+
+
+
+
+    #####################################################
+    #
+    # [MLJob::AddRawTestResults]
+    # 
+    #####################################################
+    def AddRawTestResults(self, rawResultsList):
+        self.AllTestResults.AddRawTestResults(rawResultsList[0])
+        for index in range(min(self.NumResultsSubgroups, len(rawResultsList) - 1)):
+            self.TestResultsSubgroupList[index].AddRawTestResults(rawResultsList[index + 1])
+    # End -  AddRawTestResults
+
+
+
+
     #####################################################
     #
     # [MLJob::TrainingCanPauseResume]
@@ -2148,6 +2411,21 @@ class MLJob():
 
      
 
+    #####################################################
+    #
+    # [MLJob::HasLinearUnitMatrices]
+    #
+    # Return True if the job has saved matrices for this linear unit.
+    # This only looks for the node, so it does not parse the matrices.
+    #####################################################
+    def HasLinearUnitMatrices(self, name):
+        linearUnitNode = dxml.XMLTools_GetChildNode(self.NeuralNetMatrixListXMLNode, name)
+        return (linearUnitNode is not None)
+    # End - HasLinearUnitMatrices
+
+
+
+
     #####################################################
     #
     # [MLJob::SetLinearUnitMatrices
@@ -2194,13 +2472,17 @@ class MLJob():
         else:
             numCols = len(inputArray[0])
 
-        resultString = "NumD=2;D=" + str(numRows) + VALUE_SEPARATOR_CHAR + str(numCols) + ";T=float;" + ROW_SEPARATOR_CHAR
+        # Build a list of row strings and join them once at the end. Appending each value 
+        # to a single growing string copies the whole string every time, which is
+        # quadratic in the size of the matrix.
+        rowStrList = []
         for rowNum in range(numRows):
             row = inputArray[rowNum]
-            for numVal in row:
-                resultString = resultString + str(numVal) + VALUE_SEPARATOR_CHAR
-            resultString = resultString[:-1]
-            resultString = resultString + ROW_SEPARATOR_CHAR
+            rowStrList.append(VALUE_SEPARATOR_CHAR.join([str(numVal) for numVal in row]))
+
+        resultString = "NumD=2;D=" + str(numRows) + VALUE_SEPARATOR_CHAR + str(numCols) + ";T=float;" + ROW_SEPARATOR_CHAR
+        if (numRows > 0):
+            resultString = resultString + ROW_SEPARATOR_CHAR.join(rowStrList) + ROW_SEPARATOR_CHAR
 
         return resultString
     # End - MLJob_Convert2DMatrixToString
@@ -2859,6 +3141,24 @@ class MLJob():
     def OKToUseGPU(self):
         return self.AllowGPU
 
+    #####################################################
+    # [MLJob::GetMixedPrecision]
+    #####################################################
+    def GetMixedPrecision(self):
+        return self.MixedPrecision
+
+    #####################################################
+    # [MLJob::GetAllowTF32]
+    #####################################################
+    def GetAllowTF32(self):
+        return dxml.XMLTools_GetChildNodeTextAsBool(self.TrainingXMLNode, TRAINING_OPTION_ALLOW_TF32, True)
+
+    #####################################################
+    # [MLJob::GetCudnnBenchmark]
+    #####################################################
+    def GetCudnnBenchmark(self):
+        return dxml.XMLTools_GetChildNodeTextAsBool(self.TrainingXMLNode, TRAINING_OPTION_CUDNN_BENCHMARK, False)
+
     #####################################################
     # [MLJob::GetDebug]
     #####################################################
@@ -3253,6 +3553,36 @@ class MLJob():
 
 
 
+    #####################################################
+    #
+    # [MLJob::GetAllDataParams]
+    #
+    # Return every parameter in the <Data> node as a dictionary, with one pass 
+    # over the node. Empty parameters are left out, so dict.get(name, defaultVal)
+    # returns the same value as GetDataParam(name, defaultVal).
+    #####################################################
+    def GetAllDataParams(self):
+        paramDict = {}
+        currentXMLNode = dxml.XMLTools_GetFirstChildNode(self.DataXMLNode)
+        while (currentXMLNode is not None):
+            if (dxml.XMLTools_IsLeafNode(currentXMLNode)):
+                valName = dxml.XMLTools_GetElementName(currentXMLNode)
+                resultStr = dxml.XMLTools_GetTextContents(currentXMLNode)
+                if (resultStr is not None):
+                    resultStr = resultStr.lstrip()
+                if ((resultStr is not None) and (resultStr != "") and (valName not in paramDict)):
+                    paramDict[valName] = resultStr
+            # End - if (dxml.XMLTools_IsLeafNode(currentXMLNode)):
+
+            currentXMLNode = dxml.XMLTools_GetAnyPeerNode(currentXMLNode)
+        # End - while (currentXMLNode is not None):
+
+        return paramDict
+    # End of GetAllDataParams
+
+
+
+
     #####################################################
     #
     # [MLJob::SetDataParam]
@@ -3405,7 +3735,8 @@ class MLJob():
             print("Exiting process...")
             raise Exception()
 
-        hashVal = self.ComputeArrayChecksum(inputArray)
+        # We just checked the values, so do not have ComputeArrayChecksum scan them again.
+        hashVal = self.ComputeRawArrayChecksum(inputArray)
         #print("SetArrayChecksum. Save hash " + hashName + " = " + hashVal)
         self.HashDict[hashName] = hashVal
     # End - SetArrayChecksum
@@ -3421,14 +3752,20 @@ class MLJob():
     def CompareArrayChecksum(self, inputArray, hashName):
         fDebug = False
 
-        newHashVal = self.ComputeArrayChecksum(inputArray)
-        if (fDebug):
-            print("CompareArrayChecksum. hashName = " + str(hashName) + ", newHashVal = " + str(newHashVal))
-        
+        if (numpy.isnan(inputArray).any()):
+            print("ERROR!:\nCompareArrayChecksum passed an Invalid Array")
+            print("CompareArrayChecksum. hashName = " + str(hashName))
+            print("CompareArrayChecksum. inputArray = " + str(inputArray))
+            print("Exiting process...")
+            raise Exception()
+
         if (hashName not in self.HashDict):
             print("CompareArrayChecksum. hashName not in self.HashDict hashName = " + str(hashName))
             return False
 
+        # Hash the array the same way as the saved checksum.
+        newHashVal = self.ComputeRawArrayChecksumLike(inputArray, self.HashDict[hashName])
+
         if (fDebug):
             print("Compare hash " + hashName + ", Saved=" + str(self.HashDict[hashName]) + ", Expect=" + newHashVal)
 
@@ -3438,6 +3775,38 @@ class MLJob():
 
 
 
+    ################################################################################
+    #
+    # [UpdateArrayChecksum]
+    #
+    # Save the checksum of inputArray, and return whether it is the same as the
+    # checksum previously saved under hashName. This hashes the array once, instead
+    # of a CompareArrayChecksum followed by a SetArrayChecksum.
+    # If the caller already checked that the array has no NaN values, then pass
+    # fValuesChecked=True so we only read the array once, to hash it.
+    # inputArray is a numpy array, and may be 1, 2, or 3 dimensional.
+    ################################################################################
+    def UpdateArrayChecksum(self, inputArray, hashName, fValuesChecked):
+        if ((not fValuesChecked) and (numpy.isnan(inputArray).any())):
+            print("ERROR!:\nUpdateArrayChecksum passed an Invalid Array")
+            print("UpdateArrayChecksum. hashName = " + str(hashName))
+            print("UpdateArrayChecksum. inputArray = " + str(inputArray))
+            print("Exiting process...")
+            raise Exception()
+
+        # If there is a saved checksum, then hash the array the same way so we can compare them.
+        if (hashName in self.HashDict):
+            newHashVal = self.ComputeRawArrayChecksumLike(inputArray, self.HashDict[hashName])
+            isEqual = (newHashVal == self.HashDict[hashName])
+        else:
+            newHashVal = self.ComputeRawArrayChecksum(inputArray)
+            isEqual = False
+        self.HashDict[hashName] = newHashVal
+        return isEqual
+    # End - UpdateArrayChecksum
+
+
+
 
     ################################################################################
     #
@@ -3452,13 +3821,56 @@ class MLJob():
             print("Exiting process...")
             raise Exception()
 
-        rawByteArray = inputArray.tobytes('C')
-        newHashVal = hashlib.sha256(rawByteArray).hexdigest()
-        return newHashVal
+        return self.ComputeRawArrayChecksum(inputArray)
     # End - ComputeArrayChecksum
 
 
 
+    ################################################################################
+    #
+    # [ComputeRawArrayChecksum]
+    #
+    # Hash the array without first checking it for NaN values. 
+    # inputArray is a numpy array, and may be 1, 2, or 3 dimensional.
+    ################################################################################
+    def ComputeRawArrayChecksum(self, inputArray):
+        # Hash the array buffer directly rather than copying it into a bytes object.
+        # This only copies if the array is not already C-contiguous.
+        rawByteArray = numpy.ascontiguousarray(inputArray).view(numpy.uint8)
+        if (xxhash is not None):
+            newHashVal = CHECKSUM_XXH3_PREFIX + xxhash.xxh3_64_hexdigest(rawByteArray)
+        else:
+            newHashVal = CHECKSUM_SHA256_PREFIX + hashlib.sha256(rawByteArray).hexdigest()
+        return newHashVal
+    # End - ComputeRawArrayChecksum
+
+
+
+    ################################################################################
+    #
+    # [ComputeRawArrayChecksumLike]
+    #
+    # Hash the array with the same hash, and in the same format, as savedHashVal,
+    # so the two can be compared. This does not check the array for NaN values.
+    # inputArray is a numpy array, and may be 1, 2, or 3 dimensional.
+    ################################################################################
+    def ComputeRawArrayChecksumLike(self, inputArray, savedHashVal):
+        rawByteArray = numpy.ascontiguousarray(inputArray).view(numpy.uint8)
+        if (savedHashVal.startswith(CHECKSUM_XXH3_PREFIX)):
+            if (xxhash is None):
+                print("ComputeRawArrayChecksumLike. The saved checksum uses xxhash, but xxhash is not installed")
+                return CHECKSUM_SHA256_PREFIX + hashlib.sha256(rawByteArray).hexdigest()
+            return CHECKSUM_XXH3_PREFIX + xxhash.xxh3_64_hexdigest(rawByteArray)
+
+        if (savedHashVal.startswith(CHECKSUM_SHA256_PREFIX)):
+            return CHECKSUM_SHA256_PREFIX + hashlib.sha256(rawByteArray).hexdigest()
+
+        # A checksum saved before the prefixes were added is a plain sha256.
+        return hashlib.sha256(rawByteArray).hexdigest()
+    # End - ComputeRawArrayChecksumLike
+
+
+
     ################################################################################
     #
     # [GetArrayChecksum]
@@ -3471,6 +3883,19 @@ class MLJob():
     # End - GetSavedArrayChecksum
 
 
+    ################################################################################
+    #
+    # [CopySavedArrayChecksum]
+    #
+    # Save the checksum already saved under srcHashName under dstHashName too,
+    # without hashing the array again.
+    ################################################################################
+    def CopySavedArrayChecksum(self, srcHashName, dstHashName):
+        if (srcHashName in self.HashDict):
+            self.HashDict[dstHashName] = self.HashDict[srcHashName]
+    # End - CopySavedArrayChecksum
+
+
     #####################################################
     #
     # [MLJob::ResetRunStatus]
@@ -3534,11 +3959,9 @@ def MLJob_Convert1DVectorToString(inputArray):
     dimension = len(inputArray)
 
     resultString = "NumD=1;D=" + str(dimension) + ";T=float;" + ROW_SEPARATOR_CHAR
-
-    for numVal in inputArray:
-        resultString = resultString + str(numVal) + VALUE_SEPARATOR_CHAR
-    resultString = resultString[:-1]
-    resultString = resultString + ROW_SEPARATOR_CHAR
+    if (dimension > 0):
+        resultString = resultString + VALUE_SEPARATOR_CHAR.join([str(numVal) for numVal in inputArray])
+        resultString = resultString + ROW_SEPARATOR_CHAR
 
     return resultString
 # End - MLJob_Convert1DVectorToString
@@ -3592,6 +4015,25 @@ def MLJob_ConvertStringTo1DVector(vectorStr):
 
 
 
+################################################################################
+#
+# [MLJob_WriteFileAtomically]
+#
+# Write the text to a temporary file and then rename it over filePathName.
+################################################################################
+def MLJob_WriteFileAtomically(filePathName, contentsText):
+    tempFilePathName = filePathName + ".tmp"
+    fileH = open(tempFilePathName, "w")
+    fileH.write(contentsText)
+    fileH.close()
+    os.replace(tempFilePathName, filePathName)
+# End - MLJob_WriteFileAtomically
+
+
+
+
+
+
 ################################################################################
 # 
 # This is a public procedure, it is called by the client.
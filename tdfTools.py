@@ -268,6 +268,8 @@
 import os
 import sys
 import math
+import mmap
+import operator
 import re
 import copy
 from datetime import datetime
@@ -353,6 +355,12 @@ TDF_INVALID_VALUE = -314159
 # may compare to 0 to test validity.
 TDF_SMALLEST_VALID_VALUE = -1000
 
+# Input arrays are stored as float32, which is the type the neural net uses anyway.
+# This is half the memory of float64, so a timeline is half as many bytes to fill, 
+# normalize and copy into a tensor. float32 keeps about 7 significant digits, which 
+# is enough for lab values. TDF_INVALID_VALUE is an integer, so it is exact in float32.
+TDF_INPUT_VALUE_TYPE = np.float32
+
 g_TDF_Log_Buffer = ""
 
 MIN_CR_RISE_FOR_AKI = 0.3
@@ -376,6 +384,11 @@ g_fAllowSloppyBackwardDates = False
 TIMELINE_OPEN_ELEMENT_PREFIX_CASE_INDEPENDANT = "<tl"
 TIMELINE_CLOSE_ELEMENT_CASE_INDEPENDANT = "</tl>"
 
+# These find the lines that open and close a timeline in a memory-mapped file.
+# Like the line-by-line parser, the element must be at the very start of its line.
+g_TimelineOpenLinePattern = re.compile(rb'^<tl', re.IGNORECASE | re.MULTILINE)
+g_TimelineCloseLinePattern = re.compile(rb'^</tl>', re.IGNORECASE | re.MULTILINE)
+
 
 
 ################################################################################
@@ -1048,6 +1061,8 @@ class TDFFileReader():
         # Save the parameters
         self.tdfFilePathName = tdfFilePathName
         self.fileHandle = None
+        self.fileObject = None
+        self.fileMap = None
 
         # Initialize some parsing control options to their default values.
         # These may be overridden later.
@@ -1092,6 +1107,16 @@ class TDFFileReader():
         self.varIndexThatMustBeNonZero = -1
         self.maxZeroDays = -1
 
+        # The value filter, compiled by GetCompiledValueFilter, and the lists it was compiled from.
+        self.compiledFilterKey = None
+        self.compiledFilter = []
+
+        # Arrays that GetDataForCurrentTimeline fills in when the caller asks it to 
+        # reuse its buffers. See GetReusableTimelineBuffers.
+        self.reusableInputArray = None
+        self.reusableResultArray = None
+        self.reusableDayNumArray = None
+
         ###################
         self.ParseVariableList(inputNameListStr, resultValueName, requirePropertyNameList)
 
@@ -1100,12 +1125,38 @@ class TDFFileReader():
         # Opening in binary mode is important. I do seek's to arbitrary positions
         # and that is only allowed when a file is opened in binary.
         try:
-            self.fileHandle = open(self.tdfFilePathName, 'rb') 
+            self.fileObject = open(self.tdfFilePathName, 'rb') 
         except Exception:
             TDF_Log("Error from opening TDF file. File=" + self.tdfFilePathName)
             return
+        self.fileHandle = self.fileObject
         self.lineNum = 0
 
+        # Map the whole file into memory, and read it through the mmap. An mmap has the 
+        # same readline/seek/tell/read methods as a file, so the parser does not change. 
+        # But each readline is now a copy out of the page cache rather than a read() 
+        # syscall through a separate buffer, and every worker process that maps the same 
+        # file shares the same physical pages. If the file cannot be mapped (for example, 
+        # it is empty) then we just keep reading the normal file.
+        try:
+            self.fileMap = mmap.mmap(self.fileObject.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.fileMap = None
+        if (self.fileMap is not None):
+            if (hasattr(self.fileMap, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL")):
+                try:
+                    self.fileMap.madvise(mmap.MADV_SEQUENTIAL)
+                except Exception:
+                    pass
+            self.fileHandle = self.fileMap
+        elif (hasattr(os, "posix_fadvise")):
+            # We read the file with normal reads, so give the kernel the same hint.
+            try:
+                os.posix_fadvise(self.fileObject.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except Exception:
+                pass
+        # End - if (self.fileMap is not None):
+
         ####################
         # Read the file header as a series of text lines and create a single
         # large text string for just the header. Stop at the body, which may
@@ -1182,15 +1233,109 @@ class TDFFileReader():
     # Called to explicitly release resources
     #####################################################
     def Shutdown(self):
-        if (self.fileHandle is not None):
+        if (self.fileMap is not None):
+            try:
+                self.fileMap.close()
+            except Exception:
+                pass
+        self.fileMap = None
+
+        if (self.fileObject is not None):
             try:
-                self.fileHandle.close()
+                self.fileObject.close()
             except Exception:
                 pass
+        self.fileObject = None
         self.fileHandle = None
     # End of Shutdown
 
 
+
+
+    #####################################################
+    #
+    # [TDFFileReader::SeekToFilePosition]
+    #
+    # A normal file can seek past its end, and then just reads nothing.
+    # An mmap cannot, so clip the position to the end of the file.
+    #####################################################
+    def SeekToFilePosition(self, filePosition):
+        if ((self.fileMap is not None) and (filePosition > len(self.fileMap))):
+            filePosition = len(self.fileMap)
+
+        self.fileHandle.seek(filePosition, 0)
+    # End of SeekToFilePosition
+
+
+
+
+    #####################################################
+    #
+    # [TDFFileReader::PrefetchFileRange]
+    #
+    # Tell the kernel we will soon read the bytes between startPos and stopPos.
+    # This returns right away, and the kernel starts reading those pages from disk
+    # in the background, so the I/O overlaps with whatever we do next. This is
+    # only a hint, so any error is ignored.
+    #####################################################
+    def PrefetchFileRange(self, startPos, stopPos):
+        if (self.fileObject is None):
+            return
+
+        fileSize = os.fstat(self.fileObject.fileno()).st_size
+        startPos = max(startPos, 0)
+        stopPos = min(stopPos, fileSize)
+        if (startPos >= stopPos):
+            return
+
+        try:
+            if ((self.fileMap is not None) and (hasattr(mmap, "MADV_WILLNEED"))):
+                # madvise needs the start to be on a page boundary.
+                pageStartPos = startPos - (startPos % mmap.PAGESIZE)
+                self.fileMap.madvise(mmap.MADV_WILLNEED, pageStartPos, stopPos - pageStartPos)
+            elif (hasattr(os, "posix_fadvise")):
+                os.posix_fadvise(self.fileObject.fileno(), startPos, stopPos - startPos, os.POSIX_FADV_WILLNEED)
+        except Exception:
+            pass
+    # End of PrefetchFileRange
+
+
+
+
+    #####################################################
+    #
+    # [TDFFileReader::ReleaseFileRange]
+    #
+    # Tell the kernel we are done with the bytes between startPos and stopPos, and it 
+    # may drop them from the page cache. Use this when a pass reads a file only once,
+    # so the cache keeps other data instead. Only whole pages inside the range are 
+    # released, so a page shared with the next range stays cached. Like 
+    # PrefetchFileRange, this is only a hint, so any error is ignored.
+    #####################################################
+    def ReleaseFileRange(self, startPos, stopPos):
+        if ((self.fileObject is None) or (not hasattr(os, "posix_fadvise"))):
+            return
+
+        fileSize = os.fstat(self.fileObject.fileno()).st_size
+        pageStartPos = max(startPos, 0)
+        pageStartPos = pageStartPos + ((mmap.PAGESIZE - (pageStartPos % mmap.PAGESIZE)) % mmap.PAGESIZE)
+        pageStopPos = min(stopPos, fileSize)
+        pageStopPos = pageStopPos - (pageStopPos % mmap.PAGESIZE)
+        if (pageStartPos >= pageStopPos):
+            return
+
+        try:
+            # The kernel will not drop pages that are still mapped, so unmap them
+            # from our mmap first.
+            if ((self.fileMap is not None) and (hasattr(mmap, "MADV_DONTNEED"))):
+                self.fileMap.madvise(mmap.MADV_DONTNEED, pageStartPos, pageStopPos - pageStartPos)
+            os.posix_fadvise(self.fileObject.fileno(), pageStartPos, pageStopPos - pageStartPos, 
+                             os.POSIX_FADV_DONTNEED)
+        except Exception:
+            pass
+    # End of ReleaseFileRange
+
+
     #####################################################
     # [TDFFileReader::SetConvertResultsToBools]
     #####################################################
@@ -1369,6 +1514,20 @@ class TDFFileReader():
                 pass
         # End - for labInfoIndex, labInfo in enumerate(self.allValuesLabInfoList):
 
+        # ProcessDataNodeForwardImpl only keeps labs and vitals that we use, so look up 
+        # the clipping range of each of those once here rather than for every value in 
+        # the file. GFR is not here, because it is only ever computed.
+        self.labValueRangeDict = {}
+        for valueName in self.allValueVarNameList:
+            if ((valueName == "GFR") or (valueName not in g_LabValueInfo)):
+                continue
+            try:
+                labInfo = g_LabValueInfo[valueName]
+                self.labValueRangeDict[valueName] = (float(labInfo['minVal']), float(labInfo['maxVal']))
+            except Exception:
+                pass
+        # End - for valueName in self.allValueVarNameList:
+        self.fComputeAgeInYrs = ("AgeInYrs" in self.allValueVarNameList)
 
         if (fDebug):
             print("TDFFileReader::ParseVariableList. self.numInputValues=" + str(self.numInputValues))
@@ -1513,7 +1672,7 @@ class TDFFileReader():
     def GotoFirstTimelineEx(self, fOnlyFindTimelineBoundaries):
         fDebug = False
 
-        self.fileHandle.seek(0, 0)
+        self.SeekToFilePosition(0)
 
         # Advance in the file to the start of the timeline list
         while True: 
@@ -1615,19 +1774,31 @@ class TDFFileReader():
         timelineLength = stopTimelinePosInFile - startTimelinePosInFile
         self.currentTimelineNodeStr = ""
 
-        try:
-            self.fileHandle.seek(startTimelinePosInFile, 0)
-            dataBytes = self.fileHandle.read(timelineLength)
-        except Exception:
-            return False
+        # If the file is mapped, then decode the text straight out of the mapped pages.
+        # This skips copying the bytes into a separate buffer before we decode them.
+        # Release the views before we return, or the map could not be closed later.
+        if (self.fileMap is not None):
+            try:
+                with memoryview(self.fileMap) as fileView:
+                    with fileView[startTimelinePosInFile:stopTimelinePosInFile] as timelineView:
+                        myStr = str(timelineView, "ascii", "ignore")
+            except Exception:
+                return False
+        else:
+            try:
+                self.SeekToFilePosition(startTimelinePosInFile)
+                dataBytes = self.fileHandle.read(timelineLength)
+            except Exception:
+                return False
 
-        # Convert the text from Unicode to ASCII. 
-        try:
-            myStr = dataBytes.decode("ascii", "ignore")
-        except UnicodeDecodeError:
-            return False
-        except Exception:
-            return False
+            # Convert the text from Unicode to ASCII. 
+            try:
+                myStr = dataBytes.decode("ascii", "ignore")
+            except UnicodeDecodeError:
+                return False
+            except Exception:
+                return False
+        # End - if (self.fileMap is not None):
 
         self.currentTimelineNodeStr = myStr
         fFoundTimeline = self.ParseCurrentTimelineImpl()
@@ -1682,7 +1853,7 @@ class TDFFileReader():
         # Note, the partition boundaries are arbitrary byte positions, so
         # this may jump to the middle of a line of text. That is OK, since
         # we will still advance until we see a valid start of a timeline element.
-        self.fileHandle.seek(startPartition, 0)
+        self.SeekToFilePosition(startPartition)
 
         # Now, go to the first timeline
         fFoundTimeline, fEOF, startTimelinePosInFile, stopTimelinePosInFile = self.GotoNextTimelineInPartition(TDF_INVALID_VALUE, 
@@ -1850,11 +2021,17 @@ class TDFFileReader():
     #
     # [TDFFileReader::FindAllTimelinesInPartition]
     #
-    # This returns two values: fFoundTimeline, fEOF
-    #   fFoundTimeline - True if we read a complete timeline
+    # This returns two values: resultTimelinePositionLists, fEOF
+    #   resultTimelinePositionLists - A list of {"start": N, "stop": N} for every
+    #           complete timeline that starts in the partition.
     #   fEOF - True if we hit the end of the file
     #####################################################
     def FindAllTimelinesInPartition(self, startPartition, stopPartition):
+        # If the file is mapped, then search the mapped bytes directly. 
+        # This is one scan in C, rather than reading and decoding every line in Python.
+        if (self.fileMap is not None):
+            return self.FindAllTimelinesInMappedPartition(startPartition, stopPartition)
+
         #TDF_Log("FindAllTimelinesInPartition. startPartition=" + str(startPartition) + 
         #            ", stopPartition=" + str(stopPartition))
         fEOF = False
@@ -1869,7 +2046,7 @@ class TDFFileReader():
         # Note, the partition boundaries are arbitrary byte positions, so
         # this may jump to the middle of a line of text. That is OK, since
         # we will still advance until we see a valid start of a timeline element.
-        self.fileHandle.seek(startPartition, 0)
+        self.SeekToFilePosition(startPartition)
 
         # Advance in the file to the start of each timeline
         while True: 
@@ -1940,6 +2117,50 @@ class TDFFileReader():
 
 
 
+    #####################################################
+    #
+    # [TDFFileReader::FindAllTimelinesInMappedPartition]
+    #
+    # This is FindAllTimelinesInPartition for a memory-mapped file, and returns 
+    # the same values. A timeline may start anywhere before the end of the partition,
+    # and then it may run past the end. 
+    #####################################################
+    def FindAllTimelinesInMappedPartition(self, startPartition, stopPartition):
+        resultTimelinePositionLists = []
+        fileSize = len(self.fileMap)
+        currentPos = min(max(startPartition, 0), fileSize)
+
+        while True:
+            matchResult = g_TimelineOpenLinePattern.search(self.fileMap, currentPos)
+
+            # Stop if there are no more timelines, or the next one starts after the partition.
+            # We only hit the end of the file if the partition runs past it.
+            if (matchResult is None):
+                fEOF = ((stopPartition <= 0) or (fileSize < stopPartition))
+                return resultTimelinePositionLists, fEOF
+            startTimelinePosInFile = matchResult.start()
+            if (0 < stopPartition <= startTimelinePosInFile):
+                return resultTimelinePositionLists, False
+
+            # Find the close element, and include the rest of its line.
+            matchResult = g_TimelineCloseLinePattern.search(self.fileMap, matchResult.end())
+            if (matchResult is None):
+                return resultTimelinePositionLists, True
+            stopTimelinePosInFile = self.fileMap.find(b"\n", matchResult.end())
+            if (stopTimelinePosInFile < 0):
+                stopTimelinePosInFile = fileSize
+            else:
+                stopTimelinePosInFile += 1
+
+            resultTimelinePositionLists.append({"start": startTimelinePosInFile, "stop": stopTimelinePosInFile})
+            currentPos = stopTimelinePosInFile
+        # End - while True
+    # End - FindAllTimelinesInMappedPartition
+
+
+
+
+
 
     #####################################################
     #
@@ -2308,48 +2529,39 @@ class TDFFileReader():
         # Labs and Vitals
         # Copy labs and vitals into the accumulator
         if (dataClass in ("L", "V")):
+            labValueRangeDict = self.labValueRangeDict
             assignmentList = labTextStr.split(',')
             for assignment in assignmentList:
                 assignmentParts = assignment.split('=')
                 if (len(assignmentParts) < 2):
                     continue
                 labName = assignmentParts[0]
-                labvalueStr = assignmentParts[1]
-                labValueFloat = float(TDF_INVALID_VALUE)
-
-                # Look up the lab. Optimistically, try the lab name as is, it is usually a valid name
-                try:
-                    labInfo = g_LabValueInfo[labName]
-                    labMinVal = float(labInfo['minVal'])
-                    labMaxVal = float(labInfo['maxVal'])
-                    foundValidLab = True
-                except Exception:
-                    foundValidLab = False
 
                 # Do not save any values that are not used. There are many defined variables, and
                 # a single hospital database may have many different values. We only care about some.
-                # Don't spend the time or memory saving everything.
-                if ((foundValidLab) and (labName not in self.allValueVarNameList)):
-                    foundValidLab = False
-
-                # Some labs are *only* computed. This lets us ensure they are correctly calculated
-                # using a known algorithm and done in a consistent manner.
-                if (labName == "GFR"):
-                    foundValidLab = False
+                # Don't spend the time or memory saving everything. This is checked before we
+                # parse the value, so unused values cost only a dictionary lookup.
+                # Some labs, like GFR, are *only* computed, so they are never in this dictionary. 
+                # This lets us ensure they are correctly calculated using a known algorithm and 
+                # done in a consistent manner.
+                labRange = labValueRangeDict.get(labName)
+                if (labRange is None):
+                    continue
+                labMinVal, labMaxVal = labRange
+                labvalueStr = assignmentParts[1]
+                foundValidLab = True
 
                 # Try to parse the value.
-                if (foundValidLab):
+                try:
+                    labValueFloat = float(labvalueStr)
+                except Exception:
+                    # Replace invalid characters.
+                    labvalueStr = labvalueStr.replace('>', '') 
+                    labvalueStr = labvalueStr.replace('<', '') 
                     try:
                         labValueFloat = float(labvalueStr)
                     except Exception:
-                        # Replace invalid characters.
-                        labvalueStr = labvalueStr.replace('>', '') 
-                        labvalueStr = labvalueStr.replace('<', '') 
-                        try:
-                            labValueFloat = float(labvalueStr)
-                        except Exception:
-                            foundValidLab = False
-                # End - if ((labName != "") and (labValue != "")):
+                        foundValidLab = False
 
                 # Rule out ridiculous values. Often, vitals will be entered incorrectly
                 # or similar things. This won't catch all invalid entries, but will catch
@@ -2359,17 +2571,17 @@ class TDFFileReader():
 
                 # Now, clip the value to the min and max for this variable and then save it.
                 if (foundValidLab):
-                    if (labValueFloat < float(labMinVal)):
-                        labValueFloat = float(labMinVal)
-                    if (labValueFloat > float(labMaxVal)):
-                        labValueFloat = float(labMaxVal)
+                    if (labValueFloat < labMinVal):
+                        labValueFloat = labMinVal
+                    if (labValueFloat > labMaxVal):
+                        labValueFloat = labMaxVal
                     self.latestTimelineEntryDataList[labName] = labValueFloat
                 # End - if (foundValidLab)
             # End - for assignment in assignmentList
         # End - if ((dataClass == "L") or (dataClass == "V")):
 
         # Some values come from the timestamp, not the contents, of the data element.
-        if ("AgeInYrs" in self.allValueVarNameList):
+        if (self.fComputeAgeInYrs):
             result = int(labDateDays / 365)
             self.latestTimelineEntryDataList["AgeInYrs"] = result
     # End - ProcessDataNodeForwardImpl
@@ -4019,90 +4231,101 @@ class TDFFileReader():
                                         propertyNameList, 
                                         propertyValueList, 
                                         timelineEntry):
-        fDebug = False
+        compiledFilter = self.GetCompiledValueFilter(propertyRelationList, propertyNameList, propertyValueList)
+        return self.CheckIfCurrentTimeMeetsCompiledFilter(compiledFilter, timelineEntry)
+    # End - CheckIfCurrentTimeMeetsCriteria
+
+
+
+
+    #####################################################
+    #
+    # [TDFFileReader::GetCompiledValueFilter]
+    #
+    # Return the compiled form of a value filter. The filter is the same for
+    # every timeline entry, so we only compile it again if the lists change.
+    #####################################################
+    def GetCompiledValueFilter(self, propertyRelationList, propertyNameList, propertyValueList):
+        filterKey = (tuple(propertyRelationList), tuple(propertyNameList), tuple(propertyValueList))
+        if (filterKey != self.compiledFilterKey):
+            self.compiledFilter = TDF_CompileValueFilter(propertyRelationList, propertyNameList, propertyValueList)
+            self.compiledFilterKey = filterKey
+
+        return self.compiledFilter
+    # End - GetCompiledValueFilter
+
+
+
+
+    #####################################################
+    #
+    # [TDFFileReader::CheckIfCurrentTimeMeetsCompiledFilter]
+    #
+    # Returns True if the timeline entry matches every property in a filter 
+    # made by TDF_CompileValueFilter.
+    #####################################################
+    def CheckIfCurrentTimeMeetsCompiledFilter(self, compiledFilter, timelineEntry):
         latestValues = timelineEntry['data']
 
-        numProperties = len(propertyNameList)                                                
-        if (fDebug):
-            print("CheckIfCurrentTimeMeetsCriteria. numProperties=" + str(numProperties))
-        for propNum in range(numProperties):
-            valueName = propertyNameList[propNum]
+        for valueName, relationFunction, targetVal, convertFunction in compiledFilter:
             if (valueName not in latestValues):
-                if (fDebug):
-                    print("CheckIfCurrentTimeMeetsCriteria. valueName=" + str(valueName) + " is not in list")
                 return False
 
             actualVal = latestValues[valueName]
             if ((actualVal == TDF_INVALID_VALUE) or (actualVal <= TDF_SMALLEST_VALID_VALUE)):
-                if (fDebug):
-                    print("CheckIfCurrentTimeMeetsCriteria. valueName=" + str(valueName) + " is not valid")
                 return False
 
-            targetVal = float(propertyValueList[propNum])
-            relationName = propertyRelationList[propNum]
-
-            if (fDebug):
-                print("CheckIfCurrentTimeMeetsCriteria. valueName=" + str(valueName) + " actualVal=" + str(actualVal))
-                print("CheckIfCurrentTimeMeetsCriteria. relationName=" + str(relationName) + " targetVal=" + str(targetVal))
-
-            try:
-                labInfo = g_LabValueInfo[valueName]
-            except Exception:
-                print("Error! CheckIfCurrentTimeMeetsCriteria found undefined lab name: " + valueName)
+            if (relationFunction is None):
                 return False
-            dataTypeName = labInfo['dataType']
-            if (fDebug):
-                print("CheckIfCurrentTimeMeetsCriteria: dataTypeName=" + str(dataTypeName))
-                print("CheckIfCurrentTimeMeetsCriteria: targetVal=" + str(targetVal))
-                print("CheckIfCurrentTimeMeetsCriteria: actualVal=" + str(actualVal))
-
-            ###############
-            if (relationName == ".EQ."):
-                if ((dataTypeName == TDF_DATA_TYPE_FLOAT) and (float(actualVal) != float(targetVal))):
-                    return False
-                elif ((dataTypeName in (TDF_DATA_TYPE_INT, TDF_DATA_TYPE_FUTURE_EVENT_CLASS)) and (int(actualVal) != int(targetVal))):
-                    return False
-                elif ((dataTypeName == TDF_DATA_TYPE_BOOL) and (int(actualVal) != int(targetVal))):
-                    return False
-            ###############
-            elif (relationName == ".NEQ."):
-                if ((dataTypeName == TDF_DATA_TYPE_FLOAT) and (float(actualVal) == float(targetVal))):
-                    return False
-                elif ((dataTypeName in (TDF_DATA_TYPE_INT, TDF_DATA_TYPE_FUTURE_EVENT_CLASS)) and (int(actualVal) == int(targetVal))):
-                    return False
-            ###############
-            elif (relationName == ".LT."):
-                if ((dataTypeName == TDF_DATA_TYPE_FLOAT) and (float(actualVal) >= float(targetVal))):
-                    return False
-                elif ((dataTypeName in (TDF_DATA_TYPE_INT, TDF_DATA_TYPE_FUTURE_EVENT_CLASS)) and (int(actualVal) >= int(targetVal))):
-                    return False
-            ###############
-            elif (relationName == ".LTE."):
-                if ((dataTypeName == TDF_DATA_TYPE_FLOAT) and (float(actualVal) > float(targetVal))):
-                    return False
-                elif ((dataTypeName in (TDF_DATA_TYPE_INT, TDF_DATA_TYPE_FUTURE_EVENT_CLASS)) and (int(actualVal) > int(targetVal))):
-                    return False
-            ###############
-            elif (relationName == ".GT."):
-                if ((dataTypeName == TDF_DATA_TYPE_FLOAT) and (float(actualVal) <= float(targetVal))):
-                    return False
-                elif ((dataTypeName in (TDF_DATA_TYPE_INT, TDF_DATA_TYPE_FUTURE_EVENT_CLASS)) and (int(actualVal) <= int(targetVal))):
-                    return False
-            ###############
-            elif (relationName == ".GTE."):
-                if ((dataTypeName == TDF_DATA_TYPE_FLOAT) and (float(actualVal) < float(targetVal))):
-                    return False
-                elif ((dataTypeName in (TDF_DATA_TYPE_INT, TDF_DATA_TYPE_FUTURE_EVENT_CLASS)) and (int(actualVal) < int(targetVal))):
-                    return False
-            ###############
-            else:
+            if ((convertFunction is not None) and (not relationFunction(convertFunction(actualVal), targetVal))):
                 return False
-        # End - for propNum in range(numProperties):
+        # End - for valueName, relationFunction, targetVal, convertFunction in compiledFilter:
 
-        if (fDebug):
-            print("CheckIfCurrentTimeMeetsCriteria: targetVal does indeed match required value")
         return True
-    # End - CheckIfCurrentTimeMeetsCriteria
+    # End - CheckIfCurrentTimeMeetsCompiledFilter
+
+
+
+
+
+    #####################################################
+    #
+    # [TDFFileReader::GetReusableTimelineBuffers]
+    #
+    # Return input, result and dayNum arrays with room for at least numRows rows.
+    # These are views of arrays that the reader keeps, so every call returns the 
+    # same memory. They only grow when a timeline needs more rows than any 
+    # earlier one. The rows are not cleared, but GetDataForCurrentTimeline writes
+    # every value in each row that it returns.
+    #####################################################
+    def GetReusableTimelineBuffers(self, numRows, fAddMinibatchDimension):
+        if (fAddMinibatchDimension):
+            inputShape = (1, self.numInputValues)
+            resultShape = (1, 1)
+        else:
+            inputShape = (self.numInputValues,)
+            resultShape = (1,)
+        if (self.ConvertResultsToBools):
+            resultType = int
+        else:
+            resultType = np.float64
+
+        if ((self.reusableInputArray is None) 
+                or (len(self.reusableInputArray) < numRows)
+                or (self.reusableInputArray.shape[1:] != inputShape)
+                or (self.reusableResultArray.dtype != resultType)):
+            # Grow by at least 2x, so a run of slightly longer timelines does not
+            # reallocate each time.
+            numAllocatedRows = numRows
+            if (self.reusableInputArray is not None):
+                numAllocatedRows = max(numRows, 2 * len(self.reusableInputArray))
+            self.reusableInputArray = np.empty((numAllocatedRows,) + inputShape, dtype=TDF_INPUT_VALUE_TYPE)
+            self.reusableResultArray = np.empty((numAllocatedRows,) + resultShape, dtype=resultType)
+            self.reusableDayNumArray = np.empty((numAllocatedRows))
+        # End - if ((self.reusableInputArray is None) ....
+
+        return self.reusableInputArray[:numRows], self.reusableResultArray[:numRows], self.reusableDayNumArray[:numRows]
+    # End - GetReusableTimelineBuffers()
 
 
 
@@ -4121,6 +4344,10 @@ class TDFFileReader():
     #
     #   - The third is an array of dayNumbers for each results. This is an Nx1 array.
     #
+    # If fReuseBuffers is True, then the returned arrays are views of buffers that
+    # the reader keeps, so they are only valid until the next call. Otherwise, each
+    # call allocates new arrays.
+    #
     # This method is NOT part of DataSet - it is a special iterator
     #####################################################
     def GetDataForCurrentTimeline(self, 
@@ -4129,10 +4356,15 @@ class TDFFileReader():
                                 requirePropertyValueList,
                                 fAddMinibatchDimension,
                                 fNeedTrueResultForEveryInput,
-                                numMissingInstances):
+                                numMissingInstances,
+                                fReuseBuffers=False):
         fDebug = False
         numRequireProperties = len(requirePropertyNameList)
         matchingRangeDay = -1
+        if (numRequireProperties > 0):
+            compiledFilter = self.GetCompiledValueFilter(requirePropertyRelationList, 
+                                                        requirePropertyNameList, 
+                                                        requirePropertyValueList)
 
         if (fDebug):
             print("GetDataForCurrentTimeline, start")
@@ -4166,19 +4398,23 @@ class TDFFileReader():
         # Make a vector big enough to hold all possible labs.
         # We will likely not need all of this space, but there is enough
         # room for the most extreme case.
-        if (fAddMinibatchDimension):
-            inputArray = np.zeros((maxNumCompleteLabSets, 1, self.numInputValues))
+        if (fReuseBuffers):
+            inputArray, resultArray, dayNumArray = self.GetReusableTimelineBuffers(maxNumCompleteLabSets, 
+                                                                                fAddMinibatchDimension)
+        elif (fAddMinibatchDimension):
+            inputArray = np.zeros((maxNumCompleteLabSets, 1, self.numInputValues), dtype=TDF_INPUT_VALUE_TYPE)
             if (self.ConvertResultsToBools):
                 resultArray = np.zeros((maxNumCompleteLabSets, 1, 1), dtype=int)
             else:
                 resultArray = np.zeros((maxNumCompleteLabSets, 1, 1))
         else:
-            inputArray = np.zeros((maxNumCompleteLabSets, self.numInputValues))
+            inputArray = np.zeros((maxNumCompleteLabSets, self.numInputValues), dtype=TDF_INPUT_VALUE_TYPE)
             if (self.ConvertResultsToBools):
                 resultArray = np.zeros((maxNumCompleteLabSets, 1), dtype=int)
             else:
                 resultArray = np.zeros((maxNumCompleteLabSets, 1))
-        dayNumArray = np.zeros((maxNumCompleteLabSets))
+        if (not fReuseBuffers):
+            dayNumArray = np.zeros((maxNumCompleteLabSets))
 
 
         # Initialize all time function objects
@@ -4205,10 +4441,7 @@ class TDFFileReader():
             # of getting properties only to throw them away. On the other hand, we may check
             # whether some timeline points are useful even if they do not containt he desired data.
             if (numRequireProperties > 0):
-                fOKToUseTimepoint = self.CheckIfCurrentTimeMeetsCriteria(requirePropertyRelationList,
-                                                        requirePropertyNameList,
-                                                        requirePropertyValueList,
-                                                        timelineEntry)
+                fOKToUseTimepoint = self.CheckIfCurrentTimeMeetsCompiledFilter(compiledFilter, timelineEntry)
                 # We may skip some entries that do not meet some criteria. For example, we may want to see
                 # all values of X when y >= 12. Skip this entry if it does not meet the criteria.
                 if (not fOKToUseTimepoint):
@@ -4221,17 +4454,15 @@ class TDFFileReader():
             if (fDebug):
                 print("GetDataForCurrentTimeline. fOKToUseTimepoint=True. numRequireProperties=" + str(numRequireProperties))
 
-            #<><><><>
-            matchingRangeDay = -1
-            foundResult, result, matchingRangeDay = self.GetNamedValueFromTimeline(self.resultValueName, 
-                                                                self.resultValueOffsetStartRange, 
-                                                                self.resultValueOffsetStopRange, 
-                                                                self.resultValueOffsetRangeOption,
-                                                                None, timeLineIndex, matchingRangeDay)
-            #<><><><>
-
             currentDayNum = timelineEntry['TimeDays']
 
+            # Get the row we will fill in once, rather than indexing down through 
+            # the whole array for every value.
+            if (fAddMinibatchDimension):
+                inputRow = inputArray[numReturnedDataSets, 0]
+            else:
+                inputRow = inputArray[numReturnedDataSets]
+
             # Find the labs we are looking for.
             # There are often lots of labs, but this only return labs that are relevant.
             foundAllInputs = True
@@ -4276,13 +4507,11 @@ class TDFFileReader():
 
                 # Some values, like meds, may be zero, and are still considered for short stretches. For example, you
                 # can skip a day or tweo, but not long periods of time.
-                fIgnoreRunOfZeroValues = False
                 if ((foundIt) and (self.varIndexThatMustBeNonZero == valueIndex) and (self.maxZeroDays > 0)):
                     if (result == 0):
                         if ((lastNonZeroDayIndex < 0) 
                                 or ((timelineEntry['TimeDays'] - lastNonZeroDayIndex) > self.maxZeroDays)):
                             foundIt = False
-                            fIgnoreRunOfZeroValues = True
                             if (fDebug):
                                 print("Ignore a med that is 0 for too long or has never been non-zero")
                                 print("   valueName = " + str(valueName))
@@ -4298,15 +4527,6 @@ class TDFFileReader():
                 # End - if ((foundIt) and (varIndexThatMustBeNonZero = valueIndex)):
 
                 if (not foundIt):
-                    #<><><><>
-                    if ((False) and (foundResult)):
-                        print("GetDataForCurrentTimeline. Could not find valueName=" + str(valueName))
-                        print("     BUT! foundResult=" + str(foundResult) + ", fIgnoreRunOfZeroValues=" + str(fIgnoreRunOfZeroValues))
-                        print("     timelineEntry=" + str(timelineEntry))
-                        #print("\nBAIL DUDE!!!!!\n")
-                        #raise Exception()
-                    #<><><><>
-
                     # Note, foundIt may still be False even for values that default to 0, like drug levels, if we cannot find any day with
                     # any values in the specified range. This is not a bug. Do not freak out. 
                     if (fDebug):
@@ -4322,10 +4542,7 @@ class TDFFileReader():
                 # End - if (not foundIt):
 
                 try:
-                    if (fAddMinibatchDimension):
-                        inputArray[numReturnedDataSets][0][valueIndex] = result
-                    else:
-                        inputArray[numReturnedDataSets][valueIndex] = result
+                    inputRow[valueIndex] = result
                 except Exception:
                     print("GetDataForCurrentTimeline. EXCEPTION when writing one value")
                     print("     valueName=" + valueName)
@@ -4382,10 +4599,10 @@ class TDFFileReader():
             # identical, it is still useful, because it tells the system that another time period passed.
             if ((fNeedTrueResultForEveryInput) and (numReturnedDataSets > 0)):
                 if (fAddMinibatchDimension):
-                    compareVector = inputArray[numReturnedDataSets][0][:] != inputArray[numReturnedDataSets - 1][0][:]
+                    compareVector = inputRow != inputArray[numReturnedDataSets - 1, 0]
                 else:
-                    compareVector = inputArray[numReturnedDataSets][:] != inputArray[numReturnedDataSets - 1][:]
-                foundUniqueInputVector = any(compareVector)
+                    compareVector = inputRow != inputArray[numReturnedDataSets - 1]
+                foundUniqueInputVector = compareVector.any()
                 # If the inputs are identical, we may still want to include this item if the outputs are identical
                 if (not foundUniqueInputVector):
                     if (fAddMinibatchDimension):
@@ -4442,6 +4659,93 @@ class TDFFileReader():
 
 
 
+
+    #####################################################
+    #
+    # [TDFFileReader::GetDataForAllTimelinesInPartition]
+    #
+    # This reads every timeline that starts in the partition, and returns
+    # the data for all of them stacked into one set of arrays:
+    #   numTimelines - The number of timelines we read, including ones with no data
+    #   numDataPoints - The total number of rows in the arrays
+    #   inputArray, resultArray, dayNumArray - Like GetDataForCurrentTimeline, but
+    #           the rows of each timeline follow the rows of the previous timeline.
+    #   timelineLengthArray - The number of rows for each timeline that returned data, 
+    #           in file order. Use this to find where each timeline starts.
+    #   fEOF - True if we hit the end of the file
+    #
+    # The arrays are None if no timeline in the partition had any data.
+    #####################################################
+    def GetDataForAllTimelinesInPartition(self, startPartition, stopPartition,
+                                        requirePropertyRelationList,
+                                        requirePropertyNameList,
+                                        requirePropertyValueList,
+                                        fAddMinibatchDimension,
+                                        fNeedTrueResultForEveryInput):
+        partitionInputArray = None
+        partitionResultArray = None
+        partitionDayNumArray = None
+        numDataPoints = 0
+        timelineLengthList = []
+        numTimelines = 0
+
+        # Find where all of the timelines are first, and then read each one at its known position.
+        timelinePositionList, fEOF = self.FindAllTimelinesInPartition(startPartition, stopPartition)
+        for timelinePosition in timelinePositionList:
+            fFoundTimeline, _, _, _ = self.GotoNextTimelineInPartition(timelinePosition["start"], timelinePosition["stop"], 
+                                                                    -1, False)
+            if (not fFoundTimeline):
+                break
+
+            numReturnedDataSets, inputArray, resultArray, dayNumArray = self.GetDataForCurrentTimeline(requirePropertyRelationList,
+                                                                                    requirePropertyNameList,
+                                                                                    requirePropertyValueList,
+                                                                                    fAddMinibatchDimension,
+                                                                                    fNeedTrueResultForEveryInput,
+                                                                                    None,
+                                                                                    fReuseBuffers=True)
+            if (numReturnedDataSets >= 1):
+                # Copy the timeline onto the end of the partition arrays. When they are
+                # full, double their size, so the total cost of copying stays linear.
+                stopRow = numDataPoints + numReturnedDataSets
+                if ((partitionInputArray is None) or (stopRow > len(partitionInputArray))):
+                    numAllocatedRows = stopRow
+                    if (partitionInputArray is not None):
+                        numAllocatedRows = max(stopRow, 2 * len(partitionInputArray))
+                    newInputArray = np.empty((numAllocatedRows,) + inputArray.shape[1:], dtype=inputArray.dtype)
+                    newResultArray = np.empty((numAllocatedRows,) + resultArray.shape[1:], dtype=resultArray.dtype)
+                    newDayNumArray = np.empty((numAllocatedRows), dtype=dayNumArray.dtype)
+                    if (partitionInputArray is not None):
+                        newInputArray[:numDataPoints] = partitionInputArray[:numDataPoints]
+                        newResultArray[:numDataPoints] = partitionResultArray[:numDataPoints]
+                        newDayNumArray[:numDataPoints] = partitionDayNumArray[:numDataPoints]
+                    partitionInputArray = newInputArray
+                    partitionResultArray = newResultArray
+                    partitionDayNumArray = newDayNumArray
+                # End - if ((partitionInputArray is None) or (stopRow > len(partitionInputArray))):
+
+                partitionInputArray[numDataPoints:stopRow] = inputArray
+                partitionResultArray[numDataPoints:stopRow] = resultArray
+                partitionDayNumArray[numDataPoints:stopRow] = dayNumArray
+                numDataPoints = stopRow
+                timelineLengthList.append(numReturnedDataSets)
+
+            numTimelines += 1
+        # End - for timelinePosition in timelinePositionList:
+
+        if (numDataPoints == 0):
+            return numTimelines, 0, None, None, None, None, fEOF
+
+        timelineLengthArray = np.array(timelineLengthList, dtype=np.int64)
+
+        return numTimelines, numDataPoints, partitionInputArray[:numDataPoints], partitionResultArray[:numDataPoints], \
+                    partitionDayNumArray[:numDataPoints], timelineLengthArray, fEOF
+    # End - GetDataForAllTimelinesInPartition()
+
+
+
+
+
     #####################################################
     #
     # [TDFFileReader::GetSyncedPairOfValueListsForCurrentTimeline]
@@ -5174,7 +5478,7 @@ def TDF_ParseUserValueListString(inputNameListStr, userProvidedDataStr, fParseIn
         numVectors = 1
 
     # Make a vector big enough to hold the labs.
-    inputArray = np.empty((numVectors, 1, numValsInEachVector))
+    inputArray = np.empty((numVectors, 1, numValsInEachVector), dtype=TDF_INPUT_VALUE_TYPE)
 
     # Parse the string for each vector separately, one in each loop iteration
     # If this is a single input vector, then numVectors = 1 and this will only iterate once.
@@ -5308,6 +5612,58 @@ def TDF_GetNamesForAllVariables():
 
 
 
+################################################################################
+#
+# [TDF_CompileValueFilter]
+#
+# Turn the parallel lists from MLJob::GetFilterProperties into a list of
+#    (valueName, relationFunction, targetVal, convertFunction)
+# The relation names, the target value strings and the data type of each value are 
+# all looked up here once. Then checking a timeline entry is just a dictionary lookup
+# and one comparison for each property.
+#    relationFunction is None if the property can never match.
+#    convertFunction is None if any valid value matches.
+################################################################################
+g_FilterRelationFunctions = {".EQ.": operator.eq, ".NEQ.": operator.ne, 
+                            ".LT.": operator.lt, ".LTE.": operator.le,
+                            ".GT.": operator.gt, ".GTE.": operator.ge}
+
+def TDF_CompileValueFilter(propertyRelationList, propertyNameList, propertyValueList):
+    compiledFilter = []
+
+    for propNum, valueName in enumerate(propertyNameList):
+        relationName = propertyRelationList[propNum]
+        relationFunction = g_FilterRelationFunctions.get(relationName, None)
+        targetVal = float(propertyValueList[propNum])
+
+        convertFunction = None
+        if (valueName not in g_LabValueInfo):
+            print("Error! TDF_CompileValueFilter found undefined lab name: " + valueName)
+            relationFunction = None
+        else:
+            dataTypeName = g_LabValueInfo[valueName]['dataType']
+            if (dataTypeName == TDF_DATA_TYPE_FLOAT):
+                convertFunction = float
+            elif (dataTypeName in (TDF_DATA_TYPE_INT, TDF_DATA_TYPE_FUTURE_EVENT_CLASS)):
+                convertFunction = int
+            # Bools are only compared for equality.
+            elif ((dataTypeName == TDF_DATA_TYPE_BOOL) and (relationName == ".EQ.")):
+                convertFunction = int
+        # End - if (valueName not in g_LabValueInfo):
+
+        if (convertFunction is not None):
+            targetVal = convertFunction(targetVal)
+
+        compiledFilter.append((valueName, relationFunction, targetVal, convertFunction))
+    # End - for propNum, valueName in enumerate(propertyNameList):
+
+    return compiledFilter
+# End - TDF_CompileValueFilter
+
+
+
+
+
 ################################################################################
 # A public procedure to create the DataLoader
 ################################################################################
@@ -0,0 +1,114 @@
+################################################################################
+#
+# Tests for checking and repairing the values in a linear unit.
+#
+# MLEngine_FullCheckLinearUnit must report a NaN or infinite value in either the
+# weights or the bias. MLEngine_RepairLinearUnit_InPlace must replace them, in both
+# the weights and the bias. TDF_INVALID_VALUE is a legal value and is never 
+# reported or changed.
+################################################################################
+import os
+import sys
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("sklearn")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import tdfTools as tdf
+import mlEngine as mlEngine
+
+NUM_INPUTS = 4
+NUM_OUTPUTS = 3
+
+
+################################################################################
+#
+# [MakeLinearUnit]
+#
+# Make a linear unit with healthy values, and then put badValue at one place in
+# either the weights or the bias.
+################################################################################
+def MakeLinearUnit(fBadValueInBias, badValue):
+    linearUnit = torch.nn.Linear(NUM_INPUTS, NUM_OUTPUTS)
+    with torch.no_grad():
+        linearUnit.weight.fill_(0.5)
+        linearUnit.bias.fill_(-0.25)
+        if (badValue is not None):
+            if (fBadValueInBias):
+                linearUnit.bias[1] = badValue
+            else:
+                linearUnit.weight[2][1] = badValue
+    return linearUnit
+# End - MakeLinearUnit
+
+
+################################################################################
+#
+# [FullCheck]
+#
+################################################################################
+def FullCheck(linearUnit):
+    weightMatrix, biasVector = mlEngine.MLEngine_GetLinearUnitArrays(linearUnit)
+    fValid, _, _, _, _, _ = mlEngine.MLEngine_FullCheckLinearUnit(weightMatrix, biasVector, "TestUnit")
+    return fValid
+# End - FullCheck
+
+
+def test_FullCheckAcceptsHealthyValues():
+    assert FullCheck(MakeLinearUnit(False, None))
+
+def test_FullCheckAcceptsInvalidValueMarker():
+    assert FullCheck(MakeLinearUnit(False, tdf.TDF_INVALID_VALUE))
+    assert FullCheck(MakeLinearUnit(True, tdf.TDF_INVALID_VALUE))
+
+@pytest.mark.parametrize("fBadValueInBias", [False, True])
+@pytest.mark.parametrize("badValue", [math.nan, math.inf, -math.inf])
+def test_FullCheckFindsNaNAndInf(fBadValueInBias, badValue):
+    assert not FullCheck(MakeLinearUnit(fBadValueInBias, badValue))
+
+
+
+################################################################################
+#
+# [RepairAndGetBadValue]
+#
+# Repair a linear unit with badValue in it, and return the value that replaced it.
+################################################################################
+def RepairAndGetBadValue(fBadValueInBias, badValue):
+    linearUnit = MakeLinearUnit(fBadValueInBias, badValue)
+    mlEngine.MLEngine_RepairLinearUnit_InPlace(linearUnit)
+
+    # Every other value was healthy, so it must not have changed.
+    if (fBadValueInBias):
+        assert float(linearUnit.weight.min()) == 0.5
+        assert float(linearUnit.weight.max()) == 0.5
+        return float(linearUnit.bias[1])
+    assert float(linearUnit.bias.min()) == -0.25
+    assert float(linearUnit.bias.max()) == -0.25
+    return float(linearUnit.weight[2][1])
+# End - RepairAndGetBadValue
+
+
+@pytest.mark.parametrize("fBadValueInBias", [False, True])
+@pytest.mark.parametrize("badValue, expectedValue", [
+    (math.nan, mlEngine.LARGE_REASONABLE_MATRIX_VALUE),
+    (math.inf, mlEngine.LARGE_REASONABLE_MATRIX_VALUE),
+    (-math.inf, -mlEngine.LARGE_REASONABLE_MATRIX_VALUE),
+    (mlEngine.MIN_VALID_MATRIX_VALUE / 10, 0.0)])
+def test_RepairReplacesBadValues(fBadValueInBias, badValue, expectedValue):
+    assert RepairAndGetBadValue(fBadValueInBias, badValue) == pytest.approx(expectedValue)
+
+@pytest.mark.parametrize("fBadValueInBias", [False, True])
+def test_RepairKeepsInvalidValueMarker(fBadValueInBias):
+    assert RepairAndGetBadValue(fBadValueInBias, tdf.TDF_INVALID_VALUE) == tdf.TDF_INVALID_VALUE
+
+@pytest.mark.parametrize("fBadValueInBias", [False, True])
+@pytest.mark.parametrize("badValue", [math.nan, math.inf, -math.inf])
+def test_RepairedUnitPassesFullCheck(fBadValueInBias, badValue):
+    linearUnit = MakeLinearUnit(fBadValueInBias, badValue)
+    mlEngine.MLEngine_RepairLinearUnit_InPlace(linearUnit)
+    assert FullCheck(linearUnit)
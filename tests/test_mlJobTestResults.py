@@ -0,0 +1,113 @@
+################################################################################
+#
+# Tests for merging the test results of several test workers.
+#
+# Each worker process is reused for several partitions. It calls StartTesting 
+# before each partition, records the results, and returns GetRawTestResults. 
+# The control process adds those with AddRawTestResults. The merged results 
+# must be the same as testing every partition in a single process.
+################################################################################
+import os
+import sys
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("sklearn")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import tdfTools as tdf
+import mlJob as mlJob
+
+NUM_WORKERS = 2
+NUM_PARTITIONS = 5
+NUM_SAMPLES_PER_PARTITION = 20
+
+
+################################################################################
+#
+# [MakeTestResults]
+#
+################################################################################
+def MakeTestResults(resultValueType, fIsLogistic):
+    testResults = mlJob.MLJobTestResults()
+    if (resultValueType == tdf.TDF_DATA_TYPE_BOOL):
+        testResults.SetGlobalResultInfo(resultValueType, 2, 0, 1, 1, fIsLogistic, 0.5)
+    else:
+        testResults.SetGlobalResultInfo(resultValueType, mlJob.ML_JOB_NUM_NUMERIC_VALUE_BUCKETS, 
+                                        0, 100, 100 / mlJob.ML_JOB_NUM_NUMERIC_VALUE_BUCKETS, False, 0)
+    testResults.StartTesting()
+    return testResults
+# End - MakeTestResults
+
+
+################################################################################
+#
+# [MakePartitionSamples]
+#
+################################################################################
+def MakePartitionSamples(resultValueType):
+    randomGenerator = random.Random(17)
+    partitionList = []
+    for _ in range(NUM_PARTITIONS):
+        sampleList = []
+        for _ in range(NUM_SAMPLES_PER_PARTITION):
+            if (resultValueType == tdf.TDF_DATA_TYPE_BOOL):
+                sampleList.append((randomGenerator.randint(0, 1), randomGenerator.random()))
+            else:
+                sampleList.append((randomGenerator.uniform(1, 99), randomGenerator.uniform(1, 99)))
+        partitionList.append(sampleList)
+    return partitionList
+# End - MakePartitionSamples
+
+
+################################################################################
+#
+# [CheckParallelMatchesSerial]
+#
+################################################################################
+def CheckParallelMatchesSerial(resultValueType, fIsLogistic):
+    partitionList = MakePartitionSamples(resultValueType)
+
+    serialResults = MakeTestResults(resultValueType, fIsLogistic)
+    for sampleList in partitionList:
+        for actualValue, predictedValue in sampleList:
+            serialResults.RecordTestingResult(actualValue, predictedValue)
+
+    # Each worker starts with totals left over from an earlier run, like a job read from XML.
+    workerList = []
+    for _ in range(NUM_WORKERS):
+        workerResults = MakeTestResults(resultValueType, fIsLogistic)
+        workerResults.TotalAbsoluteError = 1000.0
+        workerResults.NumPredictions = 1000
+        workerList.append(workerResults)
+
+    mergedResults = MakeTestResults(resultValueType, fIsLogistic)
+    for partitionNum, sampleList in enumerate(partitionList):
+        workerResults = workerList[partitionNum % NUM_WORKERS]
+        workerResults.StartTesting()
+        for actualValue, predictedValue in sampleList:
+            workerResults.RecordTestingResult(actualValue, predictedValue)
+        mergedResults.AddRawTestResults(workerResults.GetRawTestResults())
+    # End - for partitionNum, sampleList in enumerate(partitionList):
+
+    assert mergedResults.NumSamplesTested == serialResults.NumSamplesTested
+    assert mergedResults.TestResults == serialResults.TestResults
+    assert mergedResults.NumPredictions == serialResults.NumPredictions
+    assert mergedResults.TotalAbsoluteError == pytest.approx(serialResults.TotalAbsoluteError)
+    assert sorted(mergedResults.AllPredictions) == sorted(serialResults.AllPredictions)
+    assert sorted(mergedResults.AllTrueResults) == sorted(serialResults.AllTrueResults)
+    assert mergedResults.TestNumItemsPerClass == serialResults.TestNumItemsPerClass
+    assert mergedResults.TestNumPredictionsPerClass == serialResults.TestNumPredictionsPerClass
+    assert mergedResults.TestNumCorrectPerClass == serialResults.TestNumCorrectPerClass
+    assert (sorted(zip(mergedResults.LogisticResultsTrueValueList, mergedResults.LogisticResultsPredictedProbabilityList))
+            == sorted(zip(serialResults.LogisticResultsTrueValueList, serialResults.LogisticResultsPredictedProbabilityList)))
+# End - CheckParallelMatchesSerial
+
+
+def test_ParallelFloatResultsMatchSerial():
+    CheckParallelMatchesSerial(tdf.TDF_DATA_TYPE_FLOAT, False)
+
+def test_ParallelLogisticResultsMatchSerial():
+    CheckParallelMatchesSerial(tdf.TDF_DATA_TYPE_BOOL, True)